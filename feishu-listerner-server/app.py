@@ -1,27 +1,33 @@
 import os
+import sys
 import json
+import gzip
+import time
+import atexit
+import signal
 import logging
 import hashlib
+import hmac
+import inspect
+import tempfile
+import threading
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple, FrozenSet
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from werkzeug.exceptions import BadRequest, Unauthorized
 
 from models import DatabaseManager
+from ingest import IngestQueue
+from dedup import DedupCache
+from retention import RetentionJob
+from log_setup import setup_logging, logging_stats, on_records_dropped
+from metrics import Registry, CONTENT_TYPE, instrument
+from shards import Shard, ShardSet, load_app_tokens, shard_db_path
+from prefork import WRITE_METHODS, WriterClient, run_master, serve_worker
+from ratelimit import RateLimiter
 
-# 配置日志
-def setup_logging():
-    log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
-    logging.basicConfig(
-        level=getattr(logging, log_level),
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('app.log', encoding='utf-8'),
-            logging.StreamHandler()
-        ]
-    )
-
+# 配置日志（后台线程写入，见 log_setup.py）
 setup_logging()
 logger = logging.getLogger(__name__)
 
@@ -33,8 +39,262 @@ VERIFICATION_CODE = os.getenv('VERIFICATION_CODE', '')
 PORT = int(os.getenv('PORT', 3000))
 DB_PATH = os.getenv('DB_PATH', './feishu_messages.db')
 
-# 初始化数据库
-db = DatabaseManager(DB_PATH)
+# 多机器人：{"app_id": "verification_token"}，每个机器人一个分片数据库（DB_PATH 加 .<app_id> 后缀）；
+# 为空时为单机器人模式，使用 FEISHU_VERIFICATION_TOKEN 和 DB_PATH
+FEISHU_APPS = load_app_tokens(os.getenv('FEISHU_APPS', ''))
+
+# 数据库连接池配置
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL')
+DB_BUSY_TIMEOUT = int(os.getenv('DB_BUSY_TIMEOUT', 5000))
+DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', -20000))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 268435456))
+
+# raw_data 的 zlib 压缩级别（1-9），0 表示明文存储
+RAW_DATA_COMPRESS_LEVEL = int(os.getenv('RAW_DATA_COMPRESS_LEVEL', 6))
+
+# 进程内指标，GET /metrics 以 Prometheus 文本格式输出；METRICS_TOKEN 非空时需携带 Bearer 令牌
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+metrics = Registry()
+WEBHOOK_REQUESTS = metrics.counter(
+    'feishu_webhook_requests_total', '飞书事件回调请求数', ('event_type', 'result'))
+WEBHOOK_DURATION = metrics.histogram(
+    'feishu_webhook_duration_seconds', '飞书事件回调处理耗时（秒）')
+DUPLICATE_EVENTS = metrics.counter(
+    'feishu_duplicate_events_total', '命中去重缓存、直接应答的重复事件数')
+DB_DURATION = metrics.histogram(
+    'feishu_db_operation_duration_seconds', 'DatabaseManager 方法耗时（秒）', ('method',))
+DB_ERRORS = metrics.counter(
+    'feishu_db_operation_errors_total', 'DatabaseManager 方法抛出异常的次数', ('method',))
+UNPROCESSED_MESSAGES = metrics.gauge(
+    'feishu_unprocessed_messages', '未处理的接收消息数', ('app_id',))
+PENDING_OUTGOING = metrics.gauge(
+    'feishu_pending_outgoing_messages', '待发送的回复消息数', ('app_id',))
+OLDEST_UNPROCESSED_AGE = metrics.gauge(
+    'feishu_oldest_unprocessed_age_seconds', '最早一条未处理消息已等待的秒数，没有积压时为0', ('app_id',))
+DB_POOL_IN_USE = metrics.gauge(
+    'feishu_db_pool_connections_in_use', '正在使用的数据库连接数', ('app_id',))
+DB_POOL_WAITS = metrics.counter(
+    'feishu_db_pool_waits_total', '等待空闲数据库连接的次数', ('app_id',))
+LOG_RECORDS_DROPPED = metrics.counter(
+    'feishu_log_records_dropped_total', '日志队列已满丢弃的日志条数')
+INGEST_QUEUE_DEPTH = metrics.gauge(
+    'feishu_ingest_queue_depth', '写入队列中等待落库的消息数（INGEST_MODE=batch）', ('app_id',))
+DEDUP_CACHE_ENTRIES = metrics.gauge(
+    'feishu_dedup_cache_entries', '去重缓存中的条目数')
+RATE_LIMITED = metrics.counter(
+    'feishu_webhook_rate_limited_total', '被限流的 webhook 消息事件数', ('app_id', 'scope'))
+RATE_LIMIT_BUCKETS = metrics.gauge(
+    'feishu_rate_limit_buckets', '限流器当前的令牌桶数量', ('app_id', 'scope'))
+RETENTION_DELETED = metrics.counter(
+    'feishu_retention_deleted_total', '归档清理删除的记录数', ('app_id', 'table'))
+
+# 计数器在事件发生处累加（连接池等待、归档删除、限流、日志丢弃），不在抓取时从统计快照赋值
+on_records_dropped(LOG_RECORDS_DROPPED.labels().inc)
+
+# 长轮询等待、连接获取等方法不是数据库操作，不计时
+DB_UNTIMED_METHODS = {
+    'get_connection', 'message_version', 'wait_for_new_messages', 'add_message_listener',
+    'pool_stats', 'close', 'init_database',
+}
+DB_TIMED_METHODS = [name for name, _ in inspect.getmembers(DatabaseManager, inspect.isfunction)
+                    if not name.startswith('_') and name not in DB_UNTIMED_METHODS]
+
+# 消息租约默认时长（秒）
+LEASE_SECONDS = float(os.getenv('LEASE_SECONDS', 60))
+
+# 长轮询最长等待时间（秒）
+MAX_LONG_POLL_WAIT = float(os.getenv('MAX_LONG_POLL_WAIT', 30))
+
+# 消息推送流（SSE）心跳间隔（秒）
+STREAM_KEEPALIVE = float(os.getenv('STREAM_KEEPALIVE', 15))
+
+# 消息写入模式：sync 同步写库；batch 入队后由后台线程批量写库
+INGEST_MODE = os.getenv('INGEST_MODE', 'sync').lower()
+INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 10000))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 100))
+INGEST_FLUSH_MS = float(os.getenv('INGEST_FLUSH_MS', 5))
+
+# 过期消息归档清理：默认关闭，RETENTION_DAYS 设为正数后启用
+RETENTION_DAYS = float(os.getenv('RETENTION_DAYS', 0))
+RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', 3600))
+RETENTION_ARCHIVE_DIR = os.getenv('RETENTION_ARCHIVE_DIR', './archive')
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 500))
+RETENTION_BATCH_PAUSE_MS = float(os.getenv('RETENTION_BATCH_PAUSE_MS', 50))
+
+# webhook 限流（令牌桶，速率为每分钟事件数，0 表示不限；BURST 默认等于速率），全局限额按机器人计算
+RATE_LIMIT_GLOBAL = float(os.getenv('RATE_LIMIT_GLOBAL', 0))
+RATE_LIMIT_GLOBAL_BURST = float(os.getenv('RATE_LIMIT_GLOBAL_BURST', 0))
+RATE_LIMIT_SENDER = float(os.getenv('RATE_LIMIT_SENDER', 0))
+RATE_LIMIT_SENDER_BURST = float(os.getenv('RATE_LIMIT_SENDER_BURST', 0))
+RATE_LIMIT_CHAT = float(os.getenv('RATE_LIMIT_CHAT', 0))
+RATE_LIMIT_CHAT_BURST = float(os.getenv('RATE_LIMIT_CHAT_BURST', 0))
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 10000))
+# 超限事件的处理：throttle 留存但记为已处理（不投递），drop 不写库；两者都正常应答飞书
+RATE_LIMIT_ACTION = os.getenv('RATE_LIMIT_ACTION', 'throttle').lower()
+RATE_LIMIT_ENABLED = RATE_LIMIT_GLOBAL > 0 or RATE_LIMIT_SENDER > 0 or RATE_LIMIT_CHAT > 0
+
+# 响应 gzip 压缩：客户端接受 gzip 且响应体不小于 GZIP_MIN_SIZE 字节时压缩，GZIP_LEVEL=0 表示关闭
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 6))
+GZIP_MIN_SIZE = int(os.getenv('GZIP_MIN_SIZE', 1024))
+
+# 多进程模式：WORKERS > 1 时主进程作为唯一写进程，HTTP 请求由 WORKERS 个 worker 进程处理（见 prefork.py）
+WORKERS = int(os.getenv('WORKERS', 1))
+WRITER_SOCKET = os.getenv('WRITER_SOCKET') or os.path.join(tempfile.gettempdir(), f'feishu-writer-{os.getpid()}.sock')
+
+# 多进程模式下由主进程启动的 worker：数据库只读，写操作转发给主进程
+writer_client = None
+if os.getenv('PREFORK_ROLE') == 'worker':
+    writer_client = WriterClient(os.environ['PREFORK_SOCKET'], bytes.fromhex(os.environ['PREFORK_AUTHKEY']))
+
+# 拉取接口 fields 参数可选的字段，app_id 仅在多机器人模式下存在
+INCOMING_FIELDS = frozenset([c.strip() for c in DatabaseManager.INCOMING_COLUMNS.split(',')] + ['raw_data', 'app_id'])
+OUTGOING_FIELDS = frozenset(['id', 'timestamp', 'recipient_id', 'content', 'message_type', 'attachments',
+                             'status', 'sent_at', 'app_id'])
+
+
+def create_rate_limiter() -> Optional[RateLimiter]:
+    """按配置创建 webhook 限流器，未配置任何限额时返回 None"""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    return RateLimiter(
+        global_rate=RATE_LIMIT_GLOBAL,
+        global_burst=RATE_LIMIT_GLOBAL_BURST,
+        sender_rate=RATE_LIMIT_SENDER,
+        sender_burst=RATE_LIMIT_SENDER_BURST,
+        chat_rate=RATE_LIMIT_CHAT,
+        chat_burst=RATE_LIMIT_CHAT_BURST,
+        max_keys=RATE_LIMIT_MAX_KEYS
+    )
+
+
+def create_shard(app_id: str, token: str, db_path: str) -> Shard:
+    """创建一个机器人的分片：数据库、写入队列（batch 模式）、归档清理任务和限流器"""
+    shard_db = DatabaseManager(
+        db_path,
+        pool_size=DB_POOL_SIZE,
+        pool_timeout=DB_POOL_TIMEOUT,
+        synchronous=DB_SYNCHRONOUS,
+        busy_timeout=DB_BUSY_TIMEOUT,
+        cache_size=DB_CACHE_SIZE,
+        mmap_size=DB_MMAP_SIZE,
+        raw_data_level=RAW_DATA_COMPRESS_LEVEL,
+        on_pool_wait=DB_POOL_WAITS.labels(app_id).inc,
+        # 多进程模式下表结构由主进程（写进程）在启动 worker 之前创建
+        init_schema=writer_client is None
+    )
+    if writer_client:
+        # worker 进程：写入队列、归档清理任务和限流器都在主进程中（限额在各 worker 间共享），这里只持有代理
+        shard_db = writer_client.proxy(app_id, 'db', local=shard_db)
+        # 写方法在主进程中计时，worker 只对本地执行的读方法计时，汇总时不会重复计数
+        instrument(shard_db, [name for name in DB_TIMED_METHODS if name not in WRITE_METHODS['db']],
+                   DB_DURATION, DB_ERRORS)
+        return Shard(app_id, token, shard_db,
+                     writer_client.proxy(app_id, 'ingest_queue') if INGEST_MODE == 'batch' else None,
+                     writer_client.proxy(app_id, 'retention_job') if RETENTION_DAYS > 0 else None,
+                     writer_client.proxy(app_id, 'rate_limiter') if RATE_LIMIT_ENABLED else None)
+    instrument(shard_db, DB_TIMED_METHODS, DB_DURATION, DB_ERRORS)
+
+    shard_queue = None
+    if INGEST_MODE == 'batch':
+        shard_queue = IngestQueue(
+            shard_db,
+            max_size=INGEST_QUEUE_SIZE,
+            batch_size=INGEST_BATCH_SIZE,
+            flush_interval_ms=INGEST_FLUSH_MS
+        )
+        shard_queue.start()
+
+    shard_retention = None
+    if RETENTION_DAYS > 0:
+        # 每个机器人归档到各自的子目录，避免多个清理线程追加同一个归档文件
+        archive_dir = os.path.join(RETENTION_ARCHIVE_DIR, app_id) if RETENTION_ARCHIVE_DIR and app_id \
+            else RETENTION_ARCHIVE_DIR
+        shard_retention = RetentionJob(
+            shard_db,
+            days=RETENTION_DAYS,
+            interval=RETENTION_INTERVAL,
+            archive_dir=archive_dir,
+            batch_size=RETENTION_BATCH_SIZE,
+            batch_pause_ms=RETENTION_BATCH_PAUSE_MS,
+            on_deleted=lambda table, deleted: RETENTION_DELETED.labels(app_id, table).inc(deleted)
+        )
+        shard_retention.start()
+
+    return Shard(app_id, token, shard_db, shard_queue, shard_retention, create_rate_limiter())
+
+
+# 初始化数据库分片
+shards = ShardSet()
+if FEISHU_APPS:
+    for _app_id, _token in FEISHU_APPS.items():
+        shards.add(create_shard(_app_id, _token, shard_db_path(DB_PATH, _app_id)))
+else:
+    shards.add(create_shard('', FEISHU_VERIFICATION_TOKEN, DB_PATH))
+
+if writer_client:
+    # 主进程写入新消息后广播通知，唤醒本进程内的长轮询与推送流；主进程退出时 worker 随之退出；
+    # 主进程汇总 /metrics 时在同一条连接上索取本进程的指标快照
+    writer_client.subscribe(lambda app_id: shards.get(app_id).db.notify_new_messages(),
+                            lambda: os.kill(os.getpid(), signal.SIGTERM),
+                            lambda: metrics.snapshot())
+
+# 单机器人模式下的数据库、写入队列和归档清理任务（多机器人模式下为第一个机器人的分片）
+db = shards.default.db
+ingest_queue = shards.default.ingest_queue
+retention_job = shards.default.retention_job
+
+
+# 去重缓存：最近处理过的 message_id / event_id，DEDUP_CACHE_SIZE=0 表示关闭
+DEDUP_CACHE_SIZE = int(os.getenv('DEDUP_CACHE_SIZE', 50000))
+DEDUP_TTL = float(os.getenv('DEDUP_TTL', 43200))
+
+dedup_cache = None
+if DEDUP_CACHE_SIZE > 0 and writer_client:
+    # 多进程模式下去重缓存只在写进程中，各 worker 收到的重推事件共用同一份记录
+    dedup_cache = writer_client.proxy('', 'dedup_cache')
+elif DEDUP_CACHE_SIZE > 0:
+    dedup_cache = DedupCache(max_size=DEDUP_CACHE_SIZE, ttl=DEDUP_TTL)
+    for _shard in shards:
+        dedup_cache.warm(_shard.db.get_recent_message_ids(DEDUP_CACHE_SIZE))
+
+
+def collect_metrics():
+    """抓取前刷新积压、队列深度等需要现算的指标"""
+    for shard in shards:
+        DB_POOL_IN_USE.labels(shard.app_id).set(shard.db.pool_stats()['in_use'])
+        if writer_client:
+            # worker 只导出本进程的连接池；积压、写入队列、限流器和去重缓存由主进程统计
+            continue
+        try:
+            backlog = shard.db.backlog_stats()
+            UNPROCESSED_MESSAGES.labels(shard.app_id).set(backlog['unprocessed'])
+            PENDING_OUTGOING.labels(shard.app_id).set(backlog['pending_outgoing'])
+            OLDEST_UNPROCESSED_AGE.labels(shard.app_id).set(backlog['oldest_unprocessed_age'])
+        except Exception as e:
+            logger.error("统计消息积压失败: %s", e)
+
+        if shard.ingest_queue:
+            INGEST_QUEUE_DEPTH.labels(shard.app_id).set(shard.ingest_queue.stats()['depth'])
+        if shard.rate_limiter:
+            for scope, buckets in shard.rate_limiter.stats()['buckets'].items():
+                RATE_LIMIT_BUCKETS.labels(shard.app_id, scope).set(buckets)
+
+    if dedup_cache and not writer_client:
+        DEDUP_CACHE_ENTRIES.set(dedup_cache.stats()['size'])
+
+
+metrics.add_collector(collect_metrics)
+
+
+def shutdown():
+    """进程退出时停止清理任务、刷新写入队列并关闭连接池"""
+    shards.stop()
+
+
+atexit.register(shutdown)
 
 
 def verify_request():
@@ -45,6 +305,290 @@ def verify_request():
         raise Unauthorized("Invalid verification code")
 
 
+def metrics_authorized(authorization: Optional[str]) -> bool:
+    """校验 /metrics 的 Authorization 头，未配置 METRICS_TOKEN 时不校验"""
+    if not METRICS_TOKEN:
+        return True
+    return hmac.compare_digest(authorization or '', f'Bearer {METRICS_TOKEN}')
+
+
+def parse_id_list(data: Dict[str, Any]) -> Optional[list]:
+    """从请求体中解析 ids 列表，格式不正确时返回None"""
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        return None
+    return ids
+
+
+def decode_attachments(messages: list) -> list:
+    """将attachments字段从JSON字符串转换为对象"""
+    for msg in messages:
+        if msg.get('attachments'):
+            try:
+                msg['attachments'] = json.loads(msg['attachments'])
+            except:
+                pass
+    return messages
+
+
+def parse_fields(spec, allowed: FrozenSet[str]) -> Tuple[Optional[FrozenSet[str]], Optional[str]]:
+    """
+    解析 fields 参数（逗号分隔的字符串或字符串列表），返回 (字段集合, 错误信息)
+    未指定时字段集合为 None，返回全部字段（含 raw_data，兼容旧客户端）；
+    "*" 表示除 raw_data 外的全部字段，raw_data 只有显式列出时才返回；id 总是返回
+    """
+    if spec is None:
+        return None, None
+    if isinstance(spec, str):
+        spec = spec.split(',')
+    if not isinstance(spec, list) or not all(isinstance(f, str) for f in spec):
+        return None, 'fields must be a comma separated string or a list of strings'
+    fields = {f.strip() for f in spec if f.strip()}
+    if '*' in fields:
+        fields.discard('*')
+        fields |= allowed - {'raw_data'}
+    unknown = fields - allowed
+    if unknown:
+        return None, f'unknown fields: {",".join(sorted(unknown))}'
+    return frozenset(fields | {'id'}), None
+
+
+def project_fields(messages: list, fields: Optional[FrozenSet[str]]) -> list:
+    """只保留请求的字段"""
+    if fields is None:
+        return messages
+    return [{k: v for k, v in msg.items() if k in fields} for msg in messages]
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Accept-Encoding 是否接受 gzip（q=0 表示拒绝）"""
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.partition(';')
+        if coding.strip().lower() not in ('gzip', '*'):
+            continue
+        name, _, value = params.partition('=')
+        if name.strip().lower() != 'q':
+            return True
+        try:
+            return float(value) > 0
+        except ValueError:
+            return False
+    return False
+
+
+def gzip_body(body: bytes, accept_encoding: Optional[str]) -> Optional[bytes]:
+    """响应体足够大且客户端接受 gzip 时返回压缩后的响应体，否则返回 None"""
+    if GZIP_LEVEL <= 0 or len(body) < GZIP_MIN_SIZE or not accepts_gzip(accept_encoding):
+        return None
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def long_poll(fetch, wait: float) -> list:
+    """
+    长轮询：先查询一次，没有消息时阻塞等待新消息通知，直到有消息或超时
+    """
+    wait = max(0.0, min(wait or 0, MAX_LONG_POLL_WAIT))
+    deadline = time.monotonic() + wait
+    while True:
+        # 先取版本号再查询，避免查询与等待之间到达的消息被错过
+        version = shards.message_version()
+        messages = fetch()
+        remaining = deadline - time.monotonic()
+        if messages or remaining <= 0:
+            return messages
+        shards.wait_for_new_messages(version, remaining)
+
+
+def select_shards(app_id: Optional[str], after_id: int = 0) -> Tuple[Optional[List[Shard]], Optional[str]]:
+    """
+    拉取类接口涉及的分片，返回 (分片列表, 错误信息)
+    不指定 app_id 时汇总全部分片；各分片主键独立，跨分片时不支持 after_id 游标
+    """
+    selected = shards.select(app_id)
+    if not selected:
+        return None, f'unknown app_id: {app_id}'
+    if after_id and len(selected) > 1:
+        return None, 'after_id requires app_id when multiple bots are configured'
+    return selected, None
+
+
+def target_shard(app_id: Optional[str]) -> Tuple[Optional[Shard], Optional[str]]:
+    """按主键操作消息的接口所在的分片，多机器人模式下必须指定 app_id，返回 (分片, 错误信息)"""
+    if not shards.multi_bot:
+        return shards.default, None
+    if not app_id:
+        return None, 'app_id is required when multiple bots are configured'
+    shard = shards.get(app_id)
+    if not shard:
+        return None, f'unknown app_id: {app_id}'
+    return shard, None
+
+
+def tag_messages(shard: Shard, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """多机器人模式下为每条消息加上所属机器人的 app_id"""
+    if shards.multi_bot:
+        for msg in messages:
+            msg['app_id'] = shard.app_id
+    return messages
+
+
+def fetch_unprocessed(selected: List[Shard], limit: int, after_id: int = 0,
+                      fields: Optional[FrozenSet[str]] = None) -> List[Dict[str, Any]]:
+    """
+    从各分片拉取未处理消息，跨分片时按接收时间合并后取前 limit 条
+    fields 未请求 raw_data 时不读取、不解压 raw_data
+    """
+    include_raw_data = fields is None or 'raw_data' in fields
+    messages = []
+    for shard in selected:
+        messages.extend(tag_messages(shard, shard.db.get_unprocessed_messages(
+            limit, after_id=after_id, include_raw_data=include_raw_data)))
+    if len(selected) > 1:
+        messages.sort(key=lambda msg: (msg['timestamp'] or '', msg['id']))
+        del messages[limit:]
+    return project_fields(messages, fields)
+
+
+def fetch_outgoing(selected: List[Shard], limit: int, after_id: int = 0,
+                   fields: Optional[FrozenSet[str]] = None) -> List[Dict[str, Any]]:
+    """从各分片拉取待发送回复，跨分片时按创建时间合并后取前 limit 条"""
+    messages = []
+    for shard in selected:
+        messages.extend(tag_messages(shard, shard.db.get_outgoing_messages(limit, after_id=after_id)))
+    if len(selected) > 1:
+        messages.sort(key=lambda msg: (msg['timestamp'] or '', msg['id']))
+        del messages[limit:]
+    return project_fields(messages, fields)
+
+
+def claim_from_shards(selected: List[Shard], consumer_id: str, limit: int,
+                      lease_seconds: float, fields: Optional[FrozenSet[str]] = None) -> List[Dict[str, Any]]:
+    """依次从各分片领取消息直到凑满 limit；起始分片轮换，避免总是先取第一个机器人的消息"""
+    global _claim_offset
+    with _claim_lock:
+        start = _claim_offset % len(selected)
+        _claim_offset += 1
+    messages = []
+    for shard in selected[start:] + selected[:start]:
+        remaining = limit - len(messages)
+        if remaining <= 0:
+            break
+        messages.extend(tag_messages(shard, shard.db.claim_messages(
+            consumer_id, remaining, lease_seconds, include_raw_data=fields is None or 'raw_data' in fields)))
+    return project_fields(messages, fields)
+
+
+_claim_lock = threading.Lock()
+_claim_offset = 0
+
+
+def parse_claim_request(data: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """解析领取请求参数，返回 (参数, 错误信息)"""
+    consumer_id = data.get('consumer_id')
+    limit = data.get('limit', 100)
+    lease_seconds = data.get('lease_seconds', LEASE_SECONDS)
+    wait = data.get('wait', 0)
+    
+    if not consumer_id:
+        return None, 'consumer_id is required'
+    if not isinstance(limit, int) or limit <= 0:
+        return None, 'limit must be a positive integer'
+    if not isinstance(lease_seconds, (int, float)) or lease_seconds <= 0:
+        return None, 'lease_seconds must be positive'
+    if not isinstance(wait, (int, float)):
+        return None, 'wait must be a number'
+    fields, error = parse_fields(data.get('fields'), INCOMING_FIELDS)
+    if error:
+        return None, error
+    
+    return {
+        'consumer_id': consumer_id,
+        'limit': limit,
+        'lease_seconds': lease_seconds,
+        'wait': wait,
+        'fields': fields
+    }, None
+
+
+def format_sse_event(msg: Dict[str, Any]) -> str:
+    """将一条消息格式化为SSE事件，事件ID为消息主键"""
+    return f"id: {msg['id']}\nevent: message\ndata: {json.dumps(msg, ensure_ascii=False)}\n\n"
+
+
+def handle_mark_processed(data: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """批量标记消息为已处理，返回 (响应体, HTTP状态码)"""
+    ids = parse_id_list(data)
+    if ids is None:
+        return {'code': 1, 'msg': 'ids must be a list of integers'}, 400
+    shard, error = target_shard(data.get('app_id'))
+    if error:
+        return {'code': 1, 'msg': error}, 400
+    
+    updated = shard.db.mark_messages_processed(ids)
+    return {
+        'code': 0,
+        'msg': 'success',
+        'data': {'updated': updated}
+    }, 200
+
+
+def handle_lease_action(action: str, data: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """续租/确认/释放 的公共处理逻辑，返回 (响应体, HTTP状态码)"""
+    consumer_id = data.get('consumer_id')
+    ids = parse_id_list(data)
+    
+    if not consumer_id:
+        return {'code': 1, 'msg': 'consumer_id is required'}, 400
+    if ids is None:
+        return {'code': 1, 'msg': 'ids must be a list of integers'}, 400
+    shard, error = target_shard(data.get('app_id'))
+    if error:
+        return {'code': 1, 'msg': error}, 400
+    
+    if action == 'renew':
+        lease_seconds = data.get('lease_seconds', LEASE_SECONDS)
+        if not isinstance(lease_seconds, (int, float)) or lease_seconds <= 0:
+            return {'code': 1, 'msg': 'lease_seconds must be positive'}, 400
+        updated = shard.db.renew_lease(consumer_id, ids, lease_seconds)
+    elif action == 'ack':
+        updated = shard.db.ack_messages(consumer_id, ids)
+    else:
+        updated = shard.db.release_messages(consumer_id, ids)
+    
+    return {
+        'code': 0,
+        'msg': 'success',
+        'data': {'updated': updated}
+    }, 200
+
+
+def handle_add_reply(data: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+    """添加回复消息到发送队列，返回 (响应体, HTTP状态码)"""
+    recipient_id = data.get('recipient_id')
+    content = data.get('content')
+    message_type = data.get('message_type', 'text')
+    attachments = data.get('attachments')
+    
+    if not recipient_id or not content:
+        return {'code': 1, 'msg': 'recipient_id and content are required'}, 400
+    shard, error = target_shard(data.get('app_id'))
+    if error:
+        return {'code': 1, 'msg': error}, 400
+    
+    message_id = shard.db.add_outgoing_message(
+        recipient_id=recipient_id,
+        content=content,
+        message_type=message_type,
+        attachments=attachments
+    )
+    
+    return {
+        'code': 0,
+        'msg': 'success',
+        'data': {'message_id': message_id}
+    }, 200
+
+
 def parse_message_content(message_data: Dict[str, Any]) -> tuple:
     """
     解析飞书消息内容
@@ -106,14 +650,229 @@ def parse_message_content(message_data: Dict[str, Any]) -> tuple:
     return text_content, message_type, attachments
 
 
+def build_health() -> Tuple[Dict[str, Any], int]:
+    """构造健康检查结果，返回 (响应体, HTTP状态码)"""
+    status = 'healthy'
+    writer = None
+    if writer_client:
+        try:
+            writer = writer_client.writer_stats()
+        except Exception as e:
+            logger.error("写进程健康检查失败: %s", e)
+            status = 'unhealthy'
+    for shard in shards:
+        try:
+            with shard.db.get_connection() as conn:
+                conn.execute("SELECT 1")
+        except Exception as e:
+            logger.error("数据库健康检查失败(%s): %s", shard.app_id or 'default', e)
+            status = 'unhealthy'
+
+    result = {
+        'status': status,
+        'timestamp': datetime.now().isoformat(),
+        'service': 'feishu-openclaw'
+    }
+    # 单机器人模式下分片统计直接放在顶层，与多机器人支持之前的格式一致；
+    # 多进程模式下写进程不可用时只返回本进程的连接池统计
+    if writer_client and writer is None:
+        stats = {shard.app_id: {'db_pool': shard.db.pool_stats()} for shard in shards}
+    else:
+        stats = {shard.app_id: shard.stats() for shard in shards}
+    if shards.multi_bot:
+        result['shards'] = stats
+    else:
+        result.update(stats[shards.default.app_id])
+    if writer_client:
+        result['prefork'] = {
+            'workers': WORKERS,
+            'worker_index': int(os.getenv('PREFORK_WORKER_INDEX', 0)),
+            'worker_pid': os.getpid(),
+            'writer': writer
+        }
+    if dedup_cache and not (writer_client and writer is None):
+        result['dedup_cache'] = dedup_cache.stats()
+    result['logging'] = logging_stats()
+
+    return result, 200 if status == 'healthy' else 503
+
+
+def decode_event_body(raw_body: bytes) -> Tuple[Dict[str, Any], str]:
+    """
+    解析飞书回调请求体，整个请求只做这一次JSON解析
+    返回: (事件对象, 原始请求体文本)，原始文本直接作为 raw_data 存储
+    """
+    raw_text = raw_body.decode('utf-8')
+    return json.loads(raw_text), raw_text
+
+
+def handle_feishu_event(data: Dict[str, Any], raw_body: Optional[str] = None) -> Tuple[Dict[str, Any], int, str]:
+    """
+    处理飞书POST事件（与Web框架无关，Flask与asyncio模式共用）
+    :param data: 已解析的事件对象
+    :param raw_body: 原始请求体文本，提供时原样存为 raw_data，避免再次序列化
+    返回: (响应体, HTTP状态码, 处理结果)，处理结果用作指标标签
+    """
+    # 验证token（支持schema 2.0新格式）
+    schema = data.get('schema', '1.0')
+    if schema == '2.0':
+        # 新格式：token在header中
+        header = data.get('header', {})
+        token = header.get('token')
+        event_type = header.get('event_type')
+        event = data.get('event', {})
+        app_id = header.get('app_id')
+    else:
+        # 旧格式：token在根节点
+        token = data.get('token')
+        event_type = data.get('type')
+        event = data.get('event', {})
+        app_id = event.get('app_id') if isinstance(event, dict) else None
+    
+    # 日志只使用已提取的字段，不再序列化整个事件
+    logger.info("收到飞书事件: schema=%s, event_type=%s, app_id=%s", schema, event_type, app_id)
+    
+    # 按 app_id（或 token）选择机器人分片，同时完成 token 校验
+    shard = shards.route(app_id, token)
+    if shard is None:
+        logger.warning("飞书事件token验证失败: app_id=%s, token=%s", app_id, token)
+        return {'code': 1, 'msg': 'Unauthorized'}, 401, 'unauthorized'
+    
+    # 检查是否为消息接收事件
+    if event_type == 'url_verification':
+        # URL验证
+        challenge = data.get('challenge')
+        return {'challenge': challenge}, 200, 'challenge'
+    
+    if event_type == 'im.message.receive_v1':
+        message = event.get('message', {})
+        sender_info = event.get('sender', {})
+        
+        # 提取消息信息
+        message_id = message.get('message_id', '')
+        event_id = header.get('event_id') if schema == '2.0' else None
+        
+        # 飞书重推的事件直接应答，跳过解析与写库
+        if dedup_cache and dedup_cache.contains(event_id, message_id):
+            logger.info("重复事件已忽略: %s", message_id)
+            DUPLICATE_EVENTS.inc()
+            return {'code': 0, 'msg': 'success'}, 200, 'duplicate'
+        
+        # 正确提取 sender_id
+        # 飞书消息回调中的 sender_id 结构：
+        # "sender_id": {"open_id": "ou_xxx", "union_id": "on_xxx", "user_id": "xxxx"}
+        # 优先使用 open_id（应用内用户ID），其次使用 union_id（跨应用用户ID）
+        # 不使用 user_id（租户内ID），因为它在多租户环境中不唯一
+        sender_data = sender_info.get('sender_id', {})
+        sender_id = sender_data.get('open_id', '')
+        
+        # 如果没有 open_id，尝试使用 union_id
+        if not sender_id:
+            sender_id = sender_data.get('union_id', '')
+        
+        chat_id = message.get('chat_id', '')
+        
+        if not message_id:
+            logger.warning("消息信息不完整: chat_id=%s, msg_type=%s", message.get('chat_id'), message.get('msg_type'))
+            return {'code': 0, 'msg': 'OK'}, 200, 'incomplete'
+        
+        # 如果sender_id为空，记录警告但不使用chat_id作为备选
+        if not sender_id:
+            logger.error("未找到有效的sender_id（open_id或union_id），chat_id=%s", chat_id)
+            logger.error("sender_id字段: %s", sender_data)
+            # 继续处理，但不会发送回复
+            return {'code': 0, 'msg': 'OK'}, 200, 'incomplete'
+        
+        # 超限的事件同样正常应答飞书（避免重推），但不进入待处理队列
+        limited_scope = shard.rate_limiter.acquire(sender_id, chat_id) if shard.rate_limiter else None
+        if limited_scope:
+            RATE_LIMITED.labels(shard.app_id, limited_scope).inc()
+        if limited_scope and RATE_LIMIT_ACTION == 'drop':
+            if dedup_cache:
+                dedup_cache.add(event_id, message_id)
+            logger.info("消息被限流丢弃(%s): %s from %s, chat_id=%s", limited_scope, message_id, sender_id, chat_id)
+            return {'code': 0, 'msg': 'success'}, 200, 'dropped'
+        
+        # 解析消息内容
+        content, message_type, attachments = parse_message_content(message)
+        
+        record = {
+            'message_id': message_id,
+            'sender_id': sender_id,
+            'chat_id': chat_id,
+            'content': content,
+            'message_type': message_type,
+            'attachments': attachments,
+            'raw_data': raw_body if raw_body is not None else json.dumps(message, ensure_ascii=False)
+        }
+        if limited_scope:
+            record['throttled'] = True
+            logger.info("消息被限流(%s): %s from %s, chat_id=%s", limited_scope, message_id, sender_id, chat_id)
+        
+        # batch 模式下入队即返回，队列已满时退回同步写库
+        if shard.ingest_queue and shard.ingest_queue.put(record):
+            if dedup_cache:
+                dedup_cache.add(event_id, message_id)
+            logger.info("消息已入队: %s from %s", message_id, sender_id)
+            return {'code': 0, 'msg': 'success'}, 200, 'throttled' if limited_scope else 'queued'
+        
+        # 存储到数据库
+        shard.db.add_incoming_message(**record)
+        if dedup_cache:
+            dedup_cache.add(event_id, message_id)
+        
+        logger.info("成功存储消息: %s from %s", message_id, sender_id)
+        return {'code': 0, 'msg': 'success'}, 200, 'throttled' if limited_scope else 'stored'
+    
+    return {'code': 0, 'msg': 'OK'}, 200, 'ignored'
+
+
+def process_webhook(raw_body: bytes) -> Tuple[Dict[str, Any], int]:
+    """
+    解析并处理一次飞书回调请求，记录请求数与耗时指标
+    未通过token验证的请求不使用请求中的 event_type 作为标签，避免伪造请求撑大标签基数
+    返回: (响应体, HTTP状态码)
+    """
+    started = time.perf_counter()
+    event_type, result = 'unknown', 'error'
+    try:
+        data, raw_text = decode_event_body(raw_body)
+        response, status, result = handle_feishu_event(data, raw_text)
+        if result != 'unauthorized':
+            event_type = (data.get('header', {}).get('event_type') if data.get('schema') == '2.0'
+                          else data.get('type')) or 'unknown'
+        return response, status
+    except Exception as e:
+        if isinstance(e, ValueError):
+            result = 'invalid'
+        logger.error("处理飞书事件失败: %s", e, exc_info=True)
+        return {'code': 1, 'msg': str(e)}, 500
+    finally:
+        WEBHOOK_REQUESTS.labels(event_type, result).inc()
+        WEBHOOK_DURATION.observe(time.perf_counter() - started)
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查接口"""
-    return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.now().isoformat(),
-        'service': 'feishu-openclaw'
-    })
+    result, status = build_health()
+    return jsonify(result), status
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus 指标"""
+    if not metrics_authorized(request.headers.get('Authorization')):
+        raise Unauthorized("Invalid metrics token")
+    if writer_client:
+        # 多进程模式下由主进程汇总全部进程的指标
+        try:
+            body = writer_client.metrics()
+        except Exception as e:
+            logger.error("获取汇总指标失败: %s", e)
+            return jsonify({'code': 1, 'msg': 'Writer Unavailable'}), 503
+        return Response(body, content_type=CONTENT_TYPE)
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
 
 
 @app.route('/webhook', methods=['GET', 'POST'])
@@ -125,7 +884,7 @@ def webhook():
         challenge = request.args.get('challenge')
         token = request.args.get('token')
         
-        if token == FEISHU_VERIFICATION_TOKEN and challenge:
+        if shards.has_token(token) and challenge:
             logger.info("飞书URL验证成功")
             return jsonify({'challenge': challenge})
         else:
@@ -134,87 +893,8 @@ def webhook():
     
     # 处理POST事件
     if request.method == 'POST':
-        try:
-            data = request.get_json()
-            logger.info(f"收到飞书事件: {json.dumps(data, ensure_ascii=False)[:200]}")
-            
-            # 验证token（支持schema 2.0新格式）
-            schema = data.get('schema', '1.0')
-            if schema == '2.0':
-                # 新格式：token在header中
-                token = data.get('header', {}).get('token')
-                event_type = data.get('header', {}).get('event_type')
-                event = data.get('event', {})
-            else:
-                # 旧格式：token在根节点
-                token = data.get('token')
-                event_type = data.get('type')
-                event = data.get('event', {})
-            
-            if token != FEISHU_VERIFICATION_TOKEN:
-                logger.warning(f"飞书事件token验证失败: {token}")
-                return jsonify({'code': 1, 'msg': 'Unauthorized'}), 401
-            
-            # 检查是否为消息接收事件
-            if event_type == 'url_verification':
-                # URL验证
-                challenge = data.get('challenge')
-                return jsonify({'challenge': challenge})
-            
-            if event_type == 'im.message.receive_v1':
-                message = event.get('message', {})
-                sender_info = event.get('sender', {})
-                
-                # 提取消息信息
-                message_id = message.get('message_id', '')
-                
-                # 正确提取 sender_id
-                # 飞书消息回调中的 sender_id 结构：
-                # "sender_id": {"open_id": "ou_xxx", "union_id": "on_xxx", "user_id": "xxxx"}
-                # 优先使用 open_id（应用内用户ID），其次使用 union_id（跨应用用户ID）
-                # 不使用 user_id（租户内ID），因为它在多租户环境中不唯一
-                sender_data = sender_info.get('sender_id', {})
-                sender_id = sender_data.get('open_id', '')
-                
-                # 如果没有 open_id，尝试使用 union_id
-                if not sender_id:
-                    sender_id = sender_data.get('union_id', '')
-                
-                chat_id = message.get('chat_id', '')
-                
-                if not message_id:
-                    logger.warning(f"消息信息不完整: {json.dumps(message)}")
-                    return jsonify({'code': 0, 'msg': 'OK'})
-                
-                # 如果sender_id为空，记录警告但不使用chat_id作为备选
-                if not sender_id:
-                    logger.error(f"未找到有效的sender_id（open_id或union_id），chat_id={chat_id}")
-                    logger.error(f"完整sender_info: {json.dumps(sender_info)}")
-                    # 继续处理，但不会发送回复
-                    return jsonify({'code': 0, 'msg': 'OK'})
-                
-                # 解析消息内容
-                content, message_type, attachments = parse_message_content(message)
-                
-                # 存储到数据库
-                db.add_incoming_message(
-                    message_id=message_id,
-                    sender_id=sender_id,
-                    chat_id=chat_id,
-                    content=content,
-                    message_type=message_type,
-                    attachments=attachments,
-                    raw_data=json.dumps(message, ensure_ascii=False)
-                )
-                
-                logger.info(f"成功存储消息: {message_id} from {sender_id}")
-                return jsonify({'code': 0, 'msg': 'success'})
-            
-            return jsonify({'code': 0, 'msg': 'OK'})
-            
-        except Exception as e:
-            logger.error(f"处理飞书事件失败: {str(e)}", exc_info=True)
-            return jsonify({'code': 1, 'msg': str(e)}), 500
+        result, status = process_webhook(request.get_data())
+        return jsonify(result), status
 
 
 @app.route('/api/messages/unprocessed', methods=['GET'])
@@ -224,43 +904,168 @@ def get_unprocessed_messages():
     
     try:
         limit = request.args.get('limit', 100, type=int)
-        messages = db.get_unprocessed_messages(limit)
-        
-        # 转换attachments字段
-        for msg in messages:
-            if msg.get('attachments'):
-                try:
-                    msg['attachments'] = json.loads(msg['attachments'])
-                except:
-                    pass
+        after_id = request.args.get('after_id', 0, type=int)
+        wait = request.args.get('wait', 0, type=float)
+        fields, error = parse_fields(request.args.get('fields'), INCOMING_FIELDS)
+        if not error:
+            selected, error = select_shards(request.args.get('app_id'), after_id)
+        if error:
+            return jsonify({'code': 1, 'msg': error}), 400
+        messages = decode_attachments(long_poll(
+            lambda: fetch_unprocessed(selected, limit, after_id, fields), wait))
         
-        logger.info(f"返回 {len(messages)} 条未处理消息")
+        logger.info("返回 %s 条未处理消息", len(messages))
         return jsonify({
             'code': 0,
             'msg': 'success',
             'data': messages
         })
     except Exception as e:
-        logger.error(f"获取未处理消息失败: {str(e)}", exc_info=True)
+        logger.error("获取未处理消息失败: %s", e, exc_info=True)
         return jsonify({'code': 1, 'msg': str(e)}), 500
 
 
+@app.route('/api/messages/stream', methods=['GET'])
+def stream_messages():
+    """
+    以 Server-Sent Events 推送新消息
+    事件ID为消息主键，断线重连时通过 Last-Event-ID 从断点继续；
+    不带 Last-Event-ID 时先推送全部未处理消息
+    """
+    verify_request()
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    try:
+        last_id = int(last_event_id) if last_event_id else 0
+    except ValueError:
+        return jsonify({'code': 1, 'msg': 'invalid Last-Event-ID'}), 400
+    fields, error = parse_fields(request.args.get('fields'), INCOMING_FIELDS)
+    if not error:
+        # 事件ID为分片内的主键，推送流只订阅一个机器人
+        shard, error = target_shard(request.args.get('app_id'))
+    if error:
+        return jsonify({'code': 1, 'msg': error}), 400
+    
+    def generate(last_id):
+        logger.info("消息推送流已连接，起始ID: %s", last_id)
+        # 告诉客户端断线后的重连间隔（毫秒）
+        yield 'retry: 1000\n\n'
+        try:
+            while True:
+                version = shard.db.message_version()
+                messages = decode_attachments(fetch_unprocessed([shard], 100, last_id, fields))
+                for msg in messages:
+                    last_id = msg['id']
+                    yield format_sse_event(msg)
+                if messages:
+                    continue
+                if not shard.db.wait_for_new_messages(version, STREAM_KEEPALIVE):
+                    # 心跳注释行，保持连接并及时发现已断开的客户端
+                    yield ': keepalive\n\n'
+        finally:
+            logger.info("消息推送流已断开，最后ID: %s", last_id)
+    
+    return Response(
+        stream_with_context(generate(last_id)),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
 @app.route('/api/messages/<int:message_id>/mark-processed', methods=['POST'])
 def mark_message_processed(message_id):
     """标记消息为已处理"""
     verify_request()
     
     try:
-        success = db.mark_message_processed(message_id)
+        shard, error = target_shard(request.args.get('app_id'))
+        if error:
+            return jsonify({'code': 1, 'msg': error}), 400
+        success = shard.db.mark_message_processed(message_id)
         if success:
             return jsonify({'code': 0, 'msg': 'success'})
         else:
             return jsonify({'code': 1, 'msg': 'message not found'}), 404
     except Exception as e:
-        logger.error(f"标记消息失败: {str(e)}", exc_info=True)
+        logger.error("标记消息失败: %s", e, exc_info=True)
+        return jsonify({'code': 1, 'msg': str(e)}), 500
+
+
+@app.route('/api/messages/mark-processed', methods=['POST'])
+def mark_messages_processed():
+    """批量标记消息为已处理"""
+    verify_request()
+    
+    try:
+        result, status = handle_mark_processed(request.get_json(silent=True) or {})
+        return jsonify(result), status
+    except Exception as e:
+        logger.error("批量标记消息失败: %s", e, exc_info=True)
+        return jsonify({'code': 1, 'msg': str(e)}), 500
+
+
+@app.route('/api/messages/claim', methods=['POST'])
+def claim_messages():
+    """领取未处理的消息并加租约"""
+    verify_request()
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        params, error = parse_claim_request(data)
+        if not error:
+            selected, error = select_shards(data.get('app_id'))
+        if error:
+            return jsonify({'code': 1, 'msg': error}), 400
+        
+        messages = decode_attachments(long_poll(
+            lambda: claim_from_shards(selected, params['consumer_id'], params['limit'], params['lease_seconds'],
+                                      params['fields']),
+            params['wait']))
+        
+        logger.info("消费者 %s 领取 %s 条消息", params['consumer_id'], len(messages))
+        return jsonify({
+            'code': 0,
+            'msg': 'success',
+            'data': messages
+        })
+    except Exception as e:
+        logger.error("领取消息失败: %s", e, exc_info=True)
         return jsonify({'code': 1, 'msg': str(e)}), 500
 
 
+def leased_messages_action(action: str):
+    """续租/确认/释放 接口的公共包装"""
+    verify_request()
+    
+    try:
+        result, status = handle_lease_action(action, request.get_json(silent=True) or {})
+        return jsonify(result), status
+    except Exception as e:
+        logger.error("租约操作失败(%s): %s", action, e, exc_info=True)
+        return jsonify({'code': 1, 'msg': str(e)}), 500
+
+
+@app.route('/api/messages/renew', methods=['POST'])
+def renew_lease():
+    """续租已领取的消息"""
+    return leased_messages_action('renew')
+
+
+@app.route('/api/messages/ack', methods=['POST'])
+def ack_messages():
+    """确认已领取的消息处理完成"""
+    return leased_messages_action('ack')
+
+
+@app.route('/api/messages/release', methods=['POST'])
+def release_messages():
+    """释放已领取的消息，使其可被重新领取"""
+    return leased_messages_action('release')
+
+
 @app.route('/api/messages/outgoing', methods=['GET'])
 def get_outgoing_messages():
     """获取待发送的回复消息"""
@@ -268,24 +1073,22 @@ def get_outgoing_messages():
     
     try:
         limit = request.args.get('limit', 100, type=int)
-        messages = db.get_outgoing_messages(limit)
+        after_id = request.args.get('after_id', 0, type=int)
+        fields, error = parse_fields(request.args.get('fields'), OUTGOING_FIELDS)
+        if not error:
+            selected, error = select_shards(request.args.get('app_id'), after_id)
+        if error:
+            return jsonify({'code': 1, 'msg': error}), 400
+        messages = decode_attachments(fetch_outgoing(selected, limit, after_id, fields))
         
-        # 转换attachments字段
-        for msg in messages:
-            if msg.get('attachments'):
-                try:
-                    msg['attachments'] = json.loads(msg['attachments'])
-                except:
-                    pass
-        
-        logger.info(f"返回 {len(messages)} 条待发送消息")
+        logger.info("返回 %s 条待发送消息", len(messages))
         return jsonify({
             'code': 0,
             'msg': 'success',
             'data': messages
         })
     except Exception as e:
-        logger.error(f"获取待发送消息失败: {str(e)}", exc_info=True)
+        logger.error("获取待发送消息失败: %s", e, exc_info=True)
         return jsonify({'code': 1, 'msg': str(e)}), 500
 
 
@@ -295,13 +1098,16 @@ def mark_outgoing_sent(message_id):
     verify_request()
     
     try:
-        success = db.mark_outgoing_sent(message_id)
+        shard, error = target_shard(request.args.get('app_id'))
+        if error:
+            return jsonify({'code': 1, 'msg': error}), 400
+        success = shard.db.mark_outgoing_sent(message_id)
         if success:
             return jsonify({'code': 0, 'msg': 'success'})
         else:
             return jsonify({'code': 1, 'msg': 'message not found'}), 404
     except Exception as e:
-        logger.error(f"标记发送失败: {str(e)}", exc_info=True)
+        logger.error("标记发送失败: %s", e, exc_info=True)
         return jsonify({'code': 1, 'msg': str(e)}), 500
 
 
@@ -311,32 +1117,26 @@ def add_reply():
     verify_request()
     
     try:
-        data = request.get_json()
-        recipient_id = data.get('recipient_id')
-        content = data.get('content')
-        message_type = data.get('message_type', 'text')
-        attachments = data.get('attachments')
-        
-        if not recipient_id or not content:
-            return jsonify({'code': 1, 'msg': 'recipient_id and content are required'}), 400
-        
-        message_id = db.add_outgoing_message(
-            recipient_id=recipient_id,
-            content=content,
-            message_type=message_type,
-            attachments=attachments
-        )
-        
-        return jsonify({
-            'code': 0,
-            'msg': 'success',
-            'data': {'message_id': message_id}
-        })
+        result, status = handle_add_reply(request.get_json())
+        return jsonify(result), status
     except Exception as e:
-        logger.error(f"添加回复失败: {str(e)}", exc_info=True)
+        logger.error("添加回复失败: %s", e, exc_info=True)
         return jsonify({'code': 1, 'msg': str(e)}), 500
 
 
+@app.after_request
+def compress_response(response):
+    """客户端接受 gzip 时压缩较大的响应体（SSE 推送流等流式响应不压缩）"""
+    if response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    body = gzip_body(response.get_data(), request.headers.get('Accept-Encoding'))
+    if body is not None:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
 @app.errorhandler(400)
 def bad_request(error):
     return jsonify({'code': 1, 'msg': 'Bad Request'}), 400
@@ -358,6 +1158,20 @@ def internal_error(error):
 
 
 if __name__ == '__main__':
-    logger.info(f"启动飞书沟通服务，端口: {PORT}")
-    logger.info(f"数据库路径: {DB_PATH}")
-    app.run(host='0.0.0.0', port=PORT, debug=False)
\ No newline at end of file
+    if writer_client:
+        # 多进程模式下由主进程启动的 worker
+        serve_worker(app, '0.0.0.0', PORT)
+        sys.exit(0)
+
+    logger.info("启动飞书沟通服务，端口: %s", PORT)
+    logger.info("数据库路径: %s", ', '.join(shard.db.db_path for shard in shards))
+    logger.info("消息写入模式: %s", INGEST_MODE)
+    if WORKERS > 1:
+        logger.info("多进程模式: %s 个 worker，写进程 IPC: %s", WORKERS, WRITER_SOCKET)
+        # 收到 SIGTERM/SIGINT 后停止 worker 并返回，由 atexit 刷新写入队列
+        run_master(shards, '0.0.0.0', PORT, WORKERS, WRITER_SOCKET, metrics=metrics,
+                   shared={'dedup_cache': dedup_cache} if dedup_cache else None)
+    else:
+        # SIGTERM 时正常退出，以便 atexit 刷新写入队列
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        app.run(host='0.0.0.0', port=PORT, debug=False)
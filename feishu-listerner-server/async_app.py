@@ -0,0 +1,411 @@
+"""
+asyncio 服务模式
+
+提供与 app.py 相同的路由（/webhook、/api/messages/*、/health、/metrics），基于 aiohttp 运行：
+- 数据库操作统一在专用线程池中执行，事件循环线程不做阻塞 IO
+- 长轮询与 SSE 推送流挂起在事件循环上等待新消息通知，不占用操作系统线程
+
+启动: python3 async_app.py（或在 .env 中设置 SERVER_MODE=async 后使用 ./start.sh）
+"""
+import os
+import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Any
+
+from aiohttp import web
+
+import app as core
+
+logger = logging.getLogger(__name__)
+
+# 数据库专用线程池大小，默认与连接池大小一致
+ASYNC_DB_WORKERS = int(os.getenv('ASYNC_DB_WORKERS', core.DB_POOL_SIZE))
+
+
+class AsyncMessageNotifier:
+    """
+    新消息通知（事件循环侧）
+    写入线程通过 call_soon_threadsafe 唤醒，每次通知后替换为新的 Event，
+    等待者先取得当前 Event 再查询数据库，查询期间到达的通知不会丢失
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._event = asyncio.Event()
+        self.closed = False
+
+    def notify_threadsafe(self):
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake)
+
+    def close(self):
+        """服务关闭时唤醒所有等待者，使长轮询和推送流尽快返回"""
+        self.closed = True
+        self._wake()
+
+    def _wake(self):
+        self._event.set()
+        self._event = asyncio.Event()
+
+    def current(self) -> asyncio.Event:
+        return self._event
+
+    @staticmethod
+    async def wait(event: asyncio.Event, timeout: float) -> bool:
+        """等待通知或超时，返回是否收到通知"""
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+def json_response(result: Dict[str, Any], status: int = 200) -> web.Response:
+    return web.json_response(result, status=status)
+
+
+def error_response(status: int, msg: str) -> web.Response:
+    return json_response({'code': 1, 'msg': msg}, status)
+
+
+def verify_request(request: web.Request):
+    """验证内部API请求"""
+    code = request.headers.get('X-Verification-Code')
+    if not code or code != core.VERIFICATION_CODE:
+        logger.warning("未授权的API访问")
+        raise web.HTTPUnauthorized(
+            text=json.dumps({'code': 1, 'msg': 'Unauthorized'}),
+            content_type='application/json'
+        )
+
+
+def query_arg(request: web.Request, name: str, default, type=int):
+    """读取查询参数，格式不正确时返回默认值（与 Flask 的 args.get(type=...) 一致）"""
+    value = request.query.get(name)
+    if value is None:
+        return default
+    try:
+        return type(value)
+    except ValueError:
+        return default
+
+
+async def read_json(request: web.Request) -> Dict[str, Any]:
+    """读取JSON请求体，格式不正确时返回空字典"""
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def run_db(request: web.Request, func, *args, **kwargs):
+    """在数据库专用线程池中执行阻塞调用"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(request.app['db_executor'], partial(func, *args, **kwargs))
+
+
+async def long_poll(request: web.Request, fetch, wait: float) -> list:
+    """
+    长轮询：先查询一次，没有消息时在事件循环上等待新消息通知，直到有消息或超时
+    """
+    notifier = request.app['notifier']
+    loop = asyncio.get_running_loop()
+    wait = max(0.0, min(wait or 0, core.MAX_LONG_POLL_WAIT))
+    deadline = loop.time() + wait
+    while True:
+        event = notifier.current()
+        messages = await run_db(request, fetch)
+        remaining = deadline - loop.time()
+        if messages or remaining <= 0 or notifier.closed:
+            return messages
+        await notifier.wait(event, remaining)
+
+
+async def health_check(request: web.Request) -> web.Response:
+    """健康检查接口"""
+    result, status = await run_db(request, core.build_health)
+    result['server_mode'] = 'async'
+    return json_response(result, status)
+
+
+async def webhook_verify(request: web.Request) -> web.Response:
+    """飞书URL验证（GET）"""
+    challenge = request.query.get('challenge')
+    token = request.query.get('token')
+
+    if core.shards.has_token(token) and challenge:
+        logger.info("飞书URL验证成功")
+        return json_response({'challenge': challenge})
+    logger.warning("飞书URL验证失败")
+    return error_response(401, 'Unauthorized')
+
+
+async def webhook(request: web.Request) -> web.Response:
+    """飞书事件回调接口"""
+    result, status = await run_db(request, core.process_webhook, await request.read())
+    return json_response(result, status)
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    """Prometheus 指标（抓取时的积压统计需要查库，在线程池中执行）"""
+    if not core.metrics_authorized(request.headers.get('Authorization')):
+        return error_response(401, 'Unauthorized')
+    body = await run_db(request, core.metrics.render)
+    return web.Response(body=body.encode('utf-8'), headers={'Content-Type': core.CONTENT_TYPE})
+
+
+async def get_unprocessed_messages(request: web.Request) -> web.Response:
+    """获取未处理的飞书消息"""
+    verify_request(request)
+
+    try:
+        limit = query_arg(request, 'limit', 100)
+        after_id = query_arg(request, 'after_id', 0)
+        wait = query_arg(request, 'wait', 0, float)
+        fields, error = core.parse_fields(request.query.get('fields'), core.INCOMING_FIELDS)
+        if not error:
+            selected, error = core.select_shards(request.query.get('app_id'), after_id)
+        if error:
+            return error_response(400, error)
+        messages = core.decode_attachments(await long_poll(
+            request, partial(core.fetch_unprocessed, selected, limit, after_id, fields), wait))
+
+        logger.info("返回 %s 条未处理消息", len(messages))
+        return json_response({'code': 0, 'msg': 'success', 'data': messages})
+    except Exception as e:
+        logger.error("获取未处理消息失败: %s", e, exc_info=True)
+        return error_response(500, str(e))
+
+
+async def stream_messages(request: web.Request) -> web.StreamResponse:
+    """以 Server-Sent Events 推送新消息，语义与 Flask 模式相同"""
+    verify_request(request)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.query.get('last_id')
+    try:
+        last_id = int(last_event_id) if last_event_id else 0
+    except ValueError:
+        return error_response(400, 'invalid Last-Event-ID')
+    fields, error = core.parse_fields(request.query.get('fields'), core.INCOMING_FIELDS)
+    if not error:
+        shard, error = core.target_shard(request.query.get('app_id'))
+    if error:
+        return error_response(400, error)
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream; charset=utf-8',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(request)
+
+    notifier = request.app['notifier']
+    logger.info("消息推送流已连接，起始ID: %s", last_id)
+    try:
+        await response.write(b'retry: 1000\n\n')
+        while not notifier.closed:
+            event = notifier.current()
+            messages = core.decode_attachments(
+                await run_db(request, core.fetch_unprocessed, [shard], 100, last_id, fields))
+            for msg in messages:
+                last_id = msg['id']
+                await response.write(core.format_sse_event(msg).encode('utf-8'))
+            if messages:
+                continue
+            if not await notifier.wait(event, core.STREAM_KEEPALIVE):
+                # 心跳注释行，保持连接并及时发现已断开的客户端
+                await response.write(b': keepalive\n\n')
+    except ConnectionResetError:
+        pass
+    finally:
+        logger.info("消息推送流已断开，最后ID: %s", last_id)
+    return response
+
+
+async def mark_message_processed(request: web.Request) -> web.Response:
+    """标记消息为已处理"""
+    verify_request(request)
+
+    try:
+        message_id = int(request.match_info['message_id'])
+        shard, error = core.target_shard(request.query.get('app_id'))
+        if error:
+            return error_response(400, error)
+        if await run_db(request, shard.db.mark_message_processed, message_id):
+            return json_response({'code': 0, 'msg': 'success'})
+        return error_response(404, 'message not found')
+    except Exception as e:
+        logger.error("标记消息失败: %s", e, exc_info=True)
+        return error_response(500, str(e))
+
+
+async def mark_messages_processed(request: web.Request) -> web.Response:
+    """批量标记消息为已处理"""
+    verify_request(request)
+
+    try:
+        result, status = await run_db(request, core.handle_mark_processed, await read_json(request))
+        return json_response(result, status)
+    except Exception as e:
+        logger.error("批量标记消息失败: %s", e, exc_info=True)
+        return error_response(500, str(e))
+
+
+async def claim_messages(request: web.Request) -> web.Response:
+    """领取未处理的消息并加租约"""
+    verify_request(request)
+
+    try:
+        data = await read_json(request)
+        params, error = core.parse_claim_request(data)
+        if not error:
+            selected, error = core.select_shards(data.get('app_id'))
+        if error:
+            return error_response(400, error)
+
+        messages = core.decode_attachments(await long_poll(
+            request,
+            partial(core.claim_from_shards, selected, params['consumer_id'], params['limit'],
+                    params['lease_seconds'], params['fields']),
+            params['wait']))
+
+        logger.info("消费者 %s 领取 %s 条消息", params['consumer_id'], len(messages))
+        return json_response({'code': 0, 'msg': 'success', 'data': messages})
+    except Exception as e:
+        logger.error("领取消息失败: %s", e, exc_info=True)
+        return error_response(500, str(e))
+
+
+def leased_messages_action(action: str):
+    """续租/确认/释放 接口"""
+    async def handler(request: web.Request) -> web.Response:
+        verify_request(request)
+
+        try:
+            result, status = await run_db(request, core.handle_lease_action, action, await read_json(request))
+            return json_response(result, status)
+        except Exception as e:
+            logger.error("租约操作失败(%s): %s", action, e, exc_info=True)
+            return error_response(500, str(e))
+    return handler
+
+
+async def get_outgoing_messages(request: web.Request) -> web.Response:
+    """获取待发送的回复消息"""
+    verify_request(request)
+
+    try:
+        limit = query_arg(request, 'limit', 100)
+        after_id = query_arg(request, 'after_id', 0)
+        fields, error = core.parse_fields(request.query.get('fields'), core.OUTGOING_FIELDS)
+        if not error:
+            selected, error = core.select_shards(request.query.get('app_id'), after_id)
+        if error:
+            return error_response(400, error)
+        messages = core.decode_attachments(
+            await run_db(request, core.fetch_outgoing, selected, limit, after_id, fields))
+
+        logger.info("返回 %s 条待发送消息", len(messages))
+        return json_response({'code': 0, 'msg': 'success', 'data': messages})
+    except Exception as e:
+        logger.error("获取待发送消息失败: %s", e, exc_info=True)
+        return error_response(500, str(e))
+
+
+async def mark_outgoing_sent(request: web.Request) -> web.Response:
+    """标记回复为已发送"""
+    verify_request(request)
+
+    try:
+        message_id = int(request.match_info['message_id'])
+        shard, error = core.target_shard(request.query.get('app_id'))
+        if error:
+            return error_response(400, error)
+        if await run_db(request, shard.db.mark_outgoing_sent, message_id):
+            return json_response({'code': 0, 'msg': 'success'})
+        return error_response(404, 'message not found')
+    except Exception as e:
+        logger.error("标记发送失败: %s", e, exc_info=True)
+        return error_response(500, str(e))
+
+
+async def add_reply(request: web.Request) -> web.Response:
+    """添加新的回复消息到发送队列"""
+    verify_request(request)
+
+    try:
+        result, status = await run_db(request, core.handle_add_reply, await read_json(request))
+        return json_response(result, status)
+    except Exception as e:
+        logger.error("添加回复失败: %s", e, exc_info=True)
+        return error_response(500, str(e))
+
+
+@web.middleware
+async def compress_response(request: web.Request, handler):
+    """客户端接受 gzip 时压缩较大的响应体（SSE 推送流等流式响应不压缩）"""
+    response = await handler(request)
+    if not isinstance(response, web.Response) or response.body is None or 'Content-Encoding' in response.headers:
+        return response
+    body = core.gzip_body(response.body, request.headers.get('Accept-Encoding'))
+    if body is not None:
+        response.body = body
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+async def on_startup(application: web.Application):
+    notifier = AsyncMessageNotifier(asyncio.get_running_loop())
+    application['notifier'] = notifier
+    core.shards.add_message_listener(notifier.notify_threadsafe)
+
+
+async def on_shutdown(application: web.Application):
+    application['notifier'].close()
+
+
+async def on_cleanup(application: web.Application):
+    application['db_executor'].shutdown(wait=True)
+
+
+def create_app() -> web.Application:
+    application = web.Application(middlewares=[compress_response])
+    application['db_executor'] = ThreadPoolExecutor(max_workers=ASYNC_DB_WORKERS, thread_name_prefix='db')
+    application.on_startup.append(on_startup)
+    application.on_shutdown.append(on_shutdown)
+    application.on_cleanup.append(on_cleanup)
+
+    application.router.add_get('/health', health_check)
+    application.router.add_get('/metrics', metrics_endpoint)
+    application.router.add_get('/webhook', webhook_verify)
+    application.router.add_post('/webhook', webhook)
+    application.router.add_get('/api/messages/unprocessed', get_unprocessed_messages)
+    application.router.add_get('/api/messages/stream', stream_messages)
+    application.router.add_post(r'/api/messages/{message_id:\d+}/mark-processed', mark_message_processed)
+    application.router.add_post('/api/messages/mark-processed', mark_messages_processed)
+    application.router.add_post('/api/messages/claim', claim_messages)
+    application.router.add_post('/api/messages/renew', leased_messages_action('renew'))
+    application.router.add_post('/api/messages/ack', leased_messages_action('ack'))
+    application.router.add_post('/api/messages/release', leased_messages_action('release'))
+    application.router.add_get('/api/messages/outgoing', get_outgoing_messages)
+    application.router.add_post(r'/api/messages/outgoing/{message_id:\d+}/mark-sent', mark_outgoing_sent)
+    application.router.add_post('/api/messages/reply', add_reply)
+    return application
+
+
+def main():
+    logger.info("启动飞书沟通服务（asyncio 模式），端口: %s", core.PORT)
+    logger.info("数据库路径: %s", core.DB_PATH)
+    logger.info("消息写入模式: %s", core.INGEST_MODE)
+    # run_app 自行处理 SIGINT/SIGTERM，退出后由 atexit 刷新写入队列；
+    # 长轮询与推送流连接在 shutdown_timeout 后被取消
+    web.run_app(create_app(), host='0.0.0.0', port=core.PORT, print=None, shutdown_timeout=5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+/webhook 入库路径微基准：原路径对比单次解析路径
+
+原路径：request.get_json() 解析 -> json.dumps(data)[:200] 记日志 -> 解析 content -> json.dumps(message) 作为 raw_data
+新路径：decode_event_body() 单次解析（原始请求体直接作为 raw_data）-> 解析 content
+
+对 schema 1.0 / 2.0 的 text、post、image、file 消息分别测量每条事件的耗时与内存分配（tracemalloc），
+不涉及数据库写入，输出 JSON 报告。
+
+用法:
+    python benchmarks/bench_ingest.py --events 20000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+os.environ.setdefault('DB_PATH', ':memory:')
+os.environ.setdefault('DEDUP_CACHE_SIZE', '0')
+
+from payloads import make_event, MESSAGE_TYPES, SCHEMAS  # noqa: E402
+import app as core  # noqa: E402
+
+
+def legacy_path(raw_body: bytes):
+    data = json.loads(raw_body)
+    _log_line = f"收到飞书事件: {json.dumps(data)[:200]}"
+    message = data.get('event', {}).get('message', {})
+    content, message_type, attachments = core.parse_message_content(message)
+    raw_data = json.dumps(message, ensure_ascii=False)
+    return content, raw_data
+
+
+def current_path(raw_body: bytes):
+    data, raw_text = core.decode_event_body(raw_body)
+    message = data.get('event', {}).get('message', {})
+    content, message_type, attachments = core.parse_message_content(message)
+    return content, raw_text
+
+
+def measure(func, bodies: list, alloc_samples: int = 1000) -> dict:
+    started = time.perf_counter()
+    for body in bodies:
+        func(body)
+    elapsed = time.perf_counter() - started
+
+    # 逐条统计处理一条事件时的内存峰值增量
+    peaks = []
+    tracemalloc.start()
+    for body in bodies[:alloc_samples]:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func(body)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    return {
+        'us_per_event': round(elapsed / len(bodies) * 1e6, 2),
+        'peak_alloc_bytes_per_event': sum(peaks) // len(peaks),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='/webhook 入库路径微基准')
+    parser.add_argument('--events', type=int, default=20000, help='每种消息类型的事件数')
+    args = parser.parse_args()
+
+    results = {}
+    for schema in SCHEMAS:
+        for msg_type in MESSAGE_TYPES:
+            bodies = [json.dumps(make_event(i, msg_type, schema), ensure_ascii=False).encode('utf-8')
+                      for i in range(args.events)]
+            legacy = measure(legacy_path, bodies)
+            current = measure(current_path, bodies)
+            results[f'{schema}/{msg_type}'] = {
+                'avg_body_bytes': sum(len(b) for b in bodies) // len(bodies),
+                'legacy': legacy,
+                'current': current,
+                'speedup': round(legacy['us_per_event'] / current['us_per_event'], 2),
+            }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
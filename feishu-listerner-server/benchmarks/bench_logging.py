@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+公网服务日志开销基准：LOG_LEVEL=INFO 下 webhook 的单条延迟
+
+每种日志配置在独立子进程中运行（日志配置是进程级的）：
+- sync:  LOG_QUEUE_SIZE=0，在调用线程中同步写文件和控制台（改造前的方式）
+- queue: 默认配置，日志放入队列由后台线程写入
+- queue+rate_limit: 在 queue 基础上开启 LOG_RATE_LIMIT
+
+测量内容：Flask test_client 逐条 POST /webhook（包含入库）。
+回复服务处理循环的日志开销见 feishu-resp-server/benchmarks/bench_logging.py。
+
+用法:
+    python benchmarks/bench_logging.py --events 3000
+    python benchmarks/bench_logging.py --workdir /data/tmp   # 在真实磁盘上测试
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+TOKEN = 'bench-token'
+
+CONFIGS = {
+    'sync': {'LOG_QUEUE_SIZE': '0'},
+    'queue': {},
+    'queue+rate_limit': {'LOG_RATE_LIMIT': '20'},
+}
+
+
+def percentiles(samples: list) -> dict:
+    samples = sorted(samples)
+
+    def pick(p):
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))], 3)
+
+    return {
+        'avg_ms': round(sum(samples) / len(samples), 3),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+    }
+
+
+def run_worker(events: int) -> dict:
+    """在子进程中执行，当前目录为临时工作目录"""
+    sys.path.insert(0, SERVER_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    from payloads import make_mixed_event
+    import app as core
+
+    client = core.app.test_client()
+    bodies = [json.dumps(make_mixed_event(i, token=TOKEN), ensure_ascii=False).encode('utf-8')
+              for i in range(events)]
+    webhook = []
+    for body in bodies:
+        t0 = time.perf_counter()
+        client.post('/webhook', data=body, content_type='application/json')
+        webhook.append((time.perf_counter() - t0) * 1000)
+
+    from log_setup import logging_stats
+    return {
+        'webhook': percentiles(webhook),
+        'logging': logging_stats(),
+        'log_file_bytes': os.path.getsize('app.log'),
+    }
+
+
+def run_config(name: str, overrides: dict, args) -> dict:
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmp:
+        env = dict(os.environ,
+                   DB_PATH=os.path.join(tmp, 'bench.db'),
+                   FEISHU_VERIFICATION_TOKEN=TOKEN,
+                   DEDUP_CACHE_SIZE='0',
+                   LOG_LEVEL='INFO',
+                   **overrides)
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', '--events', str(args.events)],
+                              env=env, cwd=tmp, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f'{name} 运行失败，退出码 {proc.returncode}')
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        result['env'] = overrides
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='公网服务日志开销基准（webhook）')
+    parser.add_argument('--events', type=int, default=3000, help='每种配置处理的消息数')
+    parser.add_argument('--workdir', default=None, help='临时目录所在位置（日志与数据库写在这里）')
+    parser.add_argument('--config', choices=list(CONFIGS), action='append', help='只测试指定配置，可多次指定')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.events), ensure_ascii=False))
+        return
+
+    results = {name: run_config(name, CONFIGS[name], args) for name in (args.config or list(CONFIGS))}
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+轮询查询基准测试
+
+在临时数据库中生成大量历史消息，对比旧的 `ORDER BY timestamp` + `processed` 索引查询
+与新的主键游标 + 部分索引查询的延迟，结果以 JSON 输出。
+
+用法:
+    python benchmarks/bench_poll.py --rows 1000000 --backlog 50 --backlog 100000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from models import DatabaseManager  # noqa: E402
+
+LEGACY_QUERY = """
+    SELECT * FROM incoming_messages INDEXED BY idx_legacy_processed
+    WHERE processed = 0
+    ORDER BY timestamp ASC
+    LIMIT ?
+"""
+
+
+def populate(db: DatabaseManager, rows: int, backlog: int):
+    """生成 rows 条消息，其中最新的 backlog 条为未处理"""
+    content = '这是一条用于基准测试的消息内容' * 4
+    raw_data = json.dumps({'content': json.dumps({'text': content}, ensure_ascii=False)}, ensure_ascii=False)
+    start = time.time() - rows
+    batch = 10000
+    with db.get_connection() as conn:
+        for offset in range(0, rows, batch):
+            conn.executemany("""
+                INSERT INTO incoming_messages
+                (timestamp, message_id, sender_id, chat_id, content, message_type, processed, raw_data)
+                VALUES (datetime(?, 'unixepoch'), ?, ?, ?, ?, 'text', ?, ?)
+            """, [(
+                start + i,
+                f'om_{i}',
+                f'ou_{i % 500}',
+                f'oc_{i % 50}',
+                content,
+                0 if i >= rows - backlog else 1,
+                raw_data
+            ) for i in range(offset, min(offset + batch, rows))])
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_legacy_processed ON incoming_messages(processed)")
+        conn.execute("ANALYZE")
+
+
+def measure(func, iterations: int) -> dict:
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return {
+        'p50_ms': round(statistics.median(samples), 3),
+        'p99_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 3),
+        'mean_ms': round(statistics.mean(samples), 3),
+    }
+
+
+def run(rows: int, backlog: int, limit: int, iterations: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, 'bench.db'))
+        t0 = time.time()
+        populate(db, rows, backlog)
+        populate_seconds = round(time.time() - t0, 2)
+
+        def legacy():
+            with db.get_connection() as conn:
+                return [dict(row) for row in conn.execute(LEGACY_QUERY, (limit,))]
+
+        result = {
+            'rows': rows,
+            'backlog': backlog,
+            'limit': limit,
+            'iterations': iterations,
+            'populate_seconds': populate_seconds,
+            'db_size_mb': round(os.path.getsize(os.path.join(tmp, 'bench.db')) / 1024 / 1024, 1),
+            'legacy_order_by_timestamp': measure(legacy, iterations),
+            'cursor_partial_index': measure(lambda: db.get_unprocessed_messages(limit), iterations),
+        }
+        db.close()
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='轮询查询基准测试')
+    parser.add_argument('--rows', type=int, default=1000000, help='历史消息总数')
+    parser.add_argument('--backlog', type=int, action='append',
+                        help='未处理消息数，可多次指定（默认 50 和 100000）')
+    parser.add_argument('--limit', type=int, default=100, help='每次轮询的条数')
+    parser.add_argument('--iterations', type=int, default=50, help='每种查询的执行次数')
+    args = parser.parse_args()
+
+    results = [run(args.rows, backlog, args.limit, args.iterations)
+               for backlog in (args.backlog or [50, 100000])]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+raw_data 压缩存储基准：明文（RAW_DATA_COMPRESS_LEVEL=0）对比 zlib 压缩
+
+对每种配置写入同样的 N 条飞书事件（raw_data 为完整回调请求体），最近的 --backlog 条保持未处理，
+然后用固定大小的页缓存（--cache-kb，关闭 mmap）反复分页拉取未处理消息（不读取 raw_data），输出：
+- 数据库文件大小、raw_data 总字节数
+- 写入耗时、拉取耗时
+- SQLite 页缓存命中率（sqlite3_db_status CACHE_HIT/CACHE_MISS，通过 ctypes 读取，不可用时为 null）
+
+用法:
+    python benchmarks/bench_raw_data.py --events 50000
+"""
+
+import os
+import sys
+import json
+import time
+import ctypes
+import sqlite3
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from payloads import make_mixed_event  # noqa: E402
+from models import DatabaseManager  # noqa: E402
+from compression import storage_report  # noqa: E402
+
+SQLITE_DBSTATUS_CACHE_HIT = 7
+SQLITE_DBSTATUS_CACHE_MISS = 8
+
+
+class CacheStatus:
+    """通过 ctypes 读取连接的页缓存命中统计（依赖 CPython sqlite3 连接对象的内存布局，校验失败时不可用）"""
+
+    def __init__(self, conn: sqlite3.Connection, db_path: str):
+        self.available = False
+        try:
+            import _sqlite3
+            lib = ctypes.CDLL(_sqlite3.__file__)
+            self._status = lib.sqlite3_db_status
+            self._status.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int),
+                                     ctypes.POINTER(ctypes.c_int), ctypes.c_int]
+            filename = lib.sqlite3_db_filename
+            filename.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+            filename.restype = ctypes.c_char_p
+            self._db = ctypes.c_void_p.from_address(id(conn) + object.__basicsize__).value
+            self.available = filename(self._db, b'main').decode() == os.path.realpath(db_path)
+        except Exception:
+            self.available = False
+
+    def read(self, op: int, reset: bool = False) -> int:
+        current, highwater = ctypes.c_int(), ctypes.c_int()
+        self._status(self._db, op, ctypes.byref(current), ctypes.byref(highwater), int(reset))
+        return current.value
+
+    def reset(self):
+        if self.available:
+            self.read(SQLITE_DBSTATUS_CACHE_HIT, True)
+            self.read(SQLITE_DBSTATUS_CACHE_MISS, True)
+
+    def snapshot(self) -> dict:
+        if not self.available:
+            return {'cache_hits': None, 'cache_misses': None, 'cache_hit_rate': None}
+        hits = self.read(SQLITE_DBSTATUS_CACHE_HIT)
+        misses = self.read(SQLITE_DBSTATUS_CACHE_MISS)
+        return {
+            'cache_hits': hits,
+            'cache_misses': misses,
+            'cache_hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+
+
+def run_config(level: int, args, tmp: str) -> dict:
+    db_path = os.path.join(tmp, f'level{level}.db')
+    db = DatabaseManager(db_path, pool_size=1, cache_size=-args.cache_kb, mmap_size=0, raw_data_level=level)
+
+    started = time.perf_counter()
+    batch = []
+    for i in range(args.events):
+        event = make_mixed_event(i)
+        message = event['event']['message']
+        batch.append({
+            'message_id': message['message_id'],
+            'sender_id': event['event']['sender']['sender_id']['open_id'],
+            'chat_id': message['chat_id'],
+            'content': message['content'],
+            'message_type': message['msg_type'],
+            'raw_data': json.dumps(event, ensure_ascii=False),
+        })
+        if len(batch) == 500:
+            db.add_incoming_messages(batch)
+            batch = []
+    if batch:
+        db.add_incoming_messages(batch)
+    write_seconds = time.perf_counter() - started
+
+    with db.get_connection() as conn:
+        conn.execute("UPDATE incoming_messages SET processed = 1 WHERE id <= ?", (args.events - args.backlog,))
+
+    # 连接池只有一个连接，拉取期间统计的就是这个连接的页缓存
+    conn = db.pool.acquire()
+    status = CacheStatus(conn, db_path)
+    db.pool.release(conn)
+    status.reset()
+
+    started = time.perf_counter()
+    fetched = 0
+    for _ in range(args.passes):
+        after_id = 0
+        while True:
+            messages = db.get_unprocessed_messages(100, after_id=after_id)
+            if not messages:
+                break
+            fetched += len(messages)
+            after_id = messages[-1]['id']
+    poll_seconds = time.perf_counter() - started
+    cache = status.snapshot()
+
+    with db.get_connection() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        report = storage_report(conn, db_path)
+    db.close()
+
+    return {
+        'level': level,
+        'file_mb': round(report['file_bytes'] / 1024 / 1024, 2),
+        'page_count': report['page_count'],
+        'raw_data_mb': round(report['raw_data_bytes'] / 1024 / 1024, 2),
+        'avg_raw_data_bytes': report['avg_raw_data_bytes'],
+        'write_seconds': round(write_seconds, 2),
+        'poll_rows': fetched,
+        'poll_seconds': round(poll_seconds, 3),
+        **cache,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='raw_data 压缩存储基准')
+    parser.add_argument('--events', type=int, default=50000, help='写入的事件数')
+    parser.add_argument('--backlog', type=int, default=10000, help='未处理消息数（最近写入的消息）')
+    parser.add_argument('--passes', type=int, default=3, help='拉取全部未处理消息的轮数')
+    parser.add_argument('--cache-kb', type=int, default=16384, help='SQLite 页缓存大小（KB）')
+    parser.add_argument('--level', type=int, action='append', help='压缩级别，可多次指定（默认 0 和 6）')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [run_config(level, args, tmp) for level in (args.level or [0, 6])]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
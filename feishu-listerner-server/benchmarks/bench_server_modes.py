@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务模式负载测试：Flask（app.py）对比 asyncio（async_app.py）
+
+对每种模式在临时目录中启动服务，先建立 N 个挂起的长轮询连接，
+再在这些连接保持打开的同时以固定并发压测 /webhook，输出：
+- 实际保持住的长轮询连接数、服务进程线程数
+- webhook 吞吐量与 p50/p95/p99 延迟、错误数
+
+用法:
+    python benchmarks/bench_server_modes.py --long-polls 500 --requests 2000 --concurrency 20
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import aiohttp
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+TOKEN = 'bench-token'
+CODE = 'bench-code'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def thread_count(pid: int) -> int:
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('Threads:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return -1
+
+
+def make_event(i: int) -> dict:
+    return {
+        'schema': '2.0',
+        'header': {
+            'event_id': f'ev_{i}',
+            'token': TOKEN,
+            'event_type': 'im.message.receive_v1',
+            'app_id': 'cli_bench',
+        },
+        'event': {
+            'sender': {'sender_id': {'open_id': f'ou_{i % 200}', 'union_id': f'on_{i % 200}'}},
+            'message': {
+                'message_id': f'om_{i}',
+                'chat_id': f'oc_{i % 20}',
+                'chat_type': 'p2p',
+                'msg_type': 'text',
+                'content': json.dumps({'text': f'负载测试消息 {i} ' + '内容' * 20}, ensure_ascii=False),
+            },
+        },
+    }
+
+
+def percentile(samples: list, p: float) -> float:
+    if not samples:
+        return 0.0
+    return round(samples[min(len(samples) - 1, int(len(samples) * p))], 2)
+
+
+async def hold_long_poll(session: aiohttp.ClientSession, base: str, wait: float, results: dict):
+    try:
+        async with session.get(f'{base}/api/messages/unprocessed',
+                               params={'wait': str(wait), 'after_id': str(10 ** 12)},
+                               headers={'X-Verification-Code': CODE}) as resp:
+            results['opened'] += 1
+            await resp.read()
+    except Exception:
+        results['failed'] += 1
+
+
+async def run_webhooks(session: aiohttp.ClientSession, base: str, total: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            t0 = time.perf_counter()
+            try:
+                async with session.post(f'{base}/webhook', json=make_event(i)) as resp:
+                    await resp.read()
+                    if resp.status != 200:
+                        errors += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': total,
+        'errors': errors,
+        'throughput_rps': round(total / elapsed, 1),
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+    }
+
+
+async def bench(base: str, pid: int, args) -> dict:
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=args.wait + 30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        polls = {'opened': 0, 'failed': 0}
+        # 长轮询的 after_id 取极大值，保证压测期间写入的消息不会唤醒它们
+        poll_tasks = [asyncio.create_task(hold_long_poll(session, base, args.wait, polls))
+                      for _ in range(args.long_polls)]
+        await asyncio.sleep(args.ramp)
+        held = sum(1 for task in poll_tasks if not task.done())
+        threads_with_polls = thread_count(pid)
+
+        webhook = await run_webhooks(session, base, args.requests, args.concurrency)
+        held_after = sum(1 for task in poll_tasks if not task.done())
+
+        for task in poll_tasks:
+            task.cancel()
+        await asyncio.gather(*poll_tasks, return_exceptions=True)
+
+    return {
+        'long_polls_requested': args.long_polls,
+        'long_polls_held': held,
+        'long_polls_held_after_webhooks': held_after,
+        'long_polls_failed': polls['failed'],
+        'server_threads': threads_with_polls,
+        'webhook': webhook,
+    }
+
+
+def run_mode(script: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        env = dict(os.environ,
+                   PORT=str(port),
+                   DB_PATH=os.path.join(tmp, 'bench.db'),
+                   FEISHU_VERIFICATION_TOKEN=TOKEN,
+                   VERIFICATION_CODE=CODE,
+                   MAX_LONG_POLL_WAIT=str(args.wait),
+                   LOG_LEVEL='WARNING')
+        proc = subprocess.Popen([sys.executable, os.path.join(SERVER_DIR, script)], env=env, cwd=tmp,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base = f'http://127.0.0.1:{port}'
+        try:
+            for _ in range(100):
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            result = asyncio.run(bench(base, proc.pid, args))
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        result['script'] = script
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flask 与 asyncio 服务模式负载测试')
+    parser.add_argument('--long-polls', type=int, default=500, help='同时挂起的长轮询连接数')
+    parser.add_argument('--wait', type=float, default=60, help='长轮询等待时间（秒）')
+    parser.add_argument('--ramp', type=float, default=3, help='建立长轮询连接后的等待时间（秒）')
+    parser.add_argument('--requests', type=int, default=2000, help='webhook 请求总数')
+    parser.add_argument('--concurrency', type=int, default=20, help='webhook 并发数')
+    parser.add_argument('--mode', choices=['flask', 'async'], action='append',
+                        help='只测试指定模式，可多次指定（默认两种都测）')
+    args = parser.parse_args()
+
+    scripts = {'flask': 'app.py', 'async': 'async_app.py'}
+    results = {mode: run_mode(scripts[mode], args) for mode in (args.mode or ['flask', 'async'])}
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
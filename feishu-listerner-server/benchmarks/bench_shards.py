@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多机器人分片写入基准：机器人数量（分片数）对 webhook 写入吞吐量的影响
+
+对每个机器人数量 N，用 FEISHU_APPS 配置 N 个应用启动服务（每个应用一个 SQLite 文件），
+以固定并发压测 /webhook，事件按序轮流属于各个应用（schema 2.0，header.app_id 路由），输出：
+- 吞吐量、p50/p95/p99 延迟、错误数
+- 各分片写入的消息数
+
+单文件时所有写入争用同一把写锁；分片后不同机器人的提交可以并行。
+提交越慢（如 DB_SYNCHRONOUS=FULL、慢盘），分片的收益越明显。
+
+用法:
+    python benchmarks/bench_shards.py --bots 1 --bots 2 --bots 4 --events 4000 --concurrency 32
+    python benchmarks/bench_shards.py --mode async --env DB_SYNCHRONOUS=FULL --workdir /data/tmp
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, SERVER_DIR)
+
+from payloads import make_event, MESSAGE_TYPES  # noqa: E402
+from bench_server_modes import free_port  # noqa: E402
+from bench_suite import Recorder, summarize, wait_for_port, parse_env, SCRIPTS, CODE  # noqa: E402
+from shards import shard_db_path  # noqa: E402
+
+
+def app_tokens(bots: int) -> dict:
+    return {f'cli_bench{n:04d}': f'bench-token-{n}' for n in range(bots)}
+
+
+async def drive(base: str, apps: dict, args) -> dict:
+    app_ids = list(apps)
+    bodies = []
+    for i in range(args.events):
+        app_id = app_ids[i % len(app_ids)]
+        event = make_event(i, MESSAGE_TYPES[i % len(MESSAGE_TYPES)], '2.0', apps[app_id], app_id=app_id)
+        bodies.append(json.dumps(event, ensure_ascii=False).encode('utf-8'))
+
+    recorder = Recorder()
+    queue = iter(bodies)
+
+    async def worker():
+        for body in queue:
+            await recorder.request(session, 'POST', f'{base}/webhook', data=body,
+                                   headers={'Content-Type': 'application/json'})
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    return summarize(recorder.latencies, recorder.errors, elapsed)
+
+
+def count_rows(db_path: str) -> int:
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM incoming_messages").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def run_bots(bots: int, args) -> dict:
+    apps = app_tokens(bots)
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmp:
+        port = free_port()
+        db_path = os.path.join(tmp, 'bench.db')
+        env = dict(os.environ,
+                   PORT=str(port),
+                   DB_PATH=db_path,
+                   FEISHU_APPS=json.dumps(apps),
+                   VERIFICATION_CODE=CODE,
+                   LOG_LEVEL='WARNING',
+                   RETENTION_DAYS='0',
+                   DEDUP_CACHE_SIZE='0',
+                   **args.env)
+        proc = subprocess.Popen([sys.executable, os.path.join(SERVER_DIR, SCRIPTS[args.mode])], env=env, cwd=tmp,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(port, proc)
+            result = asyncio.run(drive(f'http://127.0.0.1:{port}', apps, args))
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        result['rows_per_shard'] = {app_id: count_rows(shard_db_path(db_path, app_id)) for app_id in apps}
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多机器人分片写入基准')
+    parser.add_argument('--bots', type=int, action='append', help='机器人数量，可多次指定（默认 1、2、4、8）')
+    parser.add_argument('--events', type=int, default=4000, help='每轮 webhook 事件总数（均分到各机器人）')
+    parser.add_argument('--concurrency', type=int, default=32, help='webhook 并发数')
+    parser.add_argument('--mode', choices=list(SCRIPTS), default='async', help='服务模式')
+    parser.add_argument('--env', action='append', metavar='KEY=VALUE', help='传给服务进程的环境变量，可多次指定')
+    parser.add_argument('--workdir', default=None, help='临时目录所在位置（数据库写在这里）')
+    args = parser.parse_args()
+    args.env = parse_env(args.env)
+
+    results = {}
+    for bots in args.bots or [1, 2, 4, 8]:
+        results[bots] = run_bots(bots, args)
+    base = results[min(results)]['throughput_rps']
+    for result in results.values():
+        result['speedup'] = round(result['throughput_rps'] / base, 2) if base else None
+    print(json.dumps({'mode': args.mode, 'env': args.env, 'results': results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+公网服务端到端负载测试套件
+
+在临时目录中启动服务（Flask 或 asyncio 模式，空数据库），按阶段以固定并发压测：
+- webhook:  POST /webhook，schema 1.0 / 2.0 的 text、post、image、file 消息轮换（payloads.py），
+            可按比例混入飞书重推的重复事件
+- fetch:    GET /api/messages/unprocessed，随机游标分页拉取
+- claim:    多个消费者交替 POST /api/messages/claim 领取、POST /api/messages/ack 确认，直到取完
+- reply:    POST /api/messages/reply 写入回复
+- outgoing: GET /api/messages/outgoing 拉取待发送回复，逐条 POST mark-sent
+
+每个阶段输出吞吐量、p50/p95/p99 延迟和错误数，以及阶段结束时的数据库文件大小（含 WAL），
+结果为 JSON，可用 --output 保存，下次用 --baseline 指定上次的结果输出对比。
+
+用法:
+    python benchmarks/bench_suite.py --events 5000 --concurrency 20 --output before.json
+    python benchmarks/bench_suite.py --events 5000 --concurrency 20 --baseline before.json
+    python benchmarks/bench_suite.py --mode async --env INGEST_MODE=batch
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, BENCH_DIR)
+
+from payloads import make_mixed_event  # noqa: E402
+from bench_server_modes import free_port  # noqa: E402
+
+TOKEN = 'bench-token'
+CODE = 'bench-code'
+SCRIPTS = {'flask': 'app.py', 'async': 'async_app.py'}
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+
+    def pick(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3) if latencies else 0.0
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+    }
+
+
+def db_size(db_path: str) -> int:
+    """数据库文件与 WAL 文件大小之和"""
+    return sum(os.path.getsize(path) for path in (db_path, db_path + '-wal') if os.path.exists(path))
+
+
+class Recorder:
+    """收集单个阶段的请求延迟与错误数"""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+    async def request(self, session: aiohttp.ClientSession, method: str, url: str, **kwargs):
+        """发送请求并记录延迟，返回解析后的 JSON（失败时为 None）"""
+        t0 = time.perf_counter()
+        try:
+            async with session.request(method, url, **kwargs) as resp:
+                body = await resp.read()
+                ok = resp.status == 200
+        except Exception:
+            body, ok = None, False
+        self.latencies.append((time.perf_counter() - t0) * 1000)
+        if not ok:
+            self.errors += 1
+            return None
+        return json.loads(body) if body else None
+
+
+async def run_workers(concurrency: int, worker) -> float:
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return time.perf_counter() - started
+
+
+class Suite:
+    def __init__(self, base: str, db_path: str, args):
+        self.base = base
+        self.db_path = db_path
+        self.args = args
+        self.headers = {'X-Verification-Code': CODE}
+        self.rng = random.Random(args.seed)
+        self.results = {}
+        self.db_growth = {'initial_bytes': db_size(db_path)}
+
+    def finish(self, phase: str, recorder: Recorder, elapsed: float, **extra):
+        self.results[phase] = dict(summarize(recorder.latencies, recorder.errors, elapsed), **extra)
+        self.db_growth[f'after_{phase}_bytes'] = db_size(self.db_path)
+
+    async def webhook(self, session: aiohttp.ClientSession):
+        events = self.args.events
+        bodies = [json.dumps(make_mixed_event(i, token=TOKEN), ensure_ascii=False).encode('utf-8')
+                  for i in range(events)]
+        # 重推事件：与之前某条事件的请求体完全相同
+        duplicates = int(events * self.args.duplicates)
+        order = list(range(events)) + [self.rng.randrange(events) for _ in range(duplicates)]
+        self.rng.shuffle(order)
+        payload_bytes = sum(len(body) for body in bodies)
+
+        recorder = Recorder()
+        queue = iter(order)
+
+        async def worker(_):
+            for i in queue:
+                await recorder.request(session, 'POST', f'{self.base}/webhook', data=bodies[i],
+                                       headers={'Content-Type': 'application/json'})
+
+        elapsed = await run_workers(self.args.concurrency, worker)
+        self.finish('webhook', recorder, elapsed, events=events, duplicates=duplicates,
+                    avg_payload_bytes=round(payload_bytes / events, 1) if events else 0)
+        # batch 写入模式下等待队列落库，保证后续阶段看到全部消息
+        await asyncio.sleep(self.args.settle)
+
+    async def fetch(self, session: aiohttp.ClientSession):
+        recorder = Recorder()
+        remaining = iter(range(self.args.fetches))
+        rows = 0
+
+        async def worker(_):
+            nonlocal rows
+            for _ in remaining:
+                after_id = self.rng.randrange(max(1, self.args.events))
+                body = await recorder.request(session, 'GET', f'{self.base}/api/messages/unprocessed',
+                                              params={'limit': str(self.args.batch), 'after_id': str(after_id)},
+                                              headers=self.headers)
+                rows += len(body['data']) if body else 0
+
+        elapsed = await run_workers(self.args.concurrency, worker)
+        self.finish('fetch', recorder, elapsed, rows=rows)
+
+    async def claim_and_ack(self, session: aiohttp.ClientSession):
+        claim, ack = Recorder(), Recorder()
+        claimed = 0
+
+        async def worker(n):
+            nonlocal claimed
+            consumer_id = f'bench-consumer-{n}'
+            while True:
+                body = await claim.request(session, 'POST', f'{self.base}/api/messages/claim',
+                                           json={'consumer_id': consumer_id, 'limit': self.args.batch},
+                                           headers=self.headers)
+                messages = body['data'] if body else []
+                if not messages:
+                    return
+                claimed += len(messages)
+                await ack.request(session, 'POST', f'{self.base}/api/messages/ack',
+                                  json={'consumer_id': consumer_id, 'ids': [m['id'] for m in messages]},
+                                  headers=self.headers)
+
+        # 领取与确认交替进行，共用同一段耗时；rows_per_second 为消息消费速度
+        elapsed = await run_workers(self.args.concurrency, worker)
+        self.finish('claim', claim, elapsed, rows=claimed,
+                    rows_per_second=round(claimed / elapsed, 1) if elapsed else 0.0,
+                    ack=summarize(ack.latencies, ack.errors, elapsed))
+
+    async def reply(self, session: aiohttp.ClientSession):
+        recorder = Recorder()
+        remaining = iter(range(self.args.replies))
+
+        async def worker(_):
+            for i in remaining:
+                await recorder.request(session, 'POST', f'{self.base}/api/messages/reply', headers=self.headers,
+                                       json={'recipient_id': f'ou_{i % 200:032x}',
+                                             'content': f'第 {i} 条回复：' + '处理结果说明。' * 10})
+
+        elapsed = await run_workers(self.args.concurrency, worker)
+        self.finish('reply', recorder, elapsed)
+
+    async def outgoing(self, session: aiohttp.ClientSession):
+        fetch, mark = Recorder(), Recorder()
+        ids = []
+        after_id = 0
+        started = time.perf_counter()
+        while True:
+            body = await fetch.request(session, 'GET', f'{self.base}/api/messages/outgoing',
+                                       params={'limit': str(self.args.batch), 'after_id': str(after_id)},
+                                       headers=self.headers)
+            messages = body['data'] if body else []
+            if not messages:
+                break
+            ids.extend(m['id'] for m in messages)
+            after_id = messages[-1]['id']
+        self.finish('outgoing', fetch, time.perf_counter() - started, rows=len(ids))
+
+        remaining = iter(ids)
+
+        async def worker(_):
+            for message_id in remaining:
+                await mark.request(session, 'POST', f'{self.base}/api/messages/outgoing/{message_id}/mark-sent',
+                                   headers=self.headers)
+
+        elapsed = await run_workers(self.args.concurrency, worker)
+        self.finish('mark_sent', mark, elapsed)
+
+    async def run(self) -> dict:
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as session:
+            await self.webhook(session)
+            await self.fetch(session)
+            await self.claim_and_ack(session)
+            await self.reply(session)
+            await self.outgoing(session)
+
+        events = self.args.events
+        growth = self.db_growth['after_webhook_bytes'] - self.db_growth['initial_bytes']
+        self.db_growth['webhook_bytes_per_event'] = round(growth / events, 1) if events else 0
+        return {'phases': self.results, 'db_growth': self.db_growth}
+
+
+def wait_for_port(port: int, proc: subprocess.Popen):
+    for _ in range(150):
+        if proc.poll() is not None:
+            raise RuntimeError(f'服务启动失败，退出码 {proc.returncode}')
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('服务启动超时')
+
+
+def run_mode(mode: str, args) -> dict:
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmp:
+        port = free_port()
+        db_path = os.path.join(tmp, 'bench.db')
+        env = dict(os.environ,
+                   PORT=str(port),
+                   DB_PATH=db_path,
+                   FEISHU_VERIFICATION_TOKEN=TOKEN,
+                   VERIFICATION_CODE=CODE,
+                   LOG_LEVEL='WARNING',
+                   RETENTION_DAYS='0',
+                   **args.env)
+        proc = subprocess.Popen([sys.executable, os.path.join(SERVER_DIR, SCRIPTS[mode])], env=env, cwd=tmp,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for_port(port, proc)
+            result = asyncio.run(Suite(f'http://127.0.0.1:{port}', db_path, args).run())
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        result['env'] = args.env
+        return result
+
+
+def compare(results: dict, baseline: dict) -> dict:
+    """与上次结果对比：吞吐量与 p99 的变化比例（正数表示吞吐提升 / 延迟增加）"""
+    diff = {}
+    for mode, result in results.items():
+        base = baseline.get(mode)
+        if not base:
+            continue
+        diff[mode] = {}
+        for phase, current in result['phases'].items():
+            before = base.get('phases', {}).get(phase)
+            if not before:
+                continue
+            diff[mode][phase] = {
+                key: round(current[key] / before[key] - 1, 3) if before.get(key) else None
+                for key in ('throughput_rps', 'p99_ms')
+            }
+    return diff
+
+
+def parse_env(items: list) -> dict:
+    env = {}
+    for item in items or []:
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise argparse.ArgumentTypeError(f'--env 需要 KEY=VALUE 格式: {item}')
+        env[key] = value
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description='公网服务 webhook 与消息接口负载测试套件')
+    parser.add_argument('--events', type=int, default=5000, help='webhook 事件数（不含重复事件）')
+    parser.add_argument('--duplicates', type=float, default=0.05, help='额外混入的重推事件比例')
+    parser.add_argument('--fetches', type=int, default=1000, help='拉取未处理消息的请求数')
+    parser.add_argument('--replies', type=int, default=2000, help='写入的回复数')
+    parser.add_argument('--batch', type=int, default=100, help='拉取 / 领取的每批条数')
+    parser.add_argument('--concurrency', type=int, default=20, help='每个阶段的并发数')
+    parser.add_argument('--settle', type=float, default=0.5, help='webhook 阶段结束后的等待时间（秒）')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    parser.add_argument('--mode', choices=list(SCRIPTS), action='append',
+                        help='只测试指定服务模式，可多次指定（默认 flask）')
+    parser.add_argument('--env', action='append', metavar='KEY=VALUE', help='传给服务进程的环境变量，可多次指定')
+    parser.add_argument('--workdir', default=None, help='临时目录所在位置（数据库写在这里）')
+    parser.add_argument('--output', help='结果保存路径')
+    parser.add_argument('--baseline', help='上次保存的结果，输出与之对比的变化')
+    args = parser.parse_args()
+    args.env = parse_env(args.env)
+
+    results = {mode: run_mode(mode, args) for mode in (args.mode or ['flask'])}
+    report = dict(results)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            report = {'results': results, 'change_vs_baseline': compare(results, json.load(f))}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(results, ensure_ascii=False, indent=2))
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+飞书 im.message.receive_v1 回调负载生成器
+
+按真实回调结构生成 schema 1.0 / 2.0 的 text、post、image、file 消息，供基准测试使用。
+"""
+
+import json
+import random
+import time
+from typing import Dict, Any
+
+MESSAGE_TYPES = ('text', 'post', 'image', 'file')
+SCHEMAS = ('1.0', '2.0')
+
+
+def _content(msg_type: str, i: int, rng: random.Random) -> Dict[str, Any]:
+    if msg_type == 'text':
+        return {'text': f'@_user_1 请帮我查一下第 {i} 号工单的处理进度' + '，谢谢' * rng.randint(0, 20)}
+    if msg_type == 'post':
+        return {
+            'post': {
+                'zh_cn': [
+                    {'tag': 'text', 'text': f'第 {i} 条富文本消息：' + '这是一段比较长的说明文字。' * rng.randint(5, 40)},
+                    {'tag': 'a', 'text': '相关文档', 'href': f'https://example.feishu.cn/docx/{i:012d}'},
+                    {'tag': 'text', 'text': '请在今天下班前回复。'},
+                ]
+            }
+        }
+    if msg_type == 'image':
+        return {'image_key': f'img_v2_{i:08d}-0000-0000-0000-{rng.randrange(16 ** 12):012x}g'}
+    return {
+        'file_key': f'file_v2_{i:08d}-0000-0000-0000-{rng.randrange(16 ** 12):012x}g',
+        'file_name': f'季度报告_{i}.pdf',
+    }
+
+
+def make_event(i: int, msg_type: str = 'text', schema: str = '2.0', token: str = 'bench-token',
+               senders: int = 200, chats: int = 20, seed: int = None,
+               app_id: str = 'cli_9e0b5f0f0d4a500c') -> Dict[str, Any]:
+    """生成第 i 条消息事件，message_id / event_id 由 i 决定，重复调用得到相同的ID（可模拟飞书重推）"""
+    rng = random.Random(i if seed is None else seed)
+    create_time = str(int(time.time() * 1000))
+    sender = {
+        'sender_id': {
+            'open_id': f'ou_{i % senders:032x}',
+            'union_id': f'on_{i % senders:032x}',
+            'user_id': f'{i % senders:08x}',
+        },
+        'sender_type': 'user',
+        'tenant_key': '2ed263bf32cf1651',
+    }
+    message = {
+        'message_id': f'om_{i:032x}',
+        'root_id': '',
+        'parent_id': '',
+        'create_time': create_time,
+        'chat_id': f'oc_{i % chats:032x}',
+        'chat_type': 'p2p' if i % 3 else 'group',
+        'message_type': msg_type,
+        'msg_type': msg_type,
+        'content': json.dumps(_content(msg_type, i, rng), ensure_ascii=False),
+        'mentions': [],
+    }
+
+    if schema == '2.0':
+        return {
+            'schema': '2.0',
+            'header': {
+                'event_id': f'{i:032x}',
+                'token': token,
+                'create_time': create_time,
+                'event_type': 'im.message.receive_v1',
+                'tenant_key': '2ed263bf32cf1651',
+                'app_id': app_id,
+            },
+            'event': {'sender': sender, 'message': message},
+        }
+    return {
+        'uuid': f'{i:032x}',
+        'token': token,
+        'ts': create_time,
+        'type': 'im.message.receive_v1',
+        'event': {'sender': sender, 'message': message},
+    }
+
+
+def make_mixed_event(i: int, token: str = 'bench-token', **kwargs) -> Dict[str, Any]:
+    """按序轮换消息类型和 schema 的事件"""
+    return make_event(i, MESSAGE_TYPES[i % len(MESSAGE_TYPES)],
+                      SCHEMAS[(i // len(MESSAGE_TYPES)) % len(SCHEMAS)], token, **kwargs)
@@ -0,0 +1,71 @@
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+class DedupCache:
+    """
+    最近处理过的事件/消息ID集合（LRU + TTL）
+    飞书在回调超时时会重推事件，命中缓存的事件直接应答，跳过解析与写库
+    """
+
+    def __init__(self, max_size: int = 50000, ttl: float = 43200):
+        self.max_size = max(1, max_size)
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def contains(self, *keys: str) -> bool:
+        """任一ID在有效期内出现过即视为重复，同时更新命中统计"""
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                if not key:
+                    continue
+                expires_at = self._entries.get(key)
+                if expires_at is None:
+                    continue
+                if expires_at < now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return True
+            self._misses += 1
+            return False
+
+    def add(self, *keys: str):
+        """记录已成功处理的ID，超出容量时淘汰最久未使用的条目"""
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for key in keys:
+                if not key:
+                    continue
+                self._entries[key] = expires_at
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def warm(self, keys: Iterable[str]):
+        """用数据库中最近的消息ID预热（按从旧到新的顺序传入）"""
+        keys = list(keys)
+        self.add(*keys)
+        logger.info("去重缓存预热完成: %s 条", len(keys))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / total, 4) if total else 0.0,
+            }
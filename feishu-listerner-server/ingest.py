@@ -0,0 +1,151 @@
+import queue
+import threading
+import time
+import logging
+from typing import Dict, Any
+
+from models import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueue:
+    """
+    Webhook 消息写入队列（write-behind）
+    webhook 只负责入队，后台线程按批次大小或时间窗口合并为一个事务写库
+    """
+
+    def __init__(self, db: DatabaseManager, max_size: int = 10000,
+                 batch_size: int = 100, flush_interval_ms: float = 5):
+        self.db = db
+        self.max_size = max_size
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval_ms) / 1000.0
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # 统计
+        self._enqueued = 0
+        self._rejected = 0
+        self._written = 0
+        self._ignored = 0
+        self._failed = 0
+        self._batches = 0
+        self._last_batch_size = 0
+        self._max_batch_size = 0
+
+    def start(self):
+        """启动后台写入线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="IngestWriter")
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("消息写入队列已启动，容量: %s，批次大小: %s", self.max_size, self.batch_size)
+
+    def put(self, message: Dict[str, Any]) -> bool:
+        """消息入队，队列已满时返回False，由调用方同步写库"""
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            return False
+        with self._lock:
+            self._enqueued += 1
+        return True
+
+    def stop(self, timeout: float = 10):
+        """停止写入线程，并把队列中剩余的消息全部落库"""
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+            if self._thread.is_alive():
+                logger.warning("消息写入线程未正常退出")
+        self._drain()
+        logger.info("消息写入队列已停止")
+
+    def _collect_batch(self) -> list:
+        """阻塞等待第一条消息，然后在时间窗口内尽量凑满一个批次"""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            batch = self._collect_batch()
+            if batch:
+                self._write_batch(batch)
+
+    def _drain(self):
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: list):
+        """写入一个批次，批量写入失败时逐条重试，避免整批丢失"""
+        try:
+            inserted = self.db.add_incoming_messages(batch)
+            failed = 0
+        except Exception as e:
+            logger.error("批量写入失败，改为逐条写入: %s", e, exc_info=True)
+            inserted = 0
+            failed = 0
+            for msg in batch:
+                try:
+                    if self.db.add_incoming_message(**msg) > 0:
+                        inserted += 1
+                except Exception as e:
+                    failed += 1
+                    logger.error("写入消息失败: %s, %s", msg.get('message_id'), e)
+
+        with self._lock:
+            self._batches += 1
+            self._written += inserted
+            self._failed += failed
+            self._ignored += len(batch) - inserted - failed
+            self._last_batch_size = len(batch)
+            self._max_batch_size = max(self._max_batch_size, len(batch))
+
+    def stats(self) -> Dict[str, Any]:
+        """队列深度及批次统计"""
+        with self._lock:
+            return {
+                'depth': self._queue.qsize(),
+                'max_size': self.max_size,
+                'enqueued': self._enqueued,
+                'rejected': self._rejected,
+                'written': self._written,
+                'ignored': self._ignored,
+                'failed': self._failed,
+                'batches': self._batches,
+                'last_batch_size': self._last_batch_size,
+                'max_batch_size': self._max_batch_size,
+                'avg_batch_size': round((self._written + self._ignored + self._failed) / self._batches, 2)
+                if self._batches else 0,
+            }
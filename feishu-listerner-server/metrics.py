@@ -0,0 +1,281 @@
+"""
+进程内指标（Prometheus 文本格式，不依赖 prometheus_client）
+
+每个标签组合对应一个子指标，各自持有一把锁，记录一次只是一次无竞争的加锁和几次加法；
+子指标在首次使用时创建，调用方可预先取得子指标避免每次查找。
+多进程模式下各进程用 snapshot() 导出取值，由主进程 render(snapshots) 按指标名与标签值相加后统一输出。
+"""
+import time
+import bisect
+import functools
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 默认延迟分桶（秒），覆盖 SQLite 单次查询到慢请求的范围
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    """带标签的指标基类"""
+    TYPE = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """取得（必要时创建）标签值对应的子指标"""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'{self.name} 需要标签 {self.labelnames}')
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _items(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return sorted(self._children.items())
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Any]:
+        """各子指标的当前取值（可序列化），用于跨进程汇总"""
+        return {values: child.snapshot() for values, child in self._items()}
+
+    @staticmethod
+    def _combine(a, b):
+        return a + b
+
+    def _merged(self, snapshots: Iterable[Dict[Tuple[str, ...], Any]]) -> List[Tuple[Tuple[str, ...], Any]]:
+        """本进程取值与其他进程的快照按标签值相加"""
+        merged = self.snapshot()
+        for snapshot in snapshots:
+            for values, value in snapshot.items():
+                merged[values] = self._combine(merged[values], value) if values in merged else value
+        return sorted(merged.items())
+
+    def _samples(self, items: List[Tuple[Tuple[str, ...], Any]]) -> List[str]:
+        raise NotImplementedError
+
+    def render(self, snapshots: Iterable[Dict[Tuple[str, ...], Any]] = ()) -> str:
+        lines = [f'# HELP {self.name} {_escape(self.documentation)}', f'# TYPE {self.name} {self.TYPE}']
+        lines.extend(self._samples(self._merged(snapshots)))
+        return '\n'.join(lines)
+
+
+class _Value:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+    def get(self) -> float:
+        with self._lock:
+            return self._value
+
+    snapshot = get
+
+
+class Counter(_Metric):
+    """单调递增计数"""
+    TYPE = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        """无标签计数器递增"""
+        self.labels().inc(amount)
+
+    def _samples(self, items: List[Tuple[Tuple[str, ...], float]]) -> List[str]:
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}'
+                for values, value in items]
+
+
+class Gauge(_Metric):
+    """瞬时值，通常在抓取时由调用方设置"""
+    TYPE = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        """无标签指标赋值"""
+        self.labels().set(value)
+
+    def _samples(self, items: List[Tuple[Tuple[str, ...], float]]) -> List[str]:
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}'
+                for values, value in items]
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class Histogram(_Metric):
+    """分桶计数的延迟分布，抓取时输出累积桶"""
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        """无标签直方图记录一次观测"""
+        self.labels().observe(value)
+
+    @staticmethod
+    def _combine(a, b):
+        return [x + y for x, y in zip(a[0], b[0])], a[1] + b[1]
+
+    def _samples(self, items: List[Tuple[Tuple[str, ...], Tuple[List[int], float]]]) -> List[str]:
+        lines = []
+        bucket_labels = self.labelnames + ('le',)
+        for values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(bucket_labels, values + (_format_value(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    """指标注册表，render() 输出 Prometheus 文本格式"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, callback: Callable[[], None]):
+        """注册抓取前回调，用于刷新队列深度等需要现算的指标"""
+        self._collectors.append(callback)
+
+    def collect(self):
+        """执行抓取前回调"""
+        for callback in self._collectors:
+            callback()
+
+    def snapshot(self) -> Dict[str, Dict[Tuple[str, ...], Any]]:
+        """
+        执行抓取前回调后导出各指标的取值：{指标名: {标签值: 取值}}
+        多进程模式下 worker 把快照交给主进程汇总
+        """
+        self.collect()
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def render(self, snapshots: Iterable[Dict[str, Dict[Tuple[str, ...], Any]]] = ()) -> str:
+        """输出本进程的指标，传入其他进程的快照时按标签值相加后输出"""
+        self.collect()
+        snapshots = list(snapshots)
+        return '\n'.join(metric.render([s[metric.name] for s in snapshots if metric.name in s])
+                         for metric in self._metrics) + '\n'
+
+    def retain(self, retired: Dict[str, Dict[Tuple[str, ...], Any]], snapshot: Dict[str, Dict[Tuple[str, ...], Any]]):
+        """把已退出进程快照中的计数器与直方图累加到 retired，gauge 随进程退出失效，不保留"""
+        for metric in self._metrics:
+            values = snapshot.get(metric.name)
+            if not values or metric.TYPE == 'gauge':
+                continue
+            target = retired.setdefault(metric.name, {})
+            for labels, value in values.items():
+                target[labels] = metric._combine(target[labels], value) if labels in target else value
+
+
+def instrument(obj: Any, names: Iterable[str], histogram: Histogram, errors: Optional[Counter] = None):
+    """
+    用计时包装对象上的方法（替换实例属性，不修改类）
+    histogram 与 errors 的唯一标签为方法名。只统计从对象外部直接调用的最外层方法：
+    被包装的方法内部再调用同一对象上被包装的方法时不单独记录，其耗时与异常计入外层方法
+    """
+    active = threading.local()
+    for name in names:
+        method = getattr(obj, name)
+        setattr(obj, name, _timed(method, histogram.labels(name), errors.labels(name) if errors else None, active))
+
+
+def _timed(method: Callable, observer: _HistogramChild, error_counter: Optional[_Value],
+           active: threading.local) -> Callable:
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if getattr(active, 'timing', False):
+            return method(*args, **kwargs)
+        active.timing = True
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            if error_counter:
+                error_counter.inc()
+            raise
+        finally:
+            observer.observe(time.perf_counter() - started)
+            active.timing = False
+    return wrapper
@@ -1,26 +1,223 @@
 import sqlite3
 import json
 import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable
+
+from compression import compress_raw_data, decompress_raw_data
 
 logger = logging.getLogger(__name__)
 
 
-class DatabaseManager:
-    def __init__(self, db_path: str):
+class ConnectionPool:
+    """
+    SQLite 连接池
+    连接长期复用，PRAGMA 只在创建连接时执行一次
+    """
+
+    def __init__(self, db_path: str, size: int = 5, timeout: float = 10.0,
+                 synchronous: str = 'NORMAL', busy_timeout: int = 5000,
+                 cache_size: int = -20000, mmap_size: int = 268435456,
+                 on_wait: Optional[Callable[[], None]] = None):
+        """
+        :param on_wait: 每次需要等待空闲连接时调用（用于累加指标）
+        """
         self.db_path = db_path
-        self.init_database()
+        self.size = max(1, size)
+        self.timeout = timeout
+        synchronous = (synchronous or 'NORMAL').upper()
+        self.synchronous = synchronous if synchronous in ('OFF', 'NORMAL', 'FULL', 'EXTRA') else 'NORMAL'
+        self.busy_timeout = busy_timeout
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.on_wait = on_wait
 
-    def get_connection(self):
-        """获取数据库连接"""
-        conn = sqlite3.connect(self.db_path)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._waits = 0
+        self._closed = False
+
+    def _create_connection(self) -> sqlite3.Connection:
+        """创建新连接并执行一次性的 PRAGMA 设置"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               timeout=self.busy_timeout / 1000.0)
         conn.row_factory = sqlite3.Row
         conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout)}")
+        conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
         return conn
 
+    def acquire(self) -> sqlite3.Connection:
+        """从池中借出连接，池满时等待归还"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("连接池已关闭")
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    self._waits += 1
+                    create = False
+            if create:
+                try:
+                    conn = self._create_connection()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                if self.on_wait:
+                    self.on_wait()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError("等待数据库连接超时")
+
+        with self._lock:
+            self._in_use += 1
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """归还连接，残留的事务会被回滚"""
+        with self._lock:
+            self._in_use -= 1
+        if self._closed:
+            conn.close()
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        """关闭池中所有空闲连接"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池使用情况"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'waits': self._waits,
+            }
+
+
+class DatabaseManager:
+    # incoming_messages 中除 raw_data 外的字段，常规查询不读取 raw_data
+    INCOMING_COLUMNS = ('id, timestamp, message_id, sender_id, chat_id, content, message_type, attachments, '
+                        'processed, response_sent, claimed_by, lease_expires_at, delivery_count')
+
+    def __init__(self, db_path: str, pool_size: int = 5, pool_timeout: float = 10.0,
+                 synchronous: str = 'NORMAL', busy_timeout: int = 5000,
+                 cache_size: int = -20000, mmap_size: int = 268435456,
+                 raw_data_level: int = 6, on_pool_wait: Optional[Callable[[], None]] = None,
+                 init_schema: bool = True):
+        """
+        :param init_schema: 是否建表与迁移；多进程模式下只由写进程执行，worker 传 False
+        """
+        self.db_path = db_path
+        # raw_data 的 zlib 压缩级别，0 表示明文存储
+        self.raw_data_level = raw_data_level
+        self.pool = ConnectionPool(
+            db_path,
+            size=pool_size,
+            timeout=pool_timeout,
+            synchronous=synchronous,
+            busy_timeout=busy_timeout,
+            cache_size=cache_size,
+            mmap_size=mmap_size,
+            on_wait=on_pool_wait
+        )
+        # 新消息通知（长轮询等待者在进程内被唤醒，无需轮询数据库）
+        self._new_message_cond = threading.Condition()
+        self._message_version = 0
+        self._message_listeners = []
+        if init_schema:
+            self.init_database()
+
+    @contextmanager
+    def get_connection(self):
+        """从连接池获取数据库连接，退出时提交（异常时回滚）并归还"""
+        conn = self.pool.acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.pool.release(conn)
+
+    def message_version(self) -> int:
+        """当前新消息版本号，每次有消息可领取时递增"""
+        with self._new_message_cond:
+            return self._message_version
+
+    def wait_for_new_messages(self, version: int, timeout: float) -> bool:
+        """等待版本号超过 version（有新消息）或超时，返回是否有新消息"""
+        with self._new_message_cond:
+            return self._new_message_cond.wait_for(
+                lambda: self._message_version != version, timeout=timeout)
+
+    def add_message_listener(self, callback):
+        """注册新消息回调（在写入线程中调用，回调需自行保证线程安全）"""
+        self._message_listeners.append(callback)
+
+    def _notify_new_messages(self):
+        """唤醒所有等待新消息的请求"""
+        with self._new_message_cond:
+            self._message_version += 1
+            self._new_message_cond.notify_all()
+        for callback in self._message_listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error("新消息回调执行失败: %s", e)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """获取连接池使用情况"""
+        return self.pool.stats()
+
+    def close(self):
+        """关闭连接池"""
+        self.pool.close()
+
+    def _init_auto_vacuum(self):
+        """
+        新建的数据库启用 auto_vacuum=INCREMENTAL（必须在建表和切换 WAL 之前设置，只在建库时执行一次）；
+        已有数据库需停服执行一次 python retention.py --enable-incremental-vacuum 转换
+        """
+        conn = sqlite3.connect(self.db_path, timeout=self.pool.busy_timeout / 1000.0)
+        try:
+            if conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+
     def init_database(self):
         """初始化数据库表"""
+        self._init_auto_vacuum()
         with self.get_connection() as conn:
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS incoming_messages (
@@ -34,10 +231,22 @@ class DatabaseManager:
                     attachments TEXT,
                     processed BOOLEAN DEFAULT 0,
                     response_sent BOOLEAN DEFAULT 0,
-                    raw_data TEXT
+                    raw_data TEXT,
+                    claimed_by TEXT,
+                    lease_expires_at REAL,
+                    delivery_count INTEGER DEFAULT 0,
+                    throttled BOOLEAN DEFAULT 0
                 )
             """)
 
+            # 旧版本数据库补齐租约相关字段
+            self._ensure_columns(conn, 'incoming_messages', {
+                'claimed_by': 'TEXT',
+                'lease_expires_at': 'REAL',
+                'delivery_count': 'INTEGER DEFAULT 0',
+                'throttled': 'BOOLEAN DEFAULT 0',
+            })
+
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS outgoing_messages (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -56,30 +265,50 @@ class DatabaseManager:
                 ON incoming_messages(message_id)
             """)
 
+            # 部分索引只包含待处理的行，按主键有序，轮询开销与历史数据量无关
             conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_incoming_processed 
-                ON incoming_messages(processed)
+                CREATE INDEX IF NOT EXISTS idx_incoming_unprocessed 
+                ON incoming_messages(id, lease_expires_at) 
+                WHERE processed = 0
             """)
 
             conn.execute("""
-                CREATE INDEX IF NOT EXISTS idx_outgoing_status 
-                ON outgoing_messages(status)
+                CREATE INDEX IF NOT EXISTS idx_outgoing_pending 
+                ON outgoing_messages(id) 
+                WHERE status = 'pending'
             """)
 
+            # 旧版本的低区分度索引会干扰查询计划，由上面的部分索引取代
+            conn.execute("DROP INDEX IF EXISTS idx_incoming_processed")
+            conn.execute("DROP INDEX IF EXISTS idx_outgoing_status")
+
             conn.commit()
             logger.info("数据库初始化完成")
 
+    @staticmethod
+    def _ensure_columns(conn, table: str, columns: Dict[str, str]):
+        """为已存在的表补齐缺失的字段"""
+        existing = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for name, definition in columns.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+                logger.info("数据库迁移: %s 增加字段 %s", table, name)
+
     def add_incoming_message(self, message_id: str, sender_id: str, chat_id: str,
                             content: str, message_type: str = 'text',
                             attachments: Optional[Dict] = None,
-                            raw_data: Optional[str] = None) -> int:
-        """添加接收到的消息"""
+                            raw_data: Optional[str] = None, throttled: bool = False) -> int:
+        """
+        添加接收到的消息
+        throttled 为 True 时（被限流）只留存记录，直接记为已处理，不会被拉取或领取
+        """
         with self.get_connection() as conn:
             try:
                 cursor = conn.execute("""
                     INSERT INTO incoming_messages 
-                    (message_id, sender_id, chat_id, content, message_type, attachments, raw_data)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    (message_id, sender_id, chat_id, content, message_type, attachments, raw_data,
+                     processed, throttled)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """, (
                     message_id,
                     sender_id,
@@ -87,26 +316,168 @@ class DatabaseManager:
                     content,
                     message_type,
                     json.dumps(attachments) if attachments else None,
-                    raw_data
+                    compress_raw_data(raw_data, self.raw_data_level),
+                    int(throttled),
+                    int(throttled)
                 ))
                 conn.commit()
-                logger.info(f"添加接收消息: {message_id}")
+                if not throttled:
+                    self._notify_new_messages()
+                logger.info("添加接收消息: %s", message_id)
                 return cursor.lastrowid
             except sqlite3.IntegrityError:
-                logger.warning(f"消息已存在: {message_id}")
+                logger.warning("消息已存在: %s", message_id)
                 return -1
 
-    def get_unprocessed_messages(self, limit: int = 100) -> List[Dict[str, Any]]:
-        """获取未处理的消息"""
+    def add_incoming_messages(self, messages: List[Dict[str, Any]]) -> int:
+        """批量添加接收到的消息（单事务），已存在的消息会被忽略，返回实际插入条数"""
+        if not messages:
+            return 0
+        with self.get_connection() as conn:
+            cursor = conn.executemany("""
+                INSERT OR IGNORE INTO incoming_messages 
+                (message_id, sender_id, chat_id, content, message_type, attachments, raw_data,
+                 processed, throttled)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, [(
+                msg['message_id'],
+                msg['sender_id'],
+                msg['chat_id'],
+                msg.get('content'),
+                msg.get('message_type', 'text'),
+                json.dumps(msg['attachments']) if msg.get('attachments') else None,
+                compress_raw_data(msg.get('raw_data'), self.raw_data_level),
+                int(bool(msg.get('throttled'))),
+                int(bool(msg.get('throttled')))
+            ) for msg in messages])
+            inserted = cursor.rowcount
+        if inserted > 0:
+            self._notify_new_messages()
+        logger.info("批量添加接收消息: %s/%s", inserted, len(messages))
+        return inserted
+
+    def _incoming_columns(self, include_raw_data: bool) -> str:
+        return self.INCOMING_COLUMNS + (', raw_data' if include_raw_data else '')
+
+    @staticmethod
+    def _incoming_row(row: sqlite3.Row) -> Dict[str, Any]:
+        """行转换为字典，raw_data（如有）解压为文本"""
+        msg = dict(row)
+        if 'raw_data' in msg:
+            msg['raw_data'] = decompress_raw_data(msg['raw_data'])
+        return msg
+
+    def get_unprocessed_messages(self, limit: int = 100, after_id: int = 0,
+                                 include_raw_data: bool = False) -> List[Dict[str, Any]]:
+        """
+        获取未处理的消息，按主键升序，只返回主键大于 after_id 的消息
+        include_raw_data 为 True 时才读取并解压 raw_data
+        """
+        with self.get_connection() as conn:
+            cursor = conn.execute(f"""
+                SELECT {self._incoming_columns(include_raw_data)} FROM incoming_messages 
+                WHERE processed = 0 AND id > ? 
+                AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                ORDER BY id ASC 
+                LIMIT ?
+            """, (after_id or 0, time.time(), limit))
+            rows = cursor.fetchall()
+            return [self._incoming_row(row) for row in rows]
+
+    def get_raw_data(self, message_id: int) -> Optional[str]:
+        """按主键读取并解压单条消息的 raw_data"""
+        with self.get_connection() as conn:
+            row = conn.execute("SELECT raw_data FROM incoming_messages WHERE id = ?", (message_id,)).fetchone()
+        return decompress_raw_data(row['raw_data']) if row else None
+
+    def get_recent_message_ids(self, limit: int = 10000) -> List[str]:
+        """获取最近接收的消息ID（从旧到新），用于预热去重缓存"""
         with self.get_connection() as conn:
             cursor = conn.execute("""
-                SELECT * FROM incoming_messages 
-                WHERE processed = 0 
-                ORDER BY timestamp ASC 
+                SELECT message_id FROM incoming_messages 
+                ORDER BY id DESC 
                 LIMIT ?
             """, (limit,))
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+            return [row['message_id'] for row in cursor.fetchall()][::-1]
+
+    def claim_messages(self, consumer_id: str, limit: int = 100, lease_seconds: float = 60,
+                       include_raw_data: bool = False) -> List[Dict[str, Any]]:
+        """
+        原子地领取未处理的消息并加租约
+        租约过期（消费者崩溃或超时）的消息会被重新投递
+        """
+        now = time.time()
+        expires_at = now + lease_seconds
+        with self.get_connection() as conn:
+            # 立即获取写锁，保证多个消费者之间领取互斥
+            conn.execute("BEGIN IMMEDIATE")
+            ids = [row['id'] for row in conn.execute("""
+                SELECT id FROM incoming_messages 
+                WHERE processed = 0 
+                AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                ORDER BY id ASC 
+                LIMIT ?
+            """, (now, limit))]
+            if not ids:
+                return []
+
+            placeholders = ','.join('?' * len(ids))
+            conn.execute(f"""
+                UPDATE incoming_messages 
+                SET claimed_by = ?, lease_expires_at = ?, delivery_count = delivery_count + 1 
+                WHERE id IN ({placeholders})
+            """, [consumer_id, expires_at] + ids)
+            rows = conn.execute(f"""
+                SELECT {self._incoming_columns(include_raw_data)} FROM incoming_messages 
+                WHERE id IN ({placeholders}) 
+                ORDER BY id ASC
+            """, ids).fetchall()
+
+        logger.info("消费者 %s 领取 %s 条消息", consumer_id, len(rows))
+        return [self._incoming_row(row) for row in rows]
+
+    def _update_leased(self, consumer_id: str, message_ids: List[int], set_clause: str,
+                       params: list) -> int:
+        """对指定消费者持有的未处理消息执行更新，返回实际更新条数"""
+        ids = list(dict.fromkeys(int(i) for i in message_ids))
+        if not ids:
+            return 0
+        affected = 0
+        with self.get_connection() as conn:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor = conn.execute(f"""
+                    UPDATE incoming_messages 
+                    SET {set_clause} 
+                    WHERE id IN ({placeholders}) 
+                    AND claimed_by = ? AND processed = 0
+                """, params + chunk + [consumer_id])
+                affected += cursor.rowcount
+        return affected
+
+    def renew_lease(self, consumer_id: str, message_ids: List[int], lease_seconds: float = 60) -> int:
+        """续租，只能续期本消费者仍持有的消息"""
+        affected = self._update_leased(consumer_id, message_ids,
+                                       "lease_expires_at = ?", [time.time() + lease_seconds])
+        logger.info("消费者 %s 续租 %s/%s 条消息", consumer_id, affected, len(message_ids))
+        return affected
+
+    def ack_messages(self, consumer_id: str, message_ids: List[int]) -> int:
+        """确认消息已处理完成"""
+        affected = self._update_leased(consumer_id, message_ids,
+                                       "processed = 1, lease_expires_at = NULL", [])
+        logger.info("消费者 %s 确认 %s/%s 条消息", consumer_id, affected, len(message_ids))
+        return affected
+
+    def release_messages(self, consumer_id: str, message_ids: List[int]) -> int:
+        """释放租约，消息立即可被其他消费者领取"""
+        affected = self._update_leased(consumer_id, message_ids,
+                                       "claimed_by = NULL, lease_expires_at = NULL", [])
+        if affected > 0:
+            self._notify_new_messages()
+        logger.info("消费者 %s 释放 %s/%s 条消息", consumer_id, affected, len(message_ids))
+        return affected
 
     def mark_message_processed(self, message_id: int) -> bool:
         """标记消息为已处理"""
@@ -118,9 +489,29 @@ class DatabaseManager:
             """, (message_id,))
             conn.commit()
             affected = cursor.rowcount
-            logger.info(f"标记消息已处理: {message_id}")
+            logger.info("标记消息已处理: %s", message_id)
             return affected > 0
 
+    def mark_messages_processed(self, message_ids: List[int]) -> int:
+        """批量标记消息为已处理（单事务），返回实际更新条数"""
+        ids = list(dict.fromkeys(int(i) for i in message_ids))
+        if not ids:
+            return 0
+        affected = 0
+        with self.get_connection() as conn:
+            # 分块避免超过SQLite参数个数上限
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor = conn.execute(f"""
+                    UPDATE incoming_messages 
+                    SET processed = 1 
+                    WHERE id IN ({placeholders})
+                """, chunk)
+                affected += cursor.rowcount
+        logger.info("批量标记消息已处理: %s/%s", affected, len(ids))
+        return affected
+
     def add_outgoing_message(self, recipient_id: str, content: str,
                             message_type: str = 'text',
                             attachments: Optional[Dict] = None) -> int:
@@ -137,18 +528,18 @@ class DatabaseManager:
                 json.dumps(attachments) if attachments else None
             ))
             conn.commit()
-            logger.info(f"添加待发送消息: {cursor.lastrowid}")
+            logger.info("添加待发送消息: %s", cursor.lastrowid)
             return cursor.lastrowid
 
-    def get_outgoing_messages(self, limit: int = 100) -> List[Dict[str, Any]]:
-        """获取待发送的回复消息"""
+    def get_outgoing_messages(self, limit: int = 100, after_id: int = 0) -> List[Dict[str, Any]]:
+        """获取待发送的回复消息，按主键升序，只返回主键大于 after_id 的消息"""
         with self.get_connection() as conn:
             cursor = conn.execute("""
                 SELECT * FROM outgoing_messages 
-                WHERE status = 'pending' 
-                ORDER BY timestamp ASC 
+                WHERE status = 'pending' AND id > ? 
+                ORDER BY id ASC 
                 LIMIT ?
-            """, (limit,))
+            """, (after_id or 0, limit))
             rows = cursor.fetchall()
             return [dict(row) for row in rows]
 
@@ -162,9 +553,31 @@ class DatabaseManager:
             """, (message_id,))
             conn.commit()
             affected = cursor.rowcount
-            logger.info(f"标记消息已发送: {message_id}")
+            logger.info("标记消息已发送: %s", message_id)
             return affected > 0
 
+    def backlog_stats(self) -> Dict[str, Any]:
+        """
+        积压情况：未处理消息数、待发送回复数、最早未处理消息的等待秒数（没有积压时为0）
+        计数走部分索引，开销只与积压量有关
+        """
+        with self.get_connection() as conn:
+            unprocessed = conn.execute(
+                "SELECT COUNT(*) FROM incoming_messages WHERE processed = 0").fetchone()[0]
+            pending = conn.execute(
+                "SELECT COUNT(*) FROM outgoing_messages WHERE status = 'pending'").fetchone()[0]
+            row = conn.execute("""
+                SELECT (julianday('now') - julianday(timestamp)) * 86400 FROM incoming_messages
+                WHERE processed = 0
+                ORDER BY id ASC
+                LIMIT 1
+            """).fetchone()
+        return {
+            'unprocessed': unprocessed,
+            'pending_outgoing': pending,
+            'oldest_unprocessed_age': max(0.0, row[0] or 0.0) if row else 0.0,
+        }
+
     def get_message_by_id(self, message_id: int, table: str = 'incoming') -> Optional[Dict[str, Any]]:
         """根据ID获取消息"""
         with self.get_connection() as conn:
@@ -173,17 +586,122 @@ class DatabaseManager:
                 WHERE id = ?
             """, (message_id,))
             row = cursor.fetchone()
-            return dict(row) if row else None
+            return self._incoming_row(row) if row else None
+
+    # 可归档清理的表及其完成条件
+    RETENTION_TABLES = {
+        'incoming_messages': 'processed = 1',
+        'outgoing_messages': "status = 'sent'",
+    }
+    # 归档写入的字段（领取、租约等运行时状态不归档）
+    RETENTION_ARCHIVE_COLUMNS = {
+        'incoming_messages': 'id, timestamp, message_id, sender_id, chat_id, content, message_type, attachments, '
+                             'raw_data',
+        'outgoing_messages': 'id, timestamp, recipient_id, content, message_type, attachments, sent_at',
+    }
 
-    def cleanup_old_messages(self, days: int = 30) -> int:
-        """清理旧消息"""
+    def find_retention_boundary(self, table: str, days: float) -> int:
+        """
+        返回第一条未超过保留期的记录主键（全部过期时为最大主键+1）
+        主键与写入时间同序，按主键二分查找，不扫描历史数据
+        """
+        if table not in self.RETENTION_TABLES:
+            raise ValueError(f"不支持清理的表: {table}")
         with self.get_connection() as conn:
-            cursor = conn.execute("""
-                DELETE FROM incoming_messages 
-                WHERE timestamp < datetime('now', '-' || ? || ' days')
-                AND processed = 1 AND response_sent = 1
-            """, (days,))
-            deleted = cursor.rowcount
-            conn.commit()
-            logger.info(f"清理了 {deleted} 条旧消息")
-            return deleted
\ No newline at end of file
+            cutoff = conn.execute("SELECT datetime('now', ?)", (f'-{days} days',)).fetchone()[0]
+            lo, hi = conn.execute(f"SELECT MIN(id), MAX(id) FROM {table}").fetchone()
+            if lo is None:
+                return 0
+            hi += 1
+            while lo < hi:
+                mid = (lo + hi) // 2
+                row = conn.execute(f"""
+                    SELECT id, timestamp FROM {table} 
+                    WHERE id >= ? 
+                    ORDER BY id 
+                    LIMIT 1
+                """, (mid,)).fetchone()
+                if row is None or row['timestamp'] >= cutoff:
+                    hi = mid
+                else:
+                    lo = row['id'] + 1
+            return lo
+
+    def get_expired_rows(self, table: str, before_id: int, after_id: int = 0,
+                         limit: int = 500) -> List[Dict[str, Any]]:
+        """按主键顺序获取 (after_id, before_id) 区间内已完成的记录（只含归档字段，raw_data 解压为文本）"""
+        condition = self.RETENTION_TABLES[table]
+        with self.get_connection() as conn:
+            cursor = conn.execute(f"""
+                SELECT {self.RETENTION_ARCHIVE_COLUMNS[table]} FROM {table} 
+                WHERE id > ? AND id < ? AND {condition} 
+                ORDER BY id 
+                LIMIT ?
+            """, (after_id, before_id, limit))
+            return [self._incoming_row(row) for row in cursor.fetchall()]
+
+    def get_expired_ids(self, table: str, before_id: int, after_id: int = 0, limit: int = 500) -> List[int]:
+        """按主键顺序获取 (after_id, before_id) 区间内已完成记录的ID（不归档时使用，不读取记录内容）"""
+        condition = self.RETENTION_TABLES[table]
+        with self.get_connection() as conn:
+            cursor = conn.execute(f"""
+                SELECT id FROM {table} 
+                WHERE id > ? AND id < ? AND {condition} 
+                ORDER BY id 
+                LIMIT ?
+            """, (after_id, before_id, limit))
+            return [row[0] for row in cursor.fetchall()]
+
+    def delete_rows(self, table: str, ids: List[int]) -> int:
+        """按主键删除记录（单事务），返回删除条数"""
+        if table not in self.RETENTION_TABLES:
+            raise ValueError(f"不支持清理的表: {table}")
+        deleted = 0
+        with self.get_connection() as conn:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor = conn.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", chunk)
+                deleted += cursor.rowcount
+        return deleted
+
+    def auto_vacuum_mode(self) -> int:
+        """当前 auto_vacuum 模式：0 NONE，1 FULL，2 INCREMENTAL"""
+        with self.get_connection() as conn:
+            return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+
+    def freelist_count(self) -> int:
+        """数据库中空闲页数"""
+        with self.get_connection() as conn:
+            return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def incremental_vacuum(self, pages: int) -> int:
+        """回收最多 pages 个空闲页，返回实际回收的页数"""
+        with self.get_connection() as conn:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # execute() 只执行一步（回收一页），executescript() 才会执行到底
+            conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+            after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return before - after
+
+    def enable_incremental_vacuum(self):
+        """将已有数据库转换为 INCREMENTAL 模式（执行一次完整 VACUUM，期间阻塞写入）"""
+        with self.get_connection() as conn:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+        logger.info("数据库已转换为 incremental_vacuum 模式")
+
+    def cleanup_old_messages(self, days: int = 30, batch_size: int = 500) -> int:
+        """按批删除超过保留天数且已完成的消息（不归档，归档清理见 retention.py）"""
+        deleted = 0
+        for table in self.RETENTION_TABLES:
+            before_id = self.find_retention_boundary(table, days)
+            after_id = 0
+            while True:
+                ids = self.get_expired_ids(table, before_id, after_id, batch_size)
+                if not ids:
+                    break
+                after_id = ids[-1]
+                deleted += self.delete_rows(table, ids)
+        logger.info("清理了 %s 条旧消息", deleted)
+        return deleted
@@ -0,0 +1,437 @@
+"""
+多进程模式（WORKERS > 1，仅 Flask 模式）
+
+- 主进程是唯一的写进程：持有各分片的数据库（建表与迁移只在这里执行）、写入队列、归档清理任务、限流器
+  和去重缓存，不处理 HTTP 请求，在 Unix socket 上执行 worker 转发的写调用（multiprocessing.connection，authkey 校验）
+- 主进程创建监听端口后启动 WORKERS 个 worker 进程，共享同一个监听 socket 接受连接；
+  worker 各自打开数据库只做读取（WAL 下读不阻塞写），写操作通过 WriterClient 转发给主进程，
+  SQLite 始终只有一个写进程，不会出现多进程争用写锁导致的 database is locked
+- 新消息通知由主进程广播给各 worker，用于唤醒长轮询和推送流
+- /metrics 由主进程汇总：通过同一条通知连接向各 worker 索取指标快照，与主进程自己的指标相加后输出；
+  已退出 worker 的计数器保留最后一次取值，重启后总数不会回退
+- worker 异常退出时由主进程重新拉起；主进程退出后 worker 随之退出
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import threading
+import subprocess
+from functools import partial
+from multiprocessing.connection import Listener, Client
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# worker 可以转发给写进程的调用，按目标对象划分；不在列表中的方法在 worker 本地执行（读操作）
+WRITE_METHODS = {
+    'db': frozenset([
+        'add_incoming_message', 'add_incoming_messages', 'claim_messages', 'renew_lease',
+        'ack_messages', 'release_messages', 'mark_message_processed', 'mark_messages_processed',
+        'add_outgoing_message', 'mark_outgoing_sent',
+    ]),
+    'ingest_queue': frozenset(['put', 'stats']),
+    'retention_job': frozenset(['stats']),
+    'rate_limiter': frozenset(['acquire', 'stats']),
+    # 不按分片划分的对象
+    'dedup_cache': frozenset(['contains', 'add', 'stats']),
+}
+
+# 汇总指标时等待每个 worker 返回快照的时间（秒），超时的 worker 使用上一次的快照
+SNAPSHOT_TIMEOUT = 2.0
+
+
+class WriterServer:
+    """写进程的 IPC 服务端：每个 worker 连接一个线程，按顺序执行调用并返回结果"""
+
+    def __init__(self, shards, address: str, authkey: bytes, metrics=None, shared: Optional[Dict[str, Any]] = None):
+        """
+        :param metrics: 主进程的指标注册表，汇总各 worker 的快照后输出
+        :param shared: 不按分片划分、由写进程持有的对象（如去重缓存），按 WRITE_METHODS 中的名称查找
+        """
+        self.shards = shards
+        self.address = address
+        self.authkey = authkey
+        self.metrics = metrics
+        self.shared = shared or {}
+        self._listener = None
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._subscribers = []
+        # 通知连接上的发送（广播线程与指标汇总）串行执行；同一时间只有一次指标汇总在读取回复
+        self._send_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._snapshot_seq = 0
+        self._snapshots = {}
+        self._retired = {}
+        self._pending = set()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._calls = 0
+        self._errors = 0
+
+    def start(self):
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self._listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        os.chmod(self.address, 0o600)
+        for shard in self.shards:
+            shard.db.add_message_listener(partial(self._on_new_message, shard.app_id))
+        threading.Thread(target=self._accept_loop, name="WriterAccept", daemon=True).start()
+        threading.Thread(target=self._broadcast_loop, name="WriterNotify", daemon=True).start()
+        logger.info("写进程 IPC 已启动: %s", self.address)
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._listener:
+            self._listener.close()
+        with self._lock:
+            connections = list(self._connections) + self._subscribers
+        for conn in connections:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'connections': len(self._connections),
+                'subscribers': len(self._subscribers),
+                'calls': self._calls,
+                'errors': self._errors,
+            }
+
+    def _accept_loop(self):
+        while not self._stopped:
+            try:
+                conn = self._listener.accept()
+            except Exception as e:
+                if not self._stopped:
+                    logger.warning("写进程 IPC 接受连接失败: %s", e)
+                    time.sleep(0.1)
+                continue
+            with self._lock:
+                self._connections.add(conn)
+            threading.Thread(target=self._serve, args=(conn,), name="WriterConn", daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if request == 'subscribe':
+                    # 订阅连接只用于推送新消息通知，不再接收调用
+                    with self._lock:
+                        self._subscribers.append(conn)
+                    return
+                response = self._execute(*request)
+                try:
+                    conn.send(response)
+                except (OSError, ValueError):
+                    return
+                except Exception:
+                    # 异常对象无法序列化时只传回错误信息
+                    conn.send(('error', RuntimeError(str(response[1]))))
+        finally:
+            with self._lock:
+                self._connections.discard(conn)
+                subscribed = conn in self._subscribers
+            if not subscribed:
+                conn.close()
+
+    def _execute(self, app_id: str, target: str, method: str, args: tuple, kwargs: dict) -> tuple:
+        with self._lock:
+            self._calls += 1
+        try:
+            if target == 'writer' and method == 'stats':
+                return 'ok', self.stats()
+            if target == 'writer' and method == 'metrics':
+                return 'ok', self.render_metrics()
+            if method not in WRITE_METHODS.get(target, ()):
+                raise ValueError(f'method not allowed: {target}.{method}')
+            if target in self.shared:
+                obj = self.shared[target]
+            else:
+                shard = self.shards.get(app_id)
+                obj = getattr(shard, target, None) if shard else None
+            if obj is None:
+                raise ValueError(f'no {target} for app_id: {app_id}')
+            return 'ok', getattr(obj, method)(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            logger.error("执行写调用失败(%s.%s): %s", target, method, e)
+            return 'error', e
+
+    def _on_new_message(self, app_id: str):
+        """在写入线程中调用，只登记待通知的分片，由广播线程发送，避免写入被慢 worker 阻塞"""
+        with self._lock:
+            self._pending.add(app_id)
+        self._wakeup.set()
+
+    def _broadcast_loop(self):
+        while not self._stopped:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                pending, self._pending = self._pending, set()
+                subscribers = list(self._subscribers)
+            for conn in subscribers:
+                try:
+                    with self._send_lock:
+                        for app_id in pending:
+                            conn.send(app_id)
+                except (OSError, ValueError):
+                    self._drop_subscriber(conn)
+
+    def _drop_subscriber(self, conn):
+        """worker 已退出：移除通知连接，其最后一次快照中的计数器并入 _retired"""
+        with self._lock:
+            if conn in self._subscribers:
+                self._subscribers.remove(conn)
+            snapshot = self._snapshots.pop(conn, None)
+            if snapshot and self.metrics:
+                self.metrics.retain(self._retired, snapshot)
+        conn.close()
+
+    def render_metrics(self) -> str:
+        """向各 worker 索取指标快照，与主进程的指标相加后输出 Prometheus 文本"""
+        with self._metrics_lock:
+            self._snapshot_seq += 1
+            seq = self._snapshot_seq
+            with self._lock:
+                subscribers = list(self._subscribers)
+            requested = []
+            for conn in subscribers:
+                try:
+                    with self._send_lock:
+                        conn.send(('snapshot', seq))
+                    requested.append(conn)
+                except (OSError, ValueError):
+                    self._drop_subscriber(conn)
+
+            deadline = time.monotonic() + SNAPSHOT_TIMEOUT
+            for conn in requested:
+                try:
+                    # 丢弃之前超时的请求迟到的回复
+                    while conn.poll(max(0.0, deadline - time.monotonic())):
+                        _, reply_seq, snapshot = conn.recv()
+                        if reply_seq == seq:
+                            with self._lock:
+                                self._snapshots[conn] = snapshot
+                            break
+                    else:
+                        logger.warning("worker 指标快照超时，使用上一次的快照")
+                except (EOFError, OSError):
+                    self._drop_subscriber(conn)
+
+            with self._lock:
+                snapshots = list(self._snapshots.values()) + [self._retired]
+        return self.metrics.render(snapshots)
+
+
+class WriterClient:
+    """worker 侧的 IPC 客户端，连接按线程借用（multiprocessing 连接不是线程安全的）"""
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return Client(self.address, family='AF_UNIX', authkey=self.authkey)
+
+    def call(self, app_id: str, target: str, method: str, *args, **kwargs):
+        """在写进程中执行调用，写进程抛出的异常在这里重新抛出"""
+        conn = self._acquire()
+        try:
+            conn.send((app_id, target, method, args, kwargs))
+            status, value = conn.recv()
+        except (OSError, EOFError) as e:
+            conn.close()
+            raise ConnectionError(f'写进程不可用: {e}')
+        with self._lock:
+            self._idle.append(conn)
+        if status == 'error':
+            raise value
+        return value
+
+    def writer_stats(self) -> Dict[str, Any]:
+        return self.call('', 'writer', 'stats')
+
+    def metrics(self) -> str:
+        """主进程汇总全部进程后的 Prometheus 文本"""
+        return self.call('', 'writer', 'metrics')
+
+    def proxy(self, app_id: str, target: str, local=None) -> 'RemoteProxy':
+        return RemoteProxy(self, app_id, target, local)
+
+    def subscribe(self, on_message, on_lost, on_snapshot=None):
+        """
+        订阅新消息通知：on_message(app_id) 在后台线程中调用；
+        连接断开（写进程退出）时调用 on_lost；
+        写进程汇总指标时在同一条连接上索取快照，由 on_snapshot() 返回本进程的指标取值
+        """
+        conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+        conn.send('subscribe')
+
+        def run():
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    on_lost()
+                    return
+                if isinstance(message, tuple) and message[0] == 'snapshot':
+                    try:
+                        snapshot = on_snapshot() if on_snapshot else {}
+                    except Exception as e:
+                        logger.error("导出指标快照失败: %s", e)
+                        snapshot = {}
+                    try:
+                        conn.send(('snapshot', message[1], snapshot))
+                    except (OSError, ValueError):
+                        pass
+                    continue
+                try:
+                    on_message(message)
+                except Exception as e:
+                    logger.error("处理新消息通知失败: %s", e)
+
+        threading.Thread(target=run, name="WriterSubscribe", daemon=True).start()
+
+
+class RemoteProxy:
+    """
+    worker 中代替写进程对象（数据库、写入队列、归档清理任务、限流器、去重缓存）的代理
+    写方法转发给写进程，其余属性交给本地对象（只读数据库连接）
+    """
+
+    def __init__(self, client: WriterClient, app_id: str, target: str, local=None):
+        self._client = client
+        self._app_id = app_id
+        self._target = target
+        self._methods = WRITE_METHODS[target]
+        self._local = local
+
+    def __getattr__(self, name):
+        if name in self._methods:
+            return partial(self._client.call, self._app_id, self._target, name)
+        if self._local is not None:
+            return getattr(self._local, name)
+        raise AttributeError(name)
+
+    def notify_new_messages(self):
+        """写进程广播的新消息通知，唤醒本 worker 内的长轮询与推送流"""
+        self._local._notify_new_messages()
+
+    def stop(self, timeout: float = 10):
+        """写入队列与清理任务由写进程负责停止"""
+
+
+class WorkerPool:
+    """启动并看护 worker 进程：共享监听 socket，异常退出后重新拉起"""
+
+    def __init__(self, count: int, listen_fd: int, env: Dict[str, str], restart_delay: float = 1.0):
+        self.count = count
+        self.listen_fd = listen_fd
+        self.env = env
+        self.restart_delay = restart_delay
+        self._procs: List[Optional[subprocess.Popen]] = [None] * count
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.restarts = 0
+
+    def _spawn(self, index: int) -> subprocess.Popen:
+        env = dict(self.env, PREFORK_WORKER_INDEX=str(index))
+        proc = subprocess.Popen([sys.executable, os.path.abspath(sys.argv[0])], env=env,
+                                pass_fds=(self.listen_fd,))
+        logger.info("worker %s 已启动，PID: %s", index, proc.pid)
+        return proc
+
+    def start(self):
+        for index in range(self.count):
+            self._procs[index] = self._spawn(index)
+        self._thread = threading.Thread(target=self._watch, name="WorkerWatch", daemon=True)
+        self._thread.start()
+
+    def _watch(self):
+        while not self._stop_event.wait(self.restart_delay):
+            for index, proc in enumerate(self._procs):
+                if proc.poll() is not None and not self._stop_event.is_set():
+                    logger.error("worker %s (PID %s) 退出，退出码 %s，重新启动", index, proc.pid, proc.returncode)
+                    self.restarts += 1
+                    self._procs[index] = self._spawn(index)
+
+    def stop(self, timeout: float = 10):
+        """先发 SIGTERM 让 worker 处理完当前请求，超时后强制结束"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        for proc in self._procs:
+            if proc and proc.poll() is None:
+                proc.terminate()
+        deadline = time.monotonic() + timeout
+        for proc in self._procs:
+            if not proc:
+                continue
+            try:
+                proc.wait(timeout=max(0.1, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.warning("worker PID %s 未在 %s 秒内退出，强制结束", proc.pid, timeout)
+                proc.kill()
+                proc.wait()
+
+
+def run_master(shards, host: str, port: int, workers: int, socket_path: str, metrics=None,
+               shared: Optional[Dict[str, Any]] = None):
+    """主进程：启动写进程 IPC 与 worker 进程，阻塞到收到 SIGTERM/SIGINT"""
+    authkey = os.urandom(32)
+    writer = WriterServer(shards, socket_path, authkey, metrics, shared)
+    writer.start()
+
+    listen_sock = socket.create_server((host, port), backlog=1024)
+    # 多个 worker 在同一个 socket 上 accept，非阻塞避免没抢到连接的 worker 卡在 accept 上
+    listen_sock.setblocking(False)
+    env = dict(os.environ,
+               PREFORK_ROLE='worker',
+               PREFORK_LISTEN_FD=str(listen_sock.fileno()),
+               PREFORK_SOCKET=socket_path,
+               PREFORK_AUTHKEY=authkey.hex())
+    pool = WorkerPool(workers, listen_sock.fileno(), env)
+    pool.start()
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    try:
+        while not stop_event.wait(1):
+            pass
+    finally:
+        logger.info("正在停止 worker 进程")
+        pool.stop()
+        listen_sock.close()
+        writer.stop()
+
+
+def serve_worker(app, host: str, port: int):
+    """worker 进程：在主进程创建的监听 socket 上处理 HTTP 请求"""
+    from werkzeug.serving import make_server
+
+    server = make_server(host, port, app, threaded=True, fd=int(os.environ['PREFORK_LISTEN_FD']))
+
+    def on_sigterm(signum, frame):
+        # stop.sh 与主进程都会发 SIGTERM，退出清理期间忽略后续信号
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    server.serve_forever()
@@ -0,0 +1,102 @@
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedTokenBuckets:
+    """
+    按键划分的令牌桶：每秒补充 rate 个令牌，最多 burst 个
+    空闲到令牌补满的桶与新桶等价，直接淘汰（LRU 顺序，惰性清理）；
+    桶数超过 max_keys 时淘汰最久未用的桶，内存有上界
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_keys = max(1, max_keys)
+        # 令牌从 0 补满所需时间，空闲超过该时间的桶已满
+        self.idle_ttl = self.burst / rate
+        # key -> [令牌数, 上次更新时间]
+        self._buckets = OrderedDict()
+        self.evicted = 0
+
+    def bucket(self, key: str, now: float) -> list:
+        """取出键对应的桶并按经过的时间补充令牌，返回 [令牌数, 上次更新时间]"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self.expire(now)
+            bucket = [self.burst, now]
+            self._buckets[key] = bucket
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def expire(self, now: float):
+        """淘汰已补满的空闲桶，以及超出容量的最久未用的桶"""
+        while self._buckets:
+            key, (tokens, last) = next(iter(self._buckets.items()))
+            if now - last < self.idle_ttl and len(self._buckets) < self.max_keys:
+                break
+            del self._buckets[key]
+            if now - last < self.idle_ttl:
+                self.evicted += 1
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RateLimiter:
+    """
+    webhook 限流：全局、按发送者（sender_id）、按会话（chat_id）三级令牌桶
+    三级都有令牌时才放行并同时扣减，被拒绝的事件不消耗任何一级的令牌；
+    速率为每分钟事件数，0 表示该级不限流
+    """
+
+    SCOPES = ('global', 'sender', 'chat')
+
+    def __init__(self, global_rate: float = 0, global_burst: float = 0,
+                 sender_rate: float = 0, sender_burst: float = 0,
+                 chat_rate: float = 0, chat_burst: float = 0,
+                 max_keys: int = 10000):
+        self._limits = {}
+        for scope, rate, burst in (('global', global_rate, global_burst),
+                                   ('sender', sender_rate, sender_burst),
+                                   ('chat', chat_rate, chat_burst)):
+            if rate > 0:
+                self._limits[scope] = KeyedTokenBuckets(rate / 60.0, burst or rate, max_keys)
+        self._lock = threading.Lock()
+        self._allowed = 0
+        self._limited = {scope: 0 for scope in self.SCOPES}
+
+    def acquire(self, sender_id: str, chat_id: str) -> Optional[str]:
+        """放行返回 None，超限返回触发限流的级别（global / sender / chat）"""
+        keys = {'global': '', 'sender': sender_id or '', 'chat': chat_id or ''}
+        now = time.monotonic()
+        with self._lock:
+            buckets = []
+            for scope, limits in self._limits.items():
+                bucket = limits.bucket(keys[scope], now)
+                if bucket[0] < 1:
+                    self._limited[scope] += 1
+                    return scope
+                buckets.append(bucket)
+            for bucket in buckets:
+                bucket[0] -= 1
+            self._allowed += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """放行数、各级限流次数与桶数量"""
+        with self._lock:
+            return {
+                'allowed': self._allowed,
+                'limited': dict(self._limited),
+                'buckets': {scope: len(limits) for scope, limits in self._limits.items()},
+                'evicted': sum(limits.evicted for limits in self._limits.values()),
+            }
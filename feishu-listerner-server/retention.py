@@ -0,0 +1,212 @@
+import os
+import sys
+import gzip
+import json
+import time
+import logging
+import argparse
+import threading
+from typing import Dict, Any, List, Optional, Callable
+
+from models import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionJob:
+    """
+    过期消息归档清理任务
+    已处理的接收消息、已发送的回复超过保留天数后，按批写入按天分段的 gzip JSONL 归档文件再删除；
+    每批一个短事务，批次之间暂停让出写锁，webhook 写入不会被长时间阻塞；
+    清理结束后用 incremental_vacuum 分批回收空闲页
+    """
+
+    def __init__(self, db: DatabaseManager, days: float = 30, interval: float = 3600,
+                 archive_dir: Optional[str] = './archive', batch_size: int = 500,
+                 batch_pause_ms: float = 50, vacuum_pages: int = 1000,
+                 on_deleted: Optional[Callable[[str, int], None]] = None):
+        """
+        :param on_deleted: 每批删除后调用 on_deleted(table, deleted)（用于累加指标）
+        """
+        self.db = db
+        self.days = days
+        self.interval = interval
+        self.archive_dir = archive_dir or None
+        self.batch_size = max(1, batch_size)
+        self.batch_pause = max(0.0, batch_pause_ms) / 1000.0
+        self.vacuum_pages = max(1, vacuum_pages)
+        self.on_deleted = on_deleted
+
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # 统计
+        self._runs = 0
+        self._archived = {table: 0 for table in DatabaseManager.RETENTION_TABLES}
+        self._deleted = {table: 0 for table in DatabaseManager.RETENTION_TABLES}
+        self._vacuumed_pages = 0
+        self._last_run_at = None
+        self._last_duration = None
+        self._last_error = None
+
+    def start(self):
+        """启动后台清理线程，首次清理在启动后最多一分钟内执行"""
+        if self._thread and self._thread.is_alive():
+            return
+        if self.db.auto_vacuum_mode() != 2:
+            logger.warning("数据库未启用 incremental_vacuum，删除后的空间不会归还给文件系统，"
+                           "可在停服后执行: python retention.py --enable-incremental-vacuum")
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="RetentionJob")
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("消息归档清理已启动，保留 %s 天，间隔 %s 秒，归档目录: %s",
+                    self.days, self.interval, self.archive_dir or '不归档')
+
+    def stop(self, timeout: float = 10):
+        """停止清理线程，进行中的批次会在当前批次结束后退出"""
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+            if self._thread.is_alive():
+                logger.warning("归档清理线程未正常退出")
+
+    def _run(self):
+        delay = min(60.0, self.interval)
+        while not self._stop_event.wait(delay):
+            try:
+                self.run_once()
+            except Exception as e:
+                with self._lock:
+                    self._last_error = str(e)
+                logger.error("归档清理失败: %s", e, exc_info=True)
+            delay = self.interval
+
+    def run_once(self) -> Dict[str, Any]:
+        """执行一轮归档清理，返回各表处理条数及回收的页数"""
+        started = time.monotonic()
+        result = {}
+        for table in DatabaseManager.RETENTION_TABLES:
+            result[table] = self._purge_table(table)
+            if self._stop_event.is_set():
+                break
+        result['vacuumed_pages'] = self._vacuum()
+
+        duration = time.monotonic() - started
+        with self._lock:
+            self._runs += 1
+            self._last_run_at = time.time()
+            self._last_duration = round(duration, 3)
+            self._last_error = None
+        if any(result.values()):
+            logger.info("归档清理完成: %s，耗时 %.2f 秒", result, duration)
+        return result
+
+    def _purge_table(self, table: str) -> int:
+        before_id = self.db.find_retention_boundary(table, self.days)
+        after_id = 0
+        purged = 0
+        while not self._stop_event.is_set():
+            # 不归档时只读取ID，不读取和解压记录内容
+            if self.archive_dir:
+                rows = self.db.get_expired_rows(table, before_id, after_id, self.batch_size)
+                ids = [row['id'] for row in rows]
+            else:
+                ids = self.db.get_expired_ids(table, before_id, after_id, self.batch_size)
+            if not ids:
+                break
+            after_id = ids[-1]
+            # 先归档再删除：中途退出时最多重复归档，不会丢失
+            if self.archive_dir:
+                self._archive(table, rows)
+                with self._lock:
+                    self._archived[table] += len(rows)
+            deleted = self.db.delete_rows(table, ids)
+            purged += deleted
+            with self._lock:
+                self._deleted[table] += deleted
+            if self.on_deleted:
+                self.on_deleted(table, deleted)
+            if self.batch_pause:
+                self._stop_event.wait(self.batch_pause)
+        return purged
+
+    def _archive(self, table: str, rows: List[Dict[str, Any]]):
+        """按记录日期追加到 <archive_dir>/<table>/<YYYY-MM-DD>.jsonl.gz（每批一个 gzip 成员）"""
+        segments = {}
+        for row in rows:
+            day = str(row.get('timestamp') or 'unknown')[:10]
+            segments.setdefault(day, []).append(row)
+
+        table_dir = os.path.join(self.archive_dir, table)
+        os.makedirs(table_dir, exist_ok=True)
+        for day, day_rows in segments.items():
+            data = ''.join(json.dumps(row, ensure_ascii=False, default=str) + '\n' for row in day_rows)
+            with open(os.path.join(table_dir, f'{day}.jsonl.gz'), 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='ab') as gz:
+                    gz.write(data.encode('utf-8'))
+                raw.flush()
+                os.fsync(raw.fileno())
+
+    def _vacuum(self) -> int:
+        """分批回收空闲页，每批之间暂停"""
+        if self.db.auto_vacuum_mode() != 2:
+            return 0
+        total = 0
+        while not self._stop_event.is_set():
+            freed = self.db.incremental_vacuum(self.vacuum_pages)
+            total += freed
+            if freed < self.vacuum_pages:
+                break
+            if self.batch_pause:
+                self._stop_event.wait(self.batch_pause)
+        with self._lock:
+            self._vacuumed_pages += total
+        return total
+
+    def stats(self) -> Dict[str, Any]:
+        """归档清理统计"""
+        with self._lock:
+            return {
+                'days': self.days,
+                'interval': self.interval,
+                'archive_dir': self.archive_dir,
+                'runs': self._runs,
+                'archived': dict(self._archived),
+                'deleted': dict(self._deleted),
+                'vacuumed_pages': self._vacuumed_pages,
+                'last_run_at': self._last_run_at,
+                'last_duration': self._last_duration,
+                'last_error': self._last_error,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='公网服务消息归档清理')
+    parser.add_argument('--db', default=os.getenv('DB_PATH', './feishu_messages.db'), help='数据库路径')
+    parser.add_argument('--days', type=float, default=float(os.getenv('RETENTION_DAYS', 0)),
+                        help='保留天数，默认取 RETENTION_DAYS，必须大于 0')
+    parser.add_argument('--archive-dir', default=os.getenv('RETENTION_ARCHIVE_DIR', './archive'),
+                        help='归档目录，传空字符串表示只删除不归档')
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('RETENTION_BATCH_SIZE', 500)))
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help='将已有数据库转换为 incremental_vacuum 模式（完整 VACUUM，需停服执行）')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if not args.enable_incremental_vacuum and args.days <= 0:
+        parser.error('请通过 --days 或 RETENTION_DAYS 指定大于 0 的保留天数')
+
+    db = DatabaseManager(args.db)
+    if args.enable_incremental_vacuum:
+        db.enable_incremental_vacuum()
+    else:
+        job = RetentionJob(db, days=args.days, archive_dir=args.archive_dir, batch_size=args.batch_size)
+        print(json.dumps(job.run_once(), ensure_ascii=False))
+    db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
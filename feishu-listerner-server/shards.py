@@ -0,0 +1,155 @@
+import os
+import json
+import logging
+import threading
+from typing import Dict, Any, List, Optional
+
+from models import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+def load_app_tokens(spec: str) -> Dict[str, str]:
+    """
+    解析 FEISHU_APPS：JSON 对象，键为飞书应用 app_id，值为该应用的 Verification Token
+    例如 {"cli_a1b2": "token_a", "cli_c3d4": "token_b"}；为空表示单机器人模式。
+    不带 app_id 的事件按 token 识别所属应用，因此各应用的 token 必须互不相同
+    """
+    if not spec or not spec.strip():
+        return {}
+    apps = json.loads(spec)
+    if not isinstance(apps, dict) or not all(isinstance(k, str) and k and isinstance(v, str)
+                                             for k, v in apps.items()):
+        raise ValueError('FEISHU_APPS 必须是 {"app_id": "verification_token"} 格式的 JSON 对象')
+    owners = {}
+    for app_id, token in apps.items():
+        if token in owners:
+            raise ValueError(f'FEISHU_APPS 中 {owners[token]} 与 {app_id} 使用了相同的 Verification Token')
+        owners[token] = app_id
+    return apps
+
+
+def shard_db_path(db_path: str, app_id: str) -> str:
+    """分片数据库路径：./feishu_messages.db -> ./feishu_messages.cli_xxx.db"""
+    root, ext = os.path.splitext(db_path)
+    return f'{root}.{app_id}{ext or ".db"}'
+
+
+class Shard:
+    """单个飞书机器人的存储：独立的 SQLite 文件、写入队列、归档清理任务和 webhook 限流器"""
+
+    def __init__(self, app_id: str, token: str, db: DatabaseManager, ingest_queue=None, retention_job=None,
+                 rate_limiter=None):
+        self.app_id = app_id
+        self.token = token
+        self.db = db
+        self.ingest_queue = ingest_queue
+        self.retention_job = retention_job
+        self.rate_limiter = rate_limiter
+
+    def stats(self) -> Dict[str, Any]:
+        """连接池、写入队列与归档清理统计"""
+        result = {'db_pool': self.db.pool_stats()}
+        if self.ingest_queue:
+            result['ingest_queue'] = self.ingest_queue.stats()
+        if self.retention_job:
+            result['retention'] = self.retention_job.stats()
+        if self.rate_limiter:
+            result['rate_limit'] = self.rate_limiter.stats()
+        return result
+
+    def stop(self):
+        """停止清理任务、刷新写入队列并关闭连接池"""
+        if self.retention_job:
+            self.retention_job.stop()
+        if self.ingest_queue:
+            self.ingest_queue.stop()
+        self.db.close()
+
+
+class ShardSet:
+    """
+    按 app_id 划分的分片集合
+    每个机器人一个数据库文件，各自持有写锁，多个机器人的写入互不阻塞；
+    单机器人模式下只有一个 app_id 为空的分片，忽略请求中的 app_id
+    """
+
+    def __init__(self):
+        self._shards = {}
+        self._by_token = {}
+        # 任一分片有新消息时递增，跨分片的长轮询在这里等待
+        self._cond = threading.Condition()
+        self._version = 0
+
+    def add(self, shard: Shard):
+        self._shards[shard.app_id] = shard
+        self._by_token[shard.token] = shard
+        shard.db.add_message_listener(self._notify)
+
+    def __iter__(self):
+        return iter(list(self._shards.values()))
+
+    def __len__(self) -> int:
+        return len(self._shards)
+
+    @property
+    def multi_bot(self) -> bool:
+        return '' not in self._shards
+
+    @property
+    def default(self) -> Shard:
+        """单机器人模式下的唯一分片；多机器人模式下为第一个分片"""
+        return next(iter(self._shards.values()))
+
+    def get(self, app_id: Optional[str]) -> Optional[Shard]:
+        """按 app_id 查找分片，单机器人模式下总是返回唯一分片"""
+        if not self.multi_bot:
+            return self.default
+        return self._shards.get(app_id)
+
+    def route(self, app_id: Optional[str], token: Optional[str]) -> Optional[Shard]:
+        """
+        为飞书事件选择分片并校验 token，校验失败返回 None
+        带 app_id 的事件按 app_id 路由，未配置的 app_id 直接拒绝；
+        schema 1.0 的事件可能不带 app_id，按 token 识别所属应用
+        """
+        if app_id and self.multi_bot:
+            shard = self._shards.get(app_id)
+            return shard if shard and token == shard.token else None
+        return self._by_token.get(token)
+
+    def has_token(self, token: Optional[str]) -> bool:
+        return token in self._by_token
+
+    def select(self, app_id: Optional[str]) -> List[Shard]:
+        """API 请求涉及的分片：指定 app_id 时为对应分片（不存在时为空），否则为全部分片"""
+        if app_id and self.multi_bot:
+            shard = self._shards.get(app_id)
+            return [shard] if shard else []
+        return list(self._shards.values())
+
+    def _notify(self):
+        with self._cond:
+            self._version += 1
+            self._cond.notify_all()
+
+    def message_version(self) -> int:
+        with self._cond:
+            return self._version
+
+    def wait_for_new_messages(self, version: int, timeout: float) -> bool:
+        """等待任一分片有新消息或超时，返回是否有新消息"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._version != version, timeout=timeout)
+
+    def add_message_listener(self, callback):
+        """在每个分片上注册新消息回调"""
+        for shard in self:
+            shard.db.add_message_listener(callback)
+
+    def stop(self):
+        for shard in self:
+            try:
+                shard.stop()
+            except Exception as e:
+                logger.error("关闭分片 %s 失败: %s", shard.app_id or 'default', e)
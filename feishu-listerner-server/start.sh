@@ -18,8 +18,17 @@ if ! command -v python3 &> /dev/null; then
     exit 1
 fi
 
+# 服务模式：flask（默认）或 async（aiohttp，同时依赖 flask）
+if [ "$SERVER_MODE" = "async" ]; then
+    APP_SCRIPT="async_app.py"
+    REQUIRED_MODULES="flask, aiohttp"
+else
+    APP_SCRIPT="app.py"
+    REQUIRED_MODULES="flask"
+fi
+
 # 检查依赖
-if ! python3 -c "import flask" 2>/dev/null; then
+if ! python3 -c "import $REQUIRED_MODULES" 2>/dev/null; then
     echo "正在安装依赖..."
     pip3 install -r requirements.txt
 fi
@@ -29,23 +38,24 @@ PORT=${PORT:-3000}
 if lsof -Pi :$PORT -sTCP:LISTEN -t >/dev/null 2>&1; then
     echo "警告: 端口 $PORT 已被占用"
     echo "正在尝试停止旧进程..."
-    pkill -f "python3 app.py"
+    pkill -f "python3 (async_)?app.py"
     sleep 2
 fi
 
 # 启动服务
 echo "正在启动飞书沟通服务..."
 echo "端口: $PORT"
+echo "模式: ${SERVER_MODE:-flask}"
 echo "日志文件: app.log"
 
-nohup python3 app.py > app.log 2>&1 &
+nohup python3 $APP_SCRIPT > app.log 2>&1 &
 
 sleep 2
 
 # 检查服务是否启动成功
-if pgrep -f "python3 app.py" > /dev/null; then
+if pgrep -f "python3 $APP_SCRIPT" > /dev/null; then
     echo "服务启动成功!"
-    echo "PID: $(pgrep -f 'python3 app.py')"
+    echo "PID: $(pgrep -f "python3 $APP_SCRIPT")"
     echo "健康检查: curl http://localhost:$PORT/health"
 else
     echo "服务启动失败，请查看日志: tail -f app.log"
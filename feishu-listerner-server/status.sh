@@ -3,8 +3,8 @@
 # 飞书沟通服务状态检查脚本
 
 # 检查进程状态
-if pgrep -f "python3 app.py" > /dev/null; then
-    PID=$(pgrep -f "python3 app.py")
+if pgrep -f "python3 (async_)?app.py" > /dev/null; then
+    PID=$(pgrep -f "python3 (async_)?app.py")
     echo "✓ 服务运行中"
     echo "  PID: $PID"
     echo "  启动时间: $(ps -p $PID -o lstart=)"
@@ -5,14 +5,14 @@
 echo "正在停止飞书沟通服务..."
 
 # 查找并停止进程
-if pgrep -f "python3 app.py" > /dev/null; then
-    pkill -f "python3 app.py"
+if pgrep -f "python3 (async_)?app.py" > /dev/null; then
+    pkill -f "python3 (async_)?app.py"
     sleep 2
     
     # 检查是否停止成功
-    if pgrep -f "python3 app.py" > /dev/null; then
+    if pgrep -f "python3 (async_)?app.py" > /dev/null; then
         echo "警告: 服务未能正常停止，尝试强制停止..."
-        pkill -9 -f "python3 app.py"
+        pkill -9 -f "python3 (async_)?app.py"
         sleep 1
     fi
     
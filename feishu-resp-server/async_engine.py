@@ -0,0 +1,740 @@
+"""
+asyncio 处理引擎（python feishu_resp_server.py start --engine=async）
+
+与线程引擎相同的流程：从公网服务获取消息 -> 落本地库 -> 调用 OpenClaw -> 发送到飞书，
+各阶段运行在同一个事件循环上，HTTP 调用基于 aiohttp，阶段之间通过有界的 asyncio.Queue 衔接：
+- 获取：一个协程按 FETCH_MODE（poll / claim / stream）拉取消息，落库后确认公网服务
+- 调度：按入库顺序从本地库取未处理消息，每个发送者同时只派发一条，同一用户的消息与回复严格有序
+- 处理：ASYNC_PROCESS_CONCURRENCY 个协程调用 OpenClaw，成百上千个进行中的对话只占用事件循环一个线程
+- 发送：ASYNC_SEND_CONCURRENCY 个协程调用飞书发送消息接口
+
+本地库仍是唯一的状态来源：消息处理完成才标记已处理，回复发出才标记已发送，退出时进行中的消息下次启动重新处理。
+SQLite 操作在专用线程池中执行，事件循环线程不做阻塞 IO。
+"""
+import os
+import json
+import time
+import signal
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from streaming_reply import StreamingReply, parse_stream_line
+
+# 子 logger，沿用 feishu_resp_server 的日志处理器
+logger = logging.getLogger('feishu_resp_server.async_engine')
+
+# 同时进行中的 OpenClaw 对话数
+ASYNC_PROCESS_CONCURRENCY = int(os.getenv('ASYNC_PROCESS_CONCURRENCY', '100'))
+# 同时进行中的飞书发送请求数
+ASYNC_SEND_CONCURRENCY = int(os.getenv('ASYNC_SEND_CONCURRENCY', '10'))
+# 本地数据库专用线程池大小
+ASYNC_DB_WORKERS = int(os.getenv('ASYNC_DB_WORKERS', '2'))
+
+
+def client_timeout(timeout: tuple, extra: float = 0) -> aiohttp.ClientTimeout:
+    """把 (连接超时, 读超时) 转换为 aiohttp 的超时设置，extra 追加在读超时上"""
+    connect_timeout, read_timeout = timeout
+    return aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout + extra)
+
+
+class AsyncFeishuSender:
+    """
+    DirectFeishuSender 的异步版本，凭证、开放平台地址和超时沿用线程引擎的发送器
+    """
+
+    def __init__(self, sender, session: aiohttp.ClientSession):
+        self.app_id = sender.app_id
+        self.app_secret = sender.app_secret
+        self.api_base = sender.api_base
+        self.timeout = client_timeout(sender.timeout)
+        self.session = session
+        self.access_token = None
+        self.token_expire_time = 0
+        # 令牌过期时只由一个协程刷新
+        self._token_lock = asyncio.Lock()
+
+    async def get_access_token(self) -> Optional[str]:
+        async with self._token_lock:
+            if self.access_token and time.time() < self.token_expire_time - 60:
+                return self.access_token
+
+            url = f"{self.api_base}/open-apis/auth/v3/tenant_access_token/internal"
+            data = {"app_id": self.app_id, "app_secret": self.app_secret}
+            try:
+                async with self.session.post(url, json=data, timeout=self.timeout) as response:
+                    if response.status != 200:
+                        logger.error("请求访问令牌失败: %s - %s", response.status, await response.text())
+                        return None
+                    result = await response.json(content_type=None)
+                if result.get("code") != 0:
+                    logger.error("获取访问令牌失败: %s", result)
+                    return None
+                self.access_token = result.get("tenant_access_token")
+                self.token_expire_time = time.time() + result.get("expire", 7200) - 60
+                logger.info("访问令牌获取成功")
+                return self.access_token
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error("获取访问令牌异常: %s", e)
+                return None
+
+    async def send_message(self, recipient_id: str, content: str, receive_id_type: str = 'open_id') -> bool:
+        return await self.create_message(recipient_id, content, receive_id_type) is not None
+
+    async def create_message(self, recipient_id: str, content: str, receive_id_type: str = 'open_id') -> Optional[str]:
+        """发送文本消息，返回飞书消息ID，失败返回 None，已发出但响应中没有消息ID时返回空字符串"""
+        access_token = await self.get_access_token()
+        if not access_token:
+            logger.error("无法获取访问令牌,无法发送消息")
+            return None
+
+        url = f"{self.api_base}/open-apis/im/v1/messages"
+        headers = {"Authorization": f"Bearer {access_token}"}
+        data = {
+            "receive_id": recipient_id,
+            "msg_type": "text",
+            "content": json.dumps({"text": content})
+        }
+        try:
+            async with self.session.post(url, headers=headers, params={"receive_id_type": receive_id_type},
+                                         json=data, timeout=self.timeout) as response:
+                if response.status != 200:
+                    logger.error("消息发送请求失败: %s - %s", response.status, await response.text())
+                    return None
+                result = await response.json(content_type=None)
+            if result.get("code") != 0:
+                logger.error("消息发送失败: %s", result)
+                return None
+            logger.info("消息发送成功: %.50s...", content)
+            return (result.get("data") or {}).get("message_id") or ''
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error("发送消息异常: %s", e)
+            return None
+
+    async def update_message(self, message_id: str, content: str) -> bool:
+        access_token = await self.get_access_token()
+        if not access_token:
+            logger.error("无法获取访问令牌,无法编辑消息")
+            return False
+
+        url = f"{self.api_base}/open-apis/im/v1/messages/{message_id}"
+        headers = {"Authorization": f"Bearer {access_token}"}
+        data = {"msg_type": "text", "content": json.dumps({"text": content})}
+        try:
+            async with self.session.put(url, headers=headers, json=data, timeout=self.timeout) as response:
+                text = await response.text()
+            if response.status == 200 and json.loads(text).get("code") == 0:
+                return True
+            logger.error("编辑消息失败: %s - %s", response.status, text)
+            return False
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error("编辑消息异常: %s", e)
+            return False
+
+
+class AsyncOpenClawClient:
+    """
+    OpenClawGatewayClient 的异步版本
+    """
+
+    def __init__(self, client, session: aiohttp.ClientSession):
+        self.agent_id = client.agent_id
+        self.gateway_token = client.gateway_token
+        self.chat_url = client.chat_url
+        self.timeout = client_timeout(client.timeout)
+        self.session = session
+
+    def build_request(self, message: str, user_id: str = None, stream: bool = False,
+                      history: List[Dict] = None) -> Tuple[Dict, Dict]:
+        headers = {'Authorization': f'Bearer {self.gateway_token}'}
+        data = {
+            'model': f'openclaw:{self.agent_id}',
+            'messages': [*(history or []), {'role': 'user', 'content': message}],
+            'stream': stream
+        }
+        if user_id:
+            data['user'] = user_id
+        return headers, data
+
+    async def chat(self, message: str, user_id: str = None, history: List[Dict] = None) -> Optional[str]:
+        headers, data = self.build_request(message, user_id, history=history)
+        try:
+            async with self.session.post(self.chat_url, headers=headers, json=data, timeout=self.timeout) as response:
+                response.raise_for_status()
+                text = await response.text()
+            return json.loads(text)['choices'][0]['message']['content']
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("调用 OpenClaw Gateway 失败: %s", e)
+            return None
+        except (ValueError, KeyError, IndexError) as e:
+            logger.error("解析 OpenClaw 响应失败: %s", e)
+            logger.error("响应内容: %s", text)
+            return None
+
+    async def chat_stream(self, message: str, user_id: str = None, history: List[Dict] = None) -> AsyncIterator[str]:
+        """流式对话，逐段产出增量内容；连接失败、流中断或解析失败时抛出异常"""
+        headers, data = self.build_request(message, user_id, stream=True, history=history)
+        async with self.session.post(self.chat_url, headers=headers, json=data, timeout=self.timeout) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                delta = parse_stream_line(line.decode('utf-8').strip())
+                if delta is None:
+                    return
+                if delta:
+                    yield delta
+
+
+class AsyncReplyEngine:
+    """
+    在事件循环上运行 FeishuReplyService 的各个阶段，配置与本地库操作沿用传入的 service
+    """
+
+    def __init__(self, service, process_concurrency: int = None, send_concurrency: int = None):
+        self.service = service
+        self.process_concurrency = max(1, process_concurrency or ASYNC_PROCESS_CONCURRENCY)
+        self.send_concurrency = max(1, send_concurrency or ASYNC_SEND_CONCURRENCY)
+        self.db_executor = ThreadPoolExecutor(max_workers=max(1, ASYNC_DB_WORKERS), thread_name_prefix='AsyncDB')
+        self.stopping = False
+        # 有消息在处理或回复在发送中的发送者 -> 任务数
+        self.busy_senders: Dict[str, int] = {}
+        # stream 模式下已落库、待确认的远程消息ID
+        self.pending_acks: List[int] = []
+        # 以下对象需要在事件循环中创建，见 run_async
+        self.process_queue = None
+        self.send_queue = None
+        self.wakeup = None
+        self.ack_event = None
+        self.stop_event = None
+        self.sender = None
+        self.openclaw = None
+        self.listener_session = None
+        self.loop = None
+
+    def run(self):
+        """运行到收到 SIGTERM/SIGINT（在主线程中运行时）或调用 stop()"""
+        asyncio.run(self.run_async())
+
+    def stop(self):
+        """可从其他线程调用"""
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+
+    async def run_async(self):
+        self.loop = loop = asyncio.get_running_loop()
+        self.process_queue = asyncio.Queue(self.process_concurrency)
+        self.send_queue = asyncio.Queue(self.send_concurrency)
+        self.wakeup = asyncio.Event()
+        self.ack_event = asyncio.Event()
+        self.stop_event = asyncio.Event()
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(signum, self.stop_event.set)
+
+        service = self.service
+        force_close = not service.http_keep_alive
+        # 各服务一个 ClientSession，连接数上限与对应阶段的并发数一致
+        sessions = [
+            aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=service.http_pool_size, force_close=force_close)),
+            aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.send_concurrency, force_close=force_close)),
+            aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.process_concurrency, force_close=force_close)),
+        ]
+        self.listener_session = sessions[0]
+        self.sender = AsyncFeishuSender(service.direct_sender, sessions[1])
+        if service.openclaw_enabled and service.openclaw_client:
+            self.openclaw = AsyncOpenClawClient(service.openclaw_client, sessions[2])
+
+        logger.info("飞书回复服务启动（asyncio 引擎）")
+        logger.info("消息获取模式: %s，消费者ID: %s，OpenClaw 并发: %s，发送并发: %s",
+                    service.fetch_mode, service.consumer_id, self.process_concurrency, self.send_concurrency)
+
+        fetch = self.stream_from_remote() if service.fetch_mode == 'stream' else self.fetch_from_remote()
+        tasks = [asyncio.create_task(fetch, name='fetch'), asyncio.create_task(self.dispatch_loop(), name='dispatch')]
+        workers = [asyncio.create_task(self.process_worker(), name='process') for _ in range(self.process_concurrency)]
+        workers += [asyncio.create_task(self.send_worker(), name='send') for _ in range(self.send_concurrency)]
+
+        try:
+            await self.stop_event.wait()
+        finally:
+            logger.info("正在停止飞书回复服务...")
+            self.stopping = True
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # 等待进行中的消息处理完，排队中与未完成的消息留在本地库中，下次启动时处理
+            await self.drain(timeout=5)
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            for session in sessions:
+                await session.close()
+            self.db_executor.shutdown(wait=True)
+            if service.conversations:
+                logger.info("对话历史缓存统计: %s", service.conversations.stats())
+            if service.response_cache:
+                logger.info("回复缓存统计: %s", service.response_cache.stats())
+            logger.info("飞书回复服务已停止")
+
+    async def drain(self, timeout: float):
+        deadline = time.monotonic() + timeout
+        while self.busy_senders and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.busy_senders:
+            logger.warning("仍有 %s 个发送者的消息未处理完，下次启动时重新处理", len(self.busy_senders))
+
+    async def db(self, func, *args, **kwargs):
+        """在数据库线程池中执行 service 的本地库操作"""
+        return await asyncio.get_running_loop().run_in_executor(self.db_executor, partial(func, *args, **kwargs))
+
+    async def sleep(self, seconds: float):
+        """可被停止信号打断的等待"""
+        try:
+            await asyncio.wait_for(self.stop_event.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    # ---------- 获取阶段 ----------
+
+    def listener_headers(self) -> Dict[str, str]:
+        return {'X-Verification-Code': self.service.verification_code}
+
+    async def listener_request(self, method: str, path: str, extra_timeout: float = 0, **kwargs):
+        """请求公网服务，返回 (状态码, JSON 或文本)；连接失败时返回 (None, 错误)"""
+        url = f"{self.service.api_base_url}{path}"
+        timeout = client_timeout(self.service.http_timeout, extra_timeout)
+        try:
+            async with self.listener_session.request(method, url, headers=self.listener_headers(),
+                                                     timeout=timeout, **kwargs) as response:
+                if response.status == 200:
+                    return 200, await response.json(content_type=None)
+                return response.status, await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            return None, e
+
+    async def get_unprocessed_messages(self) -> List[Dict]:
+        service = self.service
+        params = {'fields': service.REMOTE_FIELDS}
+        if service.long_poll_wait > 0:
+            params['wait'] = str(service.long_poll_wait)
+        if service.app_id:
+            params['app_id'] = service.app_id
+        status, result = await self.listener_request('GET', '/api/messages/unprocessed', service.long_poll_wait,
+                                                     params=params)
+        if status == 200:
+            return result['data'] if 'data' in result else result
+        if status is None:
+            logger.error("请求异常: %s", result)
+        else:
+            logger.error("获取消息失败: %s - %s", status, result)
+        return []
+
+    async def claim_messages(self) -> List[Dict]:
+        service = self.service
+        data = {
+            'consumer_id': service.consumer_id,
+            'lease_seconds': service.lease_seconds,
+            'wait': service.long_poll_wait,
+            'fields': service.REMOTE_FIELDS
+        }
+        if service.app_id:
+            data['app_id'] = service.app_id
+        status, result = await self.listener_request('POST', '/api/messages/claim', service.long_poll_wait, json=data)
+        if status == 200:
+            return result.get('data', [])
+        if status is None:
+            logger.error("请求异常: %s", result)
+        else:
+            logger.error("领取消息失败: %s - %s", status, result)
+        return []
+
+    async def lease_action(self, action: str, message_ids: List[int]) -> bool:
+        service = self.service
+        data = {'consumer_id': service.consumer_id, 'ids': message_ids}
+        if service.app_id:
+            data['app_id'] = service.app_id
+        status, result = await self.listener_request('POST', f'/api/messages/{action}', json=data)
+        if status is None:
+            logger.error("租约操作异常(%s): %s", action, result)
+        elif status != 200:
+            logger.error("租约操作失败(%s): %s - %s", action, status, result)
+        return status == 200
+
+    async def mark_messages_as_processed(self, message_ids: List[int]) -> bool:
+        service = self.service
+        data = {'ids': message_ids}
+        if service.app_id:
+            data['app_id'] = service.app_id
+        status, result = await self.listener_request('POST', '/api/messages/mark-processed', json=data)
+        if status == 404:
+            logger.warning("公网服务不支持批量标记，改为逐条标记")
+            params = {'app_id': service.app_id} if service.app_id else {}
+            results = [await self.listener_request('POST', f'/api/messages/{message_id}/mark-processed', params=params)
+                       for message_id in message_ids]
+            return all(status == 200 for status, _ in results)
+        if status is None:
+            logger.error("批量标记消息为已处理失败: %s", result)
+        elif status != 200:
+            logger.error("批量标记消息失败: %s - %s", status, result)
+        return status == 200
+
+    async def save_messages(self, messages: List[Dict]) -> tuple:
+        """逐条落本地库，返回 (成功的公网消息ID, 失败的公网消息ID)"""
+        saved_ids, failed_ids = [], []
+        for msg in messages:
+            if await self.db(self.service.save_incoming_message, msg):
+                if msg.get('id'):
+                    saved_ids.append(msg['id'])
+            else:
+                logger.warning("消息 %s 保存到本地失败", msg.get('message_id'))
+                if msg.get('id'):
+                    failed_ids.append(msg['id'])
+        self.wakeup.set()
+        return saved_ids, failed_ids
+
+    async def fetch_from_remote(self):
+        """获取阶段（poll / claim 模式）"""
+        service = self.service
+        logger.info("消息获取协程启动")
+        while not self.stopping:
+            started = time.monotonic()
+            remote_messages = None
+            try:
+                if service.fetch_mode == 'claim':
+                    remote_messages = await self.claim_messages()
+                else:
+                    remote_messages = await self.get_unprocessed_messages()
+
+                if remote_messages:
+                    logger.info("从公网服务获取到 %s 条消息", len(remote_messages))
+                    saved_ids, failed_ids = await self.save_messages(remote_messages)
+                    if service.fetch_mode == 'claim':
+                        if saved_ids and await self.lease_action('ack', saved_ids):
+                            logger.debug("%s 条消息已保存到本地并确认", len(saved_ids))
+                        if failed_ids:
+                            await self.lease_action('release', failed_ids)
+                    elif saved_ids and await self.mark_messages_as_processed(saved_ids):
+                        logger.debug("%s 条消息已保存到本地并标记远程为已处理", len(saved_ids))
+                else:
+                    logger.debug("没有新消息")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("从远程获取消息时发生错误: %s", e)
+
+            # 与线程引擎相同：长轮询拿到消息或已在服务端等待过时立即进入下一轮，否则休息1秒
+            if service.long_poll_wait > 0 and (remote_messages or time.monotonic() - started >= 1):
+                continue
+            await self.sleep(1)
+
+    async def stream_from_remote(self):
+        """
+        获取阶段（stream 模式）：订阅 SSE 推送流，断线后携带 Last-Event-ID 重连；
+        Last-Event-ID 只前进到最后一条已落库的消息，落库失败时断开重连
+        """
+        service = self.service
+        logger.info("消息获取协程启动（推送流模式）")
+        ack_task = asyncio.create_task(self.ack_stream_messages(), name='ack')
+        try:
+            await self.consume_stream()
+        finally:
+            ack_task.cancel()
+            await asyncio.gather(ack_task, return_exceptions=True)
+            # 停止前确认剩余的消息，失败的在下次连接时由服务端重新推送
+            if self.pending_acks:
+                await self.flush_acks()
+
+    async def consume_stream(self):
+        service = self.service
+        params = {'fields': service.REMOTE_FIELDS}
+        if service.app_id:
+            params['app_id'] = service.app_id
+        last_event_id = None
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=service.http_timeout[0],
+                                        sock_read=service.stream_read_timeout)
+
+        while not self.stopping:
+            headers = dict(self.listener_headers(), Accept='text/event-stream')
+            if last_event_id:
+                headers['Last-Event-ID'] = last_event_id
+            try:
+                async with self.listener_session.get(f"{service.api_base_url}/api/messages/stream", headers=headers,
+                                                     params=params, timeout=timeout) as response:
+                    if response.status != 200:
+                        logger.error("订阅消息流失败: %s - %s", response.status, await response.text())
+                    else:
+                        logger.info("消息流已连接，Last-Event-ID: %s", last_event_id)
+                        event_id, data_lines = None, []
+                        async for raw in response.content:
+                            line = raw.decode('utf-8').rstrip('\r\n')
+                            if line:
+                                field, _, value = line.partition(':')
+                                value = value[1:] if value.startswith(' ') else value
+                                if field == 'id':
+                                    event_id = value
+                                elif field == 'data':
+                                    data_lines.append(value)
+                                continue
+
+                            # 空行表示一个事件结束
+                            if data_lines and not await self.handle_stream_message(json.loads('\n'.join(data_lines))):
+                                break
+                            if event_id:
+                                last_event_id = event_id
+                            event_id, data_lines = None, []
+            except asyncio.CancelledError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning("消息流连接中断: %s", e)
+            except Exception as e:
+                logger.error("处理消息流时发生错误: %s", e)
+            await self.sleep(1)
+
+    async def handle_stream_message(self, msg: Dict) -> bool:
+        """落库后交给确认协程批量标记远程为已处理，返回是否已落库"""
+        logger.info("从消息流收到消息: %s", msg.get('message_id'))
+        if not await self.db(self.service.save_incoming_message, msg):
+            logger.warning("消息 %s 保存到本地失败，重新连接后从该消息继续", msg.get('message_id'))
+            return False
+        if msg.get('id'):
+            self.pending_acks.append(msg['id'])
+            self.ack_event.set()
+        return True
+
+    async def ack_stream_messages(self):
+        """stream 模式的确认协程：攒批后一次请求标记远程为已处理，失败的留到下一批重试"""
+        while True:
+            await self.ack_event.wait()
+            # 同一批推送的消息连续到达，稍等片刻一起确认
+            await asyncio.sleep(self.service.STREAM_ACK_INTERVAL)
+            if not await self.flush_acks():
+                await self.sleep(1)
+
+    async def flush_acks(self) -> bool:
+        batch = self.service.STREAM_ACK_BATCH
+        message_ids = self.pending_acks[:batch]
+        del self.pending_acks[:batch]
+        if not self.pending_acks:
+            self.ack_event.clear()
+        if await self.mark_messages_as_processed(message_ids):
+            logger.debug("%s 条推送消息已保存到本地并标记远程为已处理", len(message_ids))
+            return True
+        self.pending_acks[:0] = message_ids
+        self.ack_event.set()
+        return False
+
+    # ---------- 调度 ----------
+
+    def acquire_sender(self, sender_id: str):
+        self.busy_senders[sender_id] = self.busy_senders.get(sender_id, 0) + 1
+
+    def release_sender(self, sender_id: str):
+        count = self.busy_senders.get(sender_id, 0) - 1
+        if count > 0:
+            self.busy_senders[sender_id] = count
+        else:
+            self.busy_senders.pop(sender_id, None)
+        self.wakeup.set()
+
+    async def dispatch_loop(self):
+        """
+        按入库顺序派发本地未处理的消息，每个发送者同时只派发一条；处理出错的消息到达重试时间前不派发该发送者的消息；
+        定期把发送失败的回复按接收者交给发送阶段补发
+        """
+        service = self.service
+        limit = self.process_concurrency * 2
+        last_reply_check = 0
+        while not self.stopping:
+            dispatched = 0
+            self.wakeup.clear()
+            try:
+                free = limit - sum(self.busy_senders.values())
+                if free > 0:
+                    messages = await self.db(service.get_local_unprocessed_messages, limit=max(100, free),
+                                             exclude_senders=list(self.busy_senders))
+                    now = time.time()
+                    waiting = set()
+                    for msg in messages:
+                        sender_id = msg.get('sender_id') or ''
+                        if sender_id in self.busy_senders or sender_id in waiting:
+                            continue
+                        if (msg.get('retry_at') or 0) > now:
+                            waiting.add(sender_id)
+                            continue
+                        self.acquire_sender(sender_id)
+                        await self.process_queue.put(msg)
+                        dispatched += 1
+                        if dispatched >= free:
+                            break
+
+                if time.monotonic() - last_reply_check >= service.check_interval:
+                    last_reply_check = time.monotonic()
+                    for recipient_id in await self.db(service.get_pending_recipients):
+                        if recipient_id not in self.busy_senders:
+                            self.acquire_sender(recipient_id)
+                            await self.send_queue.put(recipient_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("处理本地消息时发生错误: %s", e)
+
+            # 有空位时立即继续派发，否则等待新消息落库或任务完成
+            if not dispatched:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), 1)
+                except asyncio.TimeoutError:
+                    pass
+
+    # ---------- 处理阶段 ----------
+
+    async def process_worker(self):
+        service = self.service
+        while True:
+            msg = await self.process_queue.get()
+            sender_id = msg.get('sender_id') or ''
+            try:
+                if await self.process_message(msg):
+                    # 发送完回复才释放该发送者，保证其下一条消息的回复排在后面
+                    await self.send_queue.put(sender_id)
+                    continue
+            except Exception as e:
+                # 消息保持未处理，退避后重试；达到次数上限后改为发送默认回复
+                try:
+                    if await self.db(service.record_local_failure, msg, e) and sender_id:
+                        await self.send_queue.put(sender_id)
+                        continue
+                except Exception as record_error:
+                    logger.error("记录消息处理失败时发生错误: %s", record_error)
+            self.release_sender(sender_id)
+
+    async def process_message(self, msg: Dict) -> bool:
+        """
+        生成回复并记录，返回是否需要发送回复
+        """
+        service = self.service
+        message_id = msg.get('message_id', 'unknown')
+        sender_id = msg.get('sender_id', 'unknown')
+        content = msg.get('content', '')
+        logger.info("处理本地消息: ID=%s, 发送者=%s, 内容='%.200s'", message_id, sender_id, content)
+
+        delivered = False
+        answered = False
+        # 对话历史未命中缓存时读取本地库
+        history = await self.db(service.conversation_history, msg) if self.openclaw else []
+        cached = await self.db(service.cached_response, content, history, sender_id)
+        if cached is not None:
+            response_content = cached
+            answered = True
+        elif self.openclaw and service.openclaw_stream and self.sender.app_id and self.sender.app_secret:
+            response_content, delivered, answered = await self.stream_reply(sender_id, content, history)
+        elif self.openclaw:
+            logger.info("调用 OpenClaw agent: %s", self.openclaw.agent_id)
+            response_content = await self.openclaw.chat(service.openclaw_prompt(content), user_id=sender_id,
+                                                         history=history)
+            if response_content:
+                logger.info("OpenClaw 返回回复: %.100s...", response_content)
+                await self.db(service.cache_response, content, response_content, history, sender_id)
+                answered = True
+            else:
+                logger.warning("OpenClaw 返回空回复")
+                response_content = service.fallback_reply(content, "OpenClaw 返回空回复")
+        else:
+            response_content = service.fallback_reply(content)
+
+        await self.db(service.add_reply_message, sender_id, response_content, sent=delivered)
+        # 只有 OpenClaw 的回答计入对话历史，失败的回复在本地库中标记后由历史读取跳过
+        await self.db(service.save_processed_message, message_id, content, response_content, not answered)
+        if answered:
+            service.record_conversation(msg, content, response_content)
+        if await self.db(service.mark_local_processed, msg['id']):
+            logger.info("本地消息 %s 已标记为已处理", message_id)
+        else:
+            logger.error("本地消息 %s 标记为已处理失败", message_id)
+        # 流式回复已送达时无需再经过发送阶段
+        return bool(msg.get('sender_id')) and not delivered
+
+    async def stream_reply(self, recipient_id: str, content: str,
+                           history: List[Dict] = None) -> Tuple[str, bool, bool]:
+        """
+        FeishuReplyService.stream_reply 的异步版本，返回 (完整回复, 是否已送达飞书, 是否为 OpenClaw 的完整回答)
+        """
+        service = self.service
+        # 先发出该用户此前未送达的回复，保持回复顺序
+        await self.send_pending_replies(recipient_id)
+
+        reply = StreamingReply(**service.stream_settings)
+        message_id = None
+        error_message = None
+        logger.info("流式调用 OpenClaw agent: %s", self.openclaw.agent_id)
+        try:
+            async for delta in self.openclaw.chat_stream(service.openclaw_prompt(content), user_id=recipient_id,
+                                                         history=history):
+                reply.append(delta)
+                action = reply.next_action()
+                if action == 'create':
+                    message_id = await self.sender.create_message(recipient_id, reply.partial_text())
+                    if message_id is None:
+                        reply.disabled = True
+                    else:
+                        reply.mark_sent()
+                        reply.disabled = not message_id
+                elif action == 'edit' and await self.sender.update_message(message_id, reply.partial_text()):
+                    reply.mark_sent()
+        except Exception as e:
+            error_message = str(e) or type(e).__name__
+            logger.error("流式调用 OpenClaw 失败: %s", error_message)
+
+        if not reply.text:
+            return service.fallback_reply(content, error_message or "OpenClaw 返回空回复"), False, False
+        text = reply.text
+        if error_message:
+            text = f"{text}\n\n（回复中断: {error_message}）"
+        else:
+            await self.db(service.cache_response, content, text, history, recipient_id)
+        logger.info("OpenClaw 返回回复: %.100s...", text)
+        if message_id:
+            delivered = await self.sender.update_message(message_id, text)
+        elif reply.created:
+            # 首条消息已发出但无法编辑，剩余内容单独发送一次
+            tail = text[reply.sent_length:].lstrip()
+            if tail and not await self.sender.send_message(recipient_id, tail):
+                await self.db(service.add_reply_message, recipient_id, tail)
+            delivered = True
+        else:
+            delivered = False
+        return text, delivered, error_message is None
+
+    # ---------- 发送阶段 ----------
+
+    async def send_worker(self):
+        while True:
+            recipient_id = await self.send_queue.get()
+            try:
+                sent_count = await self.send_pending_replies(recipient_id)
+                if sent_count > 0:
+                    logger.info("成功发送 %s 条回复消息到飞书", sent_count)
+            except Exception as e:
+                logger.error("发送回复时发生错误: %s", e)
+            finally:
+                self.release_sender(recipient_id)
+
+    async def send_pending_replies(self, recipient_id: str) -> int:
+        """按顺序发送给该接收者的待发送回复，遇到失败即停止，留待补发"""
+        service = self.service
+        if not (self.sender.app_id and self.sender.app_secret):
+            logger.error("未配置飞书应用凭证,无法发送消息")
+            return 0
+        sent_count = 0
+        for reply in await self.db(service.get_pending_replies, recipient_id):
+            if not await self.sender.send_message(recipient_id, reply['content']):
+                logger.error("回复消息 %s 发送失败", reply['id'])
+                break
+            if await self.db(service.mark_reply_as_sent, reply['id']):
+                sent_count += 1
+                logger.info("回复消息 %s 已发送并标记为已发送", reply['id'])
+            else:
+                logger.error("回复消息 %s 发送成功但本地标记失败", reply['id'])
+        return sent_count
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回复服务对话历史缓存基准：不同 HISTORY_CACHE_SIZE 下的命中率、淘汰数、内存占用与读取延迟
+
+本地库预先写入 --users 个用户各 --turns 轮已处理的对话，然后按 Zipf 分布（--skew）选取用户，
+模拟 --requests 条消息：读取该用户的对话历史（未命中时从本地库加载），再记录本轮对话。输出：
+- 命中率、淘汰数、缓存中的会话数与字符数
+- 缓存占用的内存（tracemalloc 统计，只含对话历史，不含本地库）
+- 读取历史的延迟：命中（内存）与未命中（本地库）分别统计
+
+用法:
+    python benchmarks/bench_conversation_history.py --users 5000 --requests 50000
+    python benchmarks/bench_conversation_history.py --cache-size 100 --cache-size 1000 --max-chars 2000
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESP_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_logging import percentiles  # noqa: E402
+
+
+def populate(db_path: str, args):
+    conn = sqlite3.connect(db_path)
+    incoming, processed = [], []
+    for turn in range(args.turns):
+        for user in range(args.users):
+            message_id = f'om_{user}_{turn}'
+            incoming.append((message_id, f'ou_user{user}', f'oc_user{user}', f'第{turn}轮的问题' + '问' * 40, 1))
+            processed.append((message_id, f'第{turn}轮的问题' + '问' * 40, f'第{turn}轮的回复' + '答' * 160))
+    conn.executemany('INSERT INTO incoming_messages (message_id, sender_id, chat_id, content, processed) '
+                     'VALUES (?, ?, ?, ?, ?)', incoming)
+    conn.executemany('INSERT INTO processed_messages (message_id, original_content, processed_result) '
+                     'VALUES (?, ?, ?)', processed)
+    conn.commit()
+    conn.close()
+
+
+def run_cache_size(cache_size: int, args, workdir: str) -> dict:
+    from feishu_resp_server import FeishuReplyService
+
+    os.environ['HISTORY_CACHE_SIZE'] = str(cache_size)
+    service = FeishuReplyService()
+    store = service.conversations
+
+    rng = random.Random(args.seed)
+    weights = [1.0 / (rank + 1) ** args.skew for rank in range(args.users)]
+    users = rng.choices(range(args.users), weights=weights, k=args.requests)
+
+    tracemalloc.start()
+    hit_ms, miss_ms = [], []
+    for index, user in enumerate(users):
+        message = {'sender_id': f'ou_user{user}', 'chat_id': f'oc_user{user}'}
+        hits = store.hits
+        started = time.perf_counter()
+        service.conversation_history(message)
+        elapsed = (time.perf_counter() - started) * 1000
+        (hit_ms if store.hits > hits else miss_ms).append(elapsed)
+        service.record_conversation(message, f'新问题{index}' + '问' * 40, f'新回复{index}' + '答' * 160)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = store.stats()
+    return {
+        'hit_rate': round(stats['hits'] / args.requests, 4),
+        'evictions': stats['evictions'],
+        'sessions': stats['sessions'],
+        'chars': stats['chars'],
+        'memory_kb': round(memory / 1024, 1),
+        'hit': percentiles(hit_ms) if hit_ms else None,
+        'miss': percentiles(miss_ms) if miss_ms else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回复服务对话历史缓存基准')
+    parser.add_argument('--cache-size', type=int, action='append', help='HISTORY_CACHE_SIZE，可多次指定（默认 100、1000、10000）')
+    parser.add_argument('--users', type=int, default=5000, help='用户数')
+    parser.add_argument('--turns', type=int, default=20, help='每个用户预先写入的对话轮数')
+    parser.add_argument('--requests', type=int, default=20000, help='模拟的消息数')
+    parser.add_argument('--skew', type=float, default=1.0, help='Zipf 分布参数，越大访问越集中')
+    parser.add_argument('--max-turns', type=int, default=10, help='HISTORY_MAX_TURNS')
+    parser.add_argument('--max-chars', type=int, default=4000, help='HISTORY_MAX_CHARS')
+    parser.add_argument('--seed', type=int, default=1, help='随机种子')
+    args = parser.parse_args()
+
+    sys.path.insert(0, RESP_DIR)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        db_path = os.path.join(tmp, 'local.db')
+        os.environ.update({
+            'LOCAL_DB_PATH': db_path,
+            'VERIFICATION_CODE': 'bench-code',
+            'HISTORY_ENABLED': 'true',
+            'HISTORY_MAX_TURNS': str(args.max_turns),
+            'HISTORY_MAX_CHARS': str(args.max_chars),
+        })
+        from feishu_resp_server import FeishuReplyService
+        # 创建本地库的表结构后写入对话
+        FeishuReplyService()
+        populate(db_path, args)
+
+        results = {}
+        for cache_size in args.cache_size or [100, 1000, 10000]:
+            results[cache_size] = run_cache_size(cache_size, args, tmp)
+
+    print(json.dumps({'users': args.users, 'turns': args.turns, 'requests': args.requests, 'skew': args.skew,
+                      'max_turns': args.max_turns, 'max_chars': args.max_chars, 'results': results},
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
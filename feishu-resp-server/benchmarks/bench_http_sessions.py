@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回复服务 HTTP 连接复用基准：每条消息的外部调用延迟，keep-alive 关闭与开启对比
+
+在本机启动三个桩服务（公网监听服务、OpenClaw Gateway、飞书开放平台，各一个端口），
+用回复服务自己的客户端走一条消息的完整外部调用链：
+    拉取未处理消息 -> 标记已处理 -> OpenClaw 对话 -> 发送飞书消息
+每种配置在同一进程中依次运行：
+- close:      HTTP_KEEP_ALIVE=false，每个请求新建连接（改造前直接调用 requests.get/post 的行为）
+- keep-alive: 默认配置，各客户端的 Session 复用连接
+输出每条消息的 p50/p95/p99 延迟、各调用的平均延迟，以及桩服务上新建的连接数。
+
+本机回环上的 TCP 握手几乎没有开销，可用 --tls 启用真实的 TLS 握手（需要 openssl 命令生成自签名证书），
+用 --handshake-delay 在每个新连接上模拟公网往返时间（毫秒）。
+
+用法:
+    python benchmarks/bench_http_sessions.py --messages 500
+    python benchmarks/bench_http_sessions.py --messages 200 --tls --handshake-delay 30
+"""
+
+import os
+import sys
+import ssl
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESP_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_logging import percentiles  # noqa: E402
+
+CALLS = ('fetch', 'mark', 'chat', 'send')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """三个桩服务共用的处理器，按路径返回对应服务的成功响应"""
+
+    protocol_version = 'HTTP/1.1'
+    # 响应头与响应体分两次写出，关闭 Nagle 避免与客户端的延迟确认叠加出约 40ms 的等待
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # 每个连接只调用一次 setup，在这里计数并模拟握手的往返时间
+        self.server.connections += 1
+        if self.server.handshake_delay:
+            time.sleep(self.server.handshake_delay)
+        super().setup()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        self.respond()
+
+    def respond(self):
+        path = self.path.split('?', 1)[0]
+        self.server.requests += 1
+        if path == '/api/messages/unprocessed':
+            self.server.sequence += 1
+            body = {'success': True, 'data': [{
+                'id': self.server.sequence, 'message_id': f'om_bench_{self.server.sequence}',
+                'sender_id': 'ou_bench', 'chat_id': 'oc_bench', 'content': '你好', 'message_type': 'text',
+            }]}
+        elif path == '/v1/chat/completions':
+            body = {'choices': [{'message': {'role': 'assistant', 'content': '收到，这是桩服务的回复'}}]}
+        elif path == '/open-apis/auth/v3/tenant_access_token/internal':
+            body = {'code': 0, 'tenant_access_token': 't-bench', 'expire': 7200}
+        else:
+            body = {'code': 0, 'success': True, 'data': {}}
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if self.close_connection:
+            # 客户端要求关闭连接时在响应中声明，客户端才不会把该连接放回连接池
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的 listen backlog 只有 5，并发建连时会被重置
+    request_queue_size = 128
+
+
+def start_stub(handshake_delay: float = 0, context: ssl.SSLContext = None,
+               handler=StubHandler) -> StubServer:
+    server = StubServer(('127.0.0.1', 0), handler)
+    server.handshake_delay = handshake_delay
+    server.connections = server.requests = server.sequence = 0
+    if context:
+        # 握手放到处理线程中进行（do_handshake_on_connect=False 时由首次读写触发），不阻塞 accept
+        server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_certificate(workdir: str) -> tuple:
+    cert, key = os.path.join(workdir, 'cert.pem'), os.path.join(workdir, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+                    '-keyout', key, '-out', cert], check=True, capture_output=True)
+    return cert, key
+
+
+def run_config(keep_alive: bool, stubs: dict, scheme: str, args) -> dict:
+    from feishu_resp_server import FeishuReplyService
+
+    os.environ.update({
+        'FEISHU_LISTENER_URL': f"{scheme}://127.0.0.1:{stubs['listener'].server_address[1]}",
+        'OPENCLAW_GATEWAY_URL': f"{scheme}://127.0.0.1:{stubs['openclaw'].server_address[1]}",
+        'FEISHU_API_BASE': f"{scheme}://127.0.0.1:{stubs['feishu'].server_address[1]}",
+        'HTTP_KEEP_ALIVE': 'true' if keep_alive else 'false',
+    })
+    for stub in stubs.values():
+        stub.connections = stub.requests = 0
+
+    service = FeishuReplyService()
+    samples, calls = [], {call: [] for call in CALLS}
+    for _ in range(args.messages):
+        started = time.perf_counter()
+        t0 = started
+        messages = service.get_unprocessed_messages()
+        t1 = time.perf_counter()
+        service.mark_messages_as_processed([msg['id'] for msg in messages])
+        t2 = time.perf_counter()
+        reply = service.openclaw_client.chat(messages[0]['content'], user_id=messages[0]['sender_id'])
+        t3 = time.perf_counter()
+        service.direct_sender.send_message(messages[0]['sender_id'], reply)
+        t4 = time.perf_counter()
+        samples.append((t4 - started) * 1000)
+        for call, (a, b) in zip(CALLS, ((t0, t1), (t1, t2), (t2, t3), (t3, t4))):
+            calls[call].append((b - a) * 1000)
+    service.stop()
+
+    result = percentiles(samples)
+    result['calls_avg_ms'] = {call: round(sum(values) / len(values), 3) for call, values in calls.items()}
+    result['requests'] = sum(stub.requests for stub in stubs.values())
+    result['connections'] = {role: stub.connections for role, stub in stubs.items()}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回复服务 HTTP 连接复用基准')
+    parser.add_argument('--messages', type=int, default=500, help='每种配置处理的消息数')
+    parser.add_argument('--tls', action='store_true', help='桩服务使用 HTTPS（自签名证书）')
+    parser.add_argument('--handshake-delay', type=float, default=0, help='每个新连接模拟的往返时间（毫秒）')
+    parser.add_argument('--pool-size', type=int, default=10, help='HTTP_POOL_SIZE')
+    args = parser.parse_args()
+
+    sys.path.insert(0, RESP_DIR)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.environ.update({
+            'LOCAL_DB_PATH': os.path.join(tmp, 'local.db'),
+            'VERIFICATION_CODE': 'bench-code',
+            'FEISHU_APP_ID': 'cli_bench',
+            'FEISHU_APP_SECRET': 'bench-secret',
+            'OPENCLAW_ENABLED': 'true',
+            'OPENCLAW_GATEWAY_TOKEN': 'bench-token',
+            'LONG_POLL_WAIT': '0',
+            'HTTP_POOL_SIZE': str(args.pool_size),
+        })
+        context, scheme = None, 'http'
+        if args.tls:
+            cert, key = make_certificate(tmp)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert, key)
+            # 客户端的各个 Session 信任自签名证书
+            os.environ['REQUESTS_CA_BUNDLE'] = cert
+            scheme = 'https'
+        stubs = {role: start_stub(args.handshake_delay / 1000.0, context)
+                 for role in ('listener', 'openclaw', 'feishu')}
+
+        results = {}
+        for name, keep_alive in (('close', False), ('keep-alive', True)):
+            results[name] = run_config(keep_alive, stubs, scheme, args)
+        for stub in stubs.values():
+            stub.shutdown()
+
+    base = results['close']['p50_ms']
+    results['keep-alive']['p50_speedup'] = round(base / results['keep-alive']['p50_ms'], 2) \
+        if results['keep-alive']['p50_ms'] else None
+    print(json.dumps({'messages': args.messages, 'tls': args.tls, 'handshake_delay_ms': args.handshake_delay,
+                      'results': results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
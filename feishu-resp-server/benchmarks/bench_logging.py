@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回复服务日志开销基准：LOG_LEVEL=INFO 下本地处理循环的单条延迟
+
+每种日志配置在独立子进程中运行（日志配置是进程级的）：
+- sync:  LOG_QUEUE_SIZE=0，在调用线程中同步写文件（改造前的方式）
+- queue: 默认配置，日志放入队列由后台线程写入
+- queue+rate_limit: 在 queue 基础上开启 LOG_RATE_LIMIT
+
+测量内容：处理循环的一次迭代（取本地消息 -> 生成默认回复 -> 记录结果 -> 标记已处理），不调用 OpenClaw。
+消息直接写入本地库，不需要公网服务。
+
+用法:
+    python benchmarks/bench_logging.py --events 3000
+    python benchmarks/bench_logging.py --workdir /data/tmp   # 在真实磁盘上测试
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESP_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+
+CONFIGS = {
+    'sync': {'LOG_QUEUE_SIZE': '0'},
+    'queue': {},
+    'queue+rate_limit': {'LOG_RATE_LIMIT': '20'},
+}
+
+
+def percentiles(samples: list) -> dict:
+    samples = sorted(samples)
+
+    def pick(p):
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))], 3)
+
+    return {
+        'avg_ms': round(sum(samples) / len(samples), 3),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+    }
+
+
+def make_message(i: int, senders: int = 200, chats: int = 20) -> dict:
+    """按公网服务 /api/messages 返回的字段生成第 i 条文本消息"""
+    return {
+        'id': i + 1,
+        'message_id': f'om_{i:032x}',
+        'sender_id': f'ou_{i % senders:032x}',
+        'chat_id': f'oc_{i % chats:032x}',
+        'content': f'请帮我查一下第 {i} 号工单的处理进度' + '，谢谢' * (i % 21),
+        'message_type': 'text',
+    }
+
+
+def run_worker(events: int) -> dict:
+    """在子进程中执行，当前目录为临时工作目录"""
+    sys.path.insert(0, RESP_DIR)
+    import feishu_resp_server as resp
+    from log_setup import stop_logging
+
+    resp.setup_logging('feishu_resp_server')
+    service = resp.FeishuReplyService()
+    for i in range(events):
+        service.save_incoming_message(make_message(i))
+
+    process = []
+    while True:
+        t0 = time.perf_counter()
+        local_messages = service.get_local_unprocessed_messages(limit=1)
+        if not local_messages:
+            break
+        msg = local_messages[0]
+        resp.logger.info("处理本地消息: ID=%s, 发送者=%s, 内容='%.200s'",
+                         msg.get('message_id'), msg.get('sender_id'), msg.get('content', ''))
+        result, answered = service.process_single_message(msg)
+        service.save_processed_message(msg.get('message_id'), msg.get('content', ''), result, failed=not answered)
+        service.mark_local_processed(msg['id'])
+        process.append((time.perf_counter() - t0) * 1000)
+
+    stop_logging()
+    return {
+        'process': percentiles(process),
+        'log_file_bytes': os.path.getsize(os.path.join('logs', 'service.log')),
+    }
+
+
+def run_config(name: str, overrides: dict, args) -> dict:
+    with tempfile.TemporaryDirectory(dir=args.workdir) as tmp:
+        env = dict(os.environ,
+                   LOCAL_DB_PATH=os.path.join(tmp, 'local.db'),
+                   OPENCLAW_ENABLED='false',
+                   LOG_LEVEL='INFO',
+                   **overrides)
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', '--events', str(args.events)],
+                              env=env, cwd=tmp, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f'{name} 运行失败，退出码 {proc.returncode}')
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        result['env'] = overrides
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回复服务日志开销基准（本地处理循环）')
+    parser.add_argument('--events', type=int, default=3000, help='每种配置处理的消息数')
+    parser.add_argument('--workdir', default=None, help='临时目录所在位置（日志与数据库写在这里）')
+    parser.add_argument('--config', choices=list(CONFIGS), action='append', help='只测试指定配置，可多次指定')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.events), ensure_ascii=False))
+        return
+
+    results = {name: run_config(name, CONFIGS[name], args) for name in (args.config or list(CONFIGS))}
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
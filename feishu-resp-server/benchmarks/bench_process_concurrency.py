@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回复服务并行处理基准：处理并发数对消息处理吞吐量的影响
+
+在本机启动 OpenClaw Gateway 与飞书开放平台的桩服务，OpenClaw 每次对话固定延迟 --latency 毫秒
+（模拟 agent 思考时间）。本地库预先写入 --messages 条消息，轮流属于 --senders 个发送者，
+然后运行回复服务的处理线程直到全部回复发出，输出：
+- 总耗时、吞吐量（条/秒）、相对并发数 1 的加速比
+- 顺序检查：桩服务按到达顺序记录每个发送者收到的回复，同一发送者的回复必须与消息入库顺序一致
+- 回复服务占用的线程数峰值（不含桩服务的线程）
+
+--engine thread 时并发数为 PROCESS_CONCURRENCY（线程数），--engine async 时为 ASYNC_PROCESS_CONCURRENCY（协程数）。
+
+用法:
+    python benchmarks/bench_process_concurrency.py --concurrency 1 --concurrency 4 --concurrency 16
+    python benchmarks/bench_process_concurrency.py --messages 400 --senders 4 --latency 500
+    python benchmarks/bench_process_concurrency.py --engine async --concurrency 500 --messages 1000 --senders 500
+"""
+
+import os
+import sys
+import re
+import json
+import time
+import argparse
+import tempfile
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESP_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_http_sessions import StubHandler, start_stub  # noqa: E402
+
+
+class AgentStubHandler(StubHandler):
+    """对话延迟 server.latency 秒后原样返回用户消息；发送消息时按接收者记录收到的内容"""
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        path = self.path.split('?', 1)[0]
+        if path == '/v1/chat/completions':
+            time.sleep(self.server.latency)
+            self.reply({'choices': [{'message': {'role': 'assistant',
+                                                 'content': body['messages'][-1]['content']}}]})
+        elif path == '/open-apis/im/v1/messages':
+            with self.server.lock:
+                self.server.received.setdefault(body['receive_id'], []).append(json.loads(body['content'])['text'])
+            self.reply({'code': 0, 'data': {}})
+        else:
+            self.respond()
+
+    def reply(self, body: dict):
+        self.server.requests += 1
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def service_threads() -> int:
+    """当前进程中回复服务的线程数，不含桩服务的监听与连接线程"""
+    return sum(1 for thread in threading.enumerate()
+               if 'serve_forever' not in thread.name and 'process_request_thread' not in thread.name)
+
+
+def run_concurrency(concurrency: int, stubs: dict, args, workdir: str) -> dict:
+    from feishu_resp_server import FeishuReplyService
+    from async_engine import AsyncReplyEngine
+
+    db_path = os.path.join(workdir, f'local-{concurrency}.db')
+    os.environ.update({
+        'LOCAL_DB_PATH': db_path,
+        'PROCESS_CONCURRENCY': str(concurrency),
+        'OPENCLAW_GATEWAY_URL': f"http://127.0.0.1:{stubs['openclaw'].server_address[1]}",
+        'FEISHU_API_BASE': f"http://127.0.0.1:{stubs['feishu'].server_address[1]}",
+    })
+    stubs['feishu'].received = {}
+
+    service = FeishuReplyService()
+    for i in range(args.messages):
+        service.save_incoming_message({
+            'id': i + 1, 'message_id': f'om_bench_{i}', 'sender_id': f'ou_sender{i % args.senders}',
+            'chat_id': 'oc_bench', 'content': f'#{i:06d}', 'message_type': 'text',
+        })
+
+    started = time.perf_counter()
+    if args.engine == 'async':
+        engine = AsyncReplyEngine(service, process_concurrency=concurrency)
+        thread = threading.Thread(target=engine.run, daemon=True)
+        thread.start()
+    else:
+        service.running = True
+        service.process_thread = threading.Thread(target=service.process_local_messages, daemon=True)
+        service.process_thread.start()
+    received = stubs['feishu'].received
+    peak_threads = 0
+    while sum(len(replies) for replies in received.values()) < args.messages:
+        if time.perf_counter() - started > args.timeout:
+            break
+        peak_threads = max(peak_threads, service_threads())
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    if args.engine == 'async':
+        engine.stop()
+        thread.join()
+    else:
+        service.stop()
+
+    delivered = sum(len(replies) for replies in received.values())
+    # 回复内容中带有消息的序号（#000123），同一发送者的序号必须递增
+    order_violations = 0
+    for replies in received.values():
+        seqs = [int(re.search(r'#(\d+)', reply).group(1)) for reply in replies]
+        order_violations += sum(1 for a, b in zip(seqs, seqs[1:]) if b <= a)
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'throughput_msgs': round(delivered / elapsed, 2) if elapsed else None,
+        'delivered': delivered,
+        'order_violations': order_violations,
+        'peak_threads': peak_threads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回复服务并行处理基准')
+    parser.add_argument('--engine', choices=['thread', 'async'], default='thread', help='处理引擎')
+    parser.add_argument('--concurrency', type=int, action='append', help='处理并发数，可多次指定（默认 1、4、16）')
+    parser.add_argument('--messages', type=int, default=200, help='消息总数')
+    parser.add_argument('--senders', type=int, default=20, help='发送者数量，消息轮流属于各发送者')
+    parser.add_argument('--latency', type=float, default=200, help='OpenClaw 每次对话的延迟（毫秒）')
+    parser.add_argument('--timeout', type=float, default=600, help='每轮最长等待时间（秒）')
+    args = parser.parse_args()
+
+    sys.path.insert(0, RESP_DIR)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.environ.update({
+            'VERIFICATION_CODE': 'bench-code',
+            'FEISHU_APP_ID': 'cli_bench',
+            'FEISHU_APP_SECRET': 'bench-secret',
+            'OPENCLAW_ENABLED': 'true',
+            'OPENCLAW_GATEWAY_TOKEN': 'bench-token',
+        })
+        stubs = {role: start_stub(handler=AgentStubHandler) for role in ('openclaw', 'feishu')}
+        for stub in stubs.values():
+            stub.latency = args.latency / 1000.0
+            stub.lock = threading.Lock()
+
+        results = {}
+        for concurrency in args.concurrency or [1, 4, 16]:
+            results[concurrency] = run_concurrency(concurrency, stubs, args, tmp)
+        for stub in stubs.values():
+            stub.shutdown()
+
+    base = results[min(results)]['throughput_msgs']
+    for result in results.values():
+        result['speedup'] = round(result['throughput_msgs'] / base, 2) if base else None
+    print(json.dumps({'engine': args.engine, 'messages': args.messages, 'senders': args.senders, 'latency_ms': args.latency,
+                      'results': results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回复服务 OpenClaw 回复缓存基准：命中缓存与调用 OpenClaw 的单条消息处理延迟
+
+在本机启动 OpenClaw Gateway 桩服务（每次对话固定延迟 --latency 毫秒），回复缓存中预先写入 --entries 条问答，
+然后用回复服务处理消息（生成回复并写入待发送队列，不含发送），依次统计：
+- disabled: RESPONSE_CACHE_ENABLED=false，每条消息都调用 OpenClaw
+- miss:     启用缓存，首次出现的问题（调用 OpenClaw 并写入缓存）
+- hit:      启用缓存，其他用户提出的相同问题（大小写、空白、末尾标点不同也视为同一问题）
+- restart:  新建服务实例（模拟重启）后又一批用户提出的相同问题，缓存从本地库读取
+另外统计 ResponseCache.get 本身的命中延迟，以及命中率、淘汰数等指标。
+
+用法:
+    python benchmarks/bench_response_cache.py --messages 200 --latency 500
+    python benchmarks/bench_response_cache.py --entries 10000 --cache-size 10000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESP_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_http_sessions import start_stub  # noqa: E402
+from bench_logging import percentiles  # noqa: E402
+from bench_process_concurrency import AgentStubHandler  # noqa: E402
+
+
+def process(service, questions: list, sender: str = 'ou_bench') -> list:
+    """每条消息来自不同的用户：sender 加序号"""
+    samples = []
+    for index, question in enumerate(questions):
+        message = {'message_id': f'om_{sender}_{index}', 'sender_id': f'{sender}{index}', 'content': question}
+        started = time.perf_counter()
+        service.process_single_message(message)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回复服务 OpenClaw 回复缓存基准')
+    parser.add_argument('--messages', type=int, default=200, help='每种情况处理的消息数')
+    parser.add_argument('--latency', type=float, default=500, help='OpenClaw 每次对话的延迟（毫秒）')
+    parser.add_argument('--entries', type=int, default=1000, help='预先写入缓存的问答数')
+    parser.add_argument('--cache-size', type=int, default=1000, help='RESPONSE_CACHE_SIZE')
+    args = parser.parse_args()
+
+    sys.path.insert(0, RESP_DIR)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        stub = start_stub(handler=AgentStubHandler)
+        stub.latency = args.latency / 1000.0
+        stub.lock = threading.Lock()
+        os.environ.update({
+            'LOCAL_DB_PATH': os.path.join(tmp, 'local.db'),
+            'VERIFICATION_CODE': 'bench-code',
+            'OPENCLAW_ENABLED': 'true',
+            'OPENCLAW_GATEWAY_TOKEN': 'bench-token',
+            'OPENCLAW_GATEWAY_URL': f"http://127.0.0.1:{stub.server_address[1]}",
+            'RESPONSE_CACHE_SIZE': str(args.cache_size),
+        })
+        from feishu_resp_server import FeishuReplyService
+
+        results = {}
+        os.environ['RESPONSE_CACHE_ENABLED'] = 'false'
+        service = FeishuReplyService()
+        results['disabled'] = percentiles(process(service, [f'常见问题{i}：如何重置 VPN？' for i in range(args.messages)]))
+        service.stop()
+
+        os.environ['RESPONSE_CACHE_ENABLED'] = 'true'
+        service = FeishuReplyService()
+        cache, agent_id = service.response_cache, service.openclaw_client.agent_id
+        for i in range(args.entries):
+            cache.put(agent_id, f'预置问题{i}', f'预置回复{i}' + '答' * 200)
+        questions = [f'常见问题{i}：如何重置 VPN？' for i in range(args.messages)]
+        results['miss'] = percentiles(process(service, questions))
+        results['hit'] = percentiles(process(service, [f'  常见问题{i}：如何重置 vpn ' for i in range(args.messages)],
+                                             sender='ou_other'))
+
+        get_samples = []
+        for i in range(args.messages):
+            started = time.perf_counter()
+            cache.get(agent_id, f'常见问题{i}：如何重置 VPN？')
+            get_samples.append((time.perf_counter() - started) * 1000)
+        results['cache_get_hit'] = percentiles(get_samples)
+        results['stats'] = cache.stats()
+        service.stop()
+
+        service = FeishuReplyService()
+        results['restart'] = percentiles(process(service, questions, sender='ou_restart'))
+        results['restart_stats'] = service.response_cache.stats()
+        service.stop()
+        stub.shutdown()
+
+    for name in ('hit', 'restart'):
+        results[name]['speedup_vs_disabled'] = round(results['disabled']['p50_ms'] / results[name]['p50_ms'], 1) \
+            if results[name]['p50_ms'] else None
+    print(json.dumps({'messages': args.messages, 'latency_ms': args.latency, 'entries': args.entries,
+                      'cache_size': args.cache_size, 'results': results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回复服务流式回复基准：用户看到第一段回复内容的等待时间，非流式与流式对比
+
+在本机启动 stub_gateway 桩服务（OpenClaw Gateway 分 --chunks 段流式返回回复，段间隔 --chunk-delay 毫秒），
+回复服务逐条处理 --messages 条消息（每条消息一个接收者），两种配置在同一进程中依次运行：
+- non-stream: OPENCLAW_STREAM=false，回复生成完毕后一次性发送
+- stream:     OPENCLAW_STREAM=true，收到首批内容后发送消息，之后按 STREAM_UPDATE_INTERVAL 原地编辑
+输出每种配置的：
+- first_visible：从开始处理到飞书上出现该回复（发送消息）的延迟
+- complete：从开始处理到飞书上的消息成为完整回复的延迟
+- 每条消息的编辑次数（平均/最大），以及最终内容与完整回复不一致的消息数
+
+用法:
+    python benchmarks/bench_streaming.py --messages 10
+    python benchmarks/bench_streaming.py --chunks 60 --chunk-delay 200 --interval 0.5
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESP_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_logging import percentiles  # noqa: E402
+from stub_gateway import start_gateway  # noqa: E402
+
+
+def run_config(stream: bool, gateway, args, workdir: str) -> dict:
+    from feishu_resp_server import FeishuReplyService
+
+    name = 'stream' if stream else 'non-stream'
+    os.environ.update({
+        'LOCAL_DB_PATH': os.path.join(workdir, f'local-{name}.db'),
+        'OPENCLAW_STREAM': 'true' if stream else 'false',
+        'STREAM_UPDATE_INTERVAL': str(args.interval),
+    })
+    gateway.events = []
+    expected = ''.join(f'第{i + 1:02d}段内容。' for i in range(args.chunks))
+
+    service = FeishuReplyService()
+    first_visible, complete, edits, mismatched = [], [], [], 0
+    for i in range(args.messages):
+        recipient_id = f'ou_stream{i}'
+        message = {'id': i + 1, 'message_id': f'om_bench_{i}', 'sender_id': recipient_id,
+                   'chat_id': 'oc_bench', 'content': '你好', 'message_type': 'text'}
+        started = time.perf_counter()
+        service.process_single_message(message)
+        service.send_pending_replies_to_server(recipient_id)
+
+        created = [event for event in gateway.events if event[1] == 'create' and event[3] == recipient_id]
+        if not created:
+            mismatched += 1
+            continue
+        message_id = created[0][2]
+        updates = [event for event in gateway.events if event[1] == 'update' and event[2] == message_id]
+        final = (updates or created)[-1]
+        first_visible.append((created[0][0] - started) * 1000)
+        complete.append((final[0] - started) * 1000)
+        edits.append(len(updates))
+        if final[4] != expected:
+            mismatched += 1
+    service.stop()
+
+    return {
+        'first_visible': percentiles(first_visible),
+        'complete': percentiles(complete),
+        'edits_avg': round(sum(edits) / len(edits), 2) if edits else None,
+        'edits_max': max(edits) if edits else None,
+        'mismatched': mismatched,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='回复服务流式回复基准')
+    parser.add_argument('--messages', type=int, default=10, help='每种配置处理的消息数')
+    parser.add_argument('--chunks', type=int, default=30, help='每个回复的分段数')
+    parser.add_argument('--chunk-delay', type=float, default=100, help='OpenClaw 段间隔（毫秒）')
+    parser.add_argument('--interval', type=float, default=1.0, help='STREAM_UPDATE_INTERVAL（秒）')
+    args = parser.parse_args()
+
+    sys.path.insert(0, RESP_DIR)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        gateway = start_gateway(args.chunks, args.chunk_delay / 1000.0)
+        base_url = f"http://127.0.0.1:{gateway.server_address[1]}"
+        os.environ.update({
+            'VERIFICATION_CODE': 'bench-code',
+            'FEISHU_APP_ID': 'cli_bench',
+            'FEISHU_APP_SECRET': 'bench-secret',
+            'OPENCLAW_ENABLED': 'true',
+            'OPENCLAW_GATEWAY_TOKEN': 'bench-token',
+            'OPENCLAW_GATEWAY_URL': base_url,
+            'FEISHU_API_BASE': base_url,
+        })
+
+        results = {}
+        for stream in (False, True):
+            results['stream' if stream else 'non-stream'] = run_config(stream, gateway, args, tmp)
+        gateway.shutdown()
+
+    base = results['non-stream']['first_visible']['p50_ms']
+    streamed = results['stream']['first_visible']['p50_ms']
+    results['stream']['first_visible_speedup'] = round(base / streamed, 2) if streamed else None
+    print(json.dumps({'messages': args.messages, 'chunks': args.chunks, 'chunk_delay_ms': args.chunk_delay,
+                      'interval_s': args.interval, 'results': results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地桩服务：同一个端口上模拟 OpenClaw Gateway 与飞书开放平台，用于验证回复服务的流式回复
+
+- POST /v1/chat/completions：stream=true 时以 OpenAI 兼容的 SSE 流分 --chunks 段返回回复，
+  段间隔 --chunk-delay 毫秒，以 data: [DONE] 结束；stream=false 时等待同样的总时长后一次性返回完整回复
+- POST /open-apis/auth/v3/tenant_access_token/internal：返回访问令牌
+- POST /open-apis/im/v1/messages：发送消息，返回 message_id
+- PUT  /open-apis/im/v1/messages/{message_id}：编辑消息
+发送与编辑按到达顺序记录在 server.events 中（时间、操作、message_id、接收者、文本），并打印到标准输出。
+
+单独运行时，把回复服务的 OPENCLAW_GATEWAY_URL 与 FEISHU_API_BASE 都指向该端口即可观察流式回复的效果：
+    python benchmarks/stub_gateway.py --port 18789 --chunks 30 --chunk-delay 150
+    OPENCLAW_STREAM=true OPENCLAW_GATEWAY_URL=http://127.0.0.1:18789 FEISHU_API_BASE=http://127.0.0.1:18789 \\
+        python feishu_resp_server.py start
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_http_sessions import StubHandler, StubServer  # noqa: E402
+
+
+class GatewayStubHandler(StubHandler):
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        path = self.path.split('?', 1)[0]
+        if path == '/v1/chat/completions':
+            if body.get('stream'):
+                self.stream_chat(body)
+            else:
+                time.sleep(self.server.chunks * self.server.chunk_delay)
+                self.reply({'choices': [{'message': {'role': 'assistant', 'content': ''.join(self.reply_chunks())}}]})
+        elif path == '/open-apis/im/v1/messages':
+            with self.server.lock:
+                self.server.sequence += 1
+                message_id = f'om_stub_{self.server.sequence}'
+            self.record('create', message_id, body['receive_id'], json.loads(body['content'])['text'])
+            self.reply({'code': 0, 'data': {'message_id': message_id}})
+        else:
+            self.respond()
+
+    def do_PUT(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+        message_id = self.path.split('?', 1)[0].rsplit('/', 1)[-1]
+        self.record('update', message_id, None, json.loads(body['content'])['text'])
+        self.reply({'code': 0, 'data': {}})
+
+    def reply_chunks(self) -> list:
+        return [f'第{i + 1:02d}段内容。' for i in range(self.server.chunks)]
+
+    def stream_chat(self, body: dict):
+        self.server.requests += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for index, chunk in enumerate(self.reply_chunks()):
+            time.sleep(self.server.chunk_delay)
+            delta = {'role': 'assistant', 'content': chunk} if index == 0 else {'content': chunk}
+            self.write_chunk('data: ' + json.dumps({'choices': [{'index': 0, 'delta': delta}]}, ensure_ascii=False))
+        self.write_chunk('data: [DONE]')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def write_chunk(self, line: str):
+        payload = (line + '\n\n').encode('utf-8')
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(payload), payload))
+        self.wfile.flush()
+
+    def reply(self, body: dict):
+        self.server.requests += 1
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def record(self, action: str, message_id: str, recipient_id, text: str):
+        with self.server.lock:
+            self.server.events.append((time.perf_counter(), action, message_id, recipient_id, text))
+        if self.server.verbose:
+            print(f'{action:6s} {message_id} {text}', flush=True)
+
+
+def start_gateway(chunks: int = 30, chunk_delay: float = 0.1, port: int = 0, verbose: bool = False) -> StubServer:
+    server = StubServer(('127.0.0.1', port), GatewayStubHandler)
+    server.handshake_delay = 0
+    server.connections = server.requests = server.sequence = 0
+    server.chunks = chunks
+    server.chunk_delay = chunk_delay
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.events = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenClaw Gateway 与飞书开放平台的本地桩服务')
+    parser.add_argument('--port', type=int, default=18789, help='监听端口')
+    parser.add_argument('--chunks', type=int, default=30, help='每个回复的分段数')
+    parser.add_argument('--chunk-delay', type=float, default=100, help='段间隔（毫秒）')
+    args = parser.parse_args()
+
+    server = start_gateway(args.chunks, args.chunk_delay / 1000.0, args.port, verbose=True)
+    print(f'stub gateway listening on http://127.0.0.1:{server.server_address[1]}', flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+本地回复服务 raw_data 的压缩存储（保存从公网服务获取的消息时压缩，get_local_raw_data 读取时解压）
+
+压缩后的 raw_data 以 BLOB 存储：格式标记 + zlib 数据；旧版本写入的 TEXT 原样读取。
+命令行用于把本地库（默认 LOCAL_DB_PATH）中的明文 raw_data 分批转换为压缩格式，并输出空间占用报告:
+    python compression.py                                             # 只输出报告
+    python compression.py --db ./feishu_local_messages.db --migrate  # 分批压缩后输出报告
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import argparse
+from typing import Dict, Any, Optional, Union
+
+# 以 NUL 开头的标记不会出现在 JSON 文本开头，可与旧的明文数据区分
+RAW_DATA_MARKER = b'\x00z1'
+
+
+def compress_raw_data(text: Optional[str], level: int = 6) -> Optional[Union[bytes, str]]:
+    """压缩 raw_data，level 为 0 时保持明文"""
+    if text is None or level <= 0:
+        return text
+    return RAW_DATA_MARKER + zlib.compress(text.encode('utf-8'), level)
+
+
+def decompress_raw_data(value: Optional[Union[bytes, str]]) -> Optional[str]:
+    """读取 raw_data，兼容压缩格式和旧的明文格式"""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value.startswith(RAW_DATA_MARKER):
+        return zlib.decompress(value[len(RAW_DATA_MARKER):]).decode('utf-8')
+    return value.decode('utf-8')
+
+
+def migrate_table(conn: sqlite3.Connection, table: str = 'incoming_messages', level: int = 6,
+                  batch_size: int = 500, pause: float = 0.01) -> int:
+    """把明文 raw_data 分批转换为压缩格式，每批一个短事务，返回转换条数"""
+    converted = 0
+    after_id = 0
+    while True:
+        rows = conn.execute(f"""
+            SELECT id, raw_data FROM {table}
+            WHERE id > ? AND typeof(raw_data) = 'text'
+            ORDER BY id
+            LIMIT ?
+        """, (after_id, batch_size)).fetchall()
+        if not rows:
+            return converted
+        after_id = rows[-1][0]
+        with conn:
+            conn.executemany(f"UPDATE {table} SET raw_data = ? WHERE id = ?",
+                             [(compress_raw_data(raw, level), row_id) for row_id, raw in rows])
+        converted += len(rows)
+        if pause:
+            time.sleep(pause)
+
+
+def storage_report(conn: sqlite3.Connection, db_path: str, table: str = 'incoming_messages') -> Dict[str, Any]:
+    """数据库文件大小及 raw_data 存储占用"""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    rows, raw_bytes, compressed, plain = conn.execute(f"""
+        SELECT COUNT(*),
+               COALESCE(SUM(LENGTH(CAST(raw_data AS BLOB))), 0),
+               SUM(CASE WHEN typeof(raw_data) = 'blob' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN typeof(raw_data) = 'text' THEN 1 ELSE 0 END)
+        FROM {table}
+    """).fetchone()
+    return {
+        'file_bytes': os.path.getsize(db_path) if os.path.exists(db_path) else 0,
+        'page_size': page_size,
+        'page_count': page_count,
+        'freelist_pages': freelist,
+        'rows': rows,
+        'raw_data_bytes': raw_bytes,
+        'avg_raw_data_bytes': round(raw_bytes / rows, 1) if rows else 0,
+        'compressed_rows': compressed or 0,
+        'plain_rows': plain or 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='raw_data 压缩迁移与空间报告')
+    parser.add_argument('--db', default=os.getenv('LOCAL_DB_PATH', './feishu_local_messages.db'),
+                        help='本地数据库路径（默认 LOCAL_DB_PATH）')
+    parser.add_argument('--table', default='incoming_messages')
+    parser.add_argument('--migrate', action='store_true', help='把明文 raw_data 转换为压缩格式')
+    parser.add_argument('--level', type=int, default=6, help='zlib 压缩级别')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--vacuum', action='store_true', help='迁移后执行 VACUUM 收缩文件（需停服）')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    conn.execute("PRAGMA busy_timeout=30000")
+    result = {'before': storage_report(conn, args.db, args.table)}
+    if args.migrate:
+        started = time.monotonic()
+        result['converted'] = migrate_table(conn, args.table, args.level, args.batch_size)
+        result['seconds'] = round(time.monotonic() - started, 2)
+        if args.vacuum:
+            conn.execute("VACUUM")
+        elif conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            conn.executescript("PRAGMA incremental_vacuum;")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        result['after'] = storage_report(conn, args.db, args.table)
+    conn.close()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
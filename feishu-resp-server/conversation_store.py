@@ -0,0 +1,89 @@
+"""
+按会话缓存的对话历史（LRU）
+
+每个会话（同一聊天中的同一发送者）保留最近若干轮 (用户消息, 回复)，调用 OpenClaw 时作为上下文一并发送。
+内存中只保留最近使用的 capacity 个会话，超出时淘汰最久未使用的会话；未命中时通过 loader 从本地库读取。
+每个会话的历史按轮数（max_turns）与字符数（max_chars）裁剪，内存占用上限约为 capacity * max_chars 个字符。
+本地库是唯一的状态来源：缓存中没有的会话不在内存中追加，下次读取时从本地库加载完整历史。
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+
+Turn = Tuple[str, str]
+
+
+class ConversationStore:
+
+    def __init__(self, loader: Callable[[Any, int], List[Turn]], capacity: int = 1000,
+                 max_turns: int = 10, max_chars: int = 4000):
+        """
+        :param loader: loader(key, limit) 从本地库读取该会话最近 limit 轮对话，按时间从早到晚排列
+        """
+        self.loader = loader
+        self.capacity = max(1, capacity)
+        self.max_turns = max(1, max_turns)
+        self.max_chars = max(1, max_chars)
+        # key -> 该会话的对话历史，按最近使用排序（末尾最新）
+        self._sessions: 'OrderedDict[Any, List[Turn]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key) -> List[Turn]:
+        """返回该会话裁剪后的对话历史（副本）"""
+        with self._lock:
+            turns = self._sessions.get(key)
+            if turns is not None:
+                self._sessions.move_to_end(key)
+                self.hits += 1
+                return list(turns)
+            self.misses += 1
+
+        # 读取本地库时不持有锁；同一会话的消息按顺序处理，不会并发加载同一个会话
+        turns = self._trim(self.loader(key, self.max_turns))
+        with self._lock:
+            self._sessions[key] = turns
+            self._sessions.move_to_end(key)
+            self._evict()
+        return list(turns)
+
+    def append(self, key, user: str, assistant: str):
+        """记录一轮对话；会话不在缓存中时忽略，下次读取时从本地库加载"""
+        with self._lock:
+            turns = self._sessions.get(key)
+            if turns is None:
+                return
+            turns.append((user, assistant))
+            self._sessions[key] = self._trim(turns)
+            self._sessions.move_to_end(key)
+
+    def _trim(self, turns: List[Turn]) -> List[Turn]:
+        """保留最近的 max_turns 轮，且总字符数不超过 max_chars"""
+        turns = turns[-self.max_turns:]
+        total = 0
+        for index in range(len(turns) - 1, -1, -1):
+            total += len(turns[index][0]) + len(turns[index][1])
+            if total > self.max_chars:
+                return turns[index + 1:]
+        return turns
+
+    def _evict(self):
+        while len(self._sessions) > self.capacity:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'capacity': self.capacity,
+                'turns': sum(len(turns) for turns in self._sessions.values()),
+                'chars': sum(len(user) + len(assistant) for turns in self._sessions.values()
+                             for user, assistant in turns),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
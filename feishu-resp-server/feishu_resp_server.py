@@ -7,25 +7,24 @@ import requests
 import time
 import logging
 import signal
+import socket
 import sys
 from datetime import datetime
 import sqlite3
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 import threading
-from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
 
-# 配置日志
+from log_setup import setup_logging
+from compression import compress_raw_data, decompress_raw_data
+from conversation_store import ConversationStore
+from http_session import create_session, timeout_with
+from keyed_executor import KeyedExecutor
+from response_cache import ResponseCache
+from streaming_reply import StreamingReply, parse_stream_line
+
+# 配置日志（处理器在 main() 中通过 log_setup.setup_logging 挂载）
 logger = logging.getLogger('feishu_resp_server')
-logger.setLevel(logging.INFO)
-handler = RotatingFileHandler(
-    'logs/service.log',
-    maxBytes=100*1024*1024,  # 100MB
-    backupCount=3
-)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
 
 class DirectFeishuSender:
     """
@@ -33,14 +32,21 @@ class DirectFeishuSender:
     使用飞书官方API直接发送消息
     """
     
-    def __init__(self, app_id: str = None, app_secret: str = None):
+    def __init__(self, app_id: str = None, app_secret: str = None, session: requests.Session = None,
+                 timeout: Tuple[float, float] = (5, 10), api_base: str = 'https://open.feishu.cn'):
         """
         初始化发送器
         :param app_id: 飞书应用ID
         :param app_secret: 飞书应用密钥
+        :param session: 复用连接的 Session，默认新建
+        :param timeout: (连接超时, 读超时)，单位秒
+        :param api_base: 开放平台地址
         """
         self.app_id = app_id or os.environ.get('FEISHU_APP_ID')
         self.app_secret = app_secret or os.environ.get('FEISHU_APP_SECRET')
+        self.session = session or create_session()
+        self.timeout = timeout
+        self.api_base = api_base.rstrip('/')
         self.access_token = None
         self.token_expire_time = 0
     
@@ -52,7 +58,7 @@ class DirectFeishuSender:
             # 令牌未过期且还有至少60秒有效期
             return self.access_token
         
-        url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
+        url = f"{self.api_base}/open-apis/auth/v3/tenant_access_token/internal"
         
         headers = {
             "Content-Type": "application/json; charset=utf-8"
@@ -64,7 +70,7 @@ class DirectFeishuSender:
         }
         
         try:
-            response = requests.post(url, headers=headers, json=data, timeout=10)
+            response = self.session.post(url, headers=headers, json=data, timeout=self.timeout)
             if response.status_code == 200:
                 result = response.json()
                 if result.get("code") == 0:
@@ -74,13 +80,13 @@ class DirectFeishuSender:
                     self.token_expire_time = datetime.now().timestamp() + result.get("expire", 7200) - 60
                     return self.access_token
                 else:
-                    logger.error(f"获取访问令牌失败: {result}")
+                    logger.error("获取访问令牌失败: %s", result)
                     return None
             else:
-                logger.error(f"请求访问令牌失败: {response.status_code} - {response.text}")
+                logger.error("请求访问令牌失败: %s - %s", response.status_code, response.text)
                 return None
         except Exception as e:
-            logger.error(f"获取访问令牌异常: {e}")
+            logger.error("获取访问令牌异常: %s", e)
             return None
     
     def send_message(self, recipient_id: str, content: str, message_type: str = 'text', receive_id_type: str = 'open_id') -> bool:
@@ -92,28 +98,25 @@ class DirectFeishuSender:
         :param receive_id_type: 接收者ID类型,默认为open_id（与消息接收时提取的ID类型保持一致）
         :return: 发送是否成功
         """
+        return self.create_message(recipient_id, content, receive_id_type) is not None
+    
+    def create_message(self, recipient_id: str, content: str, receive_id_type: str = 'open_id') -> Optional[str]:
+        """
+        发送文本消息
+        :return: 飞书消息ID（用于之后编辑该消息），失败返回 None；已发出但响应中没有消息ID时返回空字符串
+        """
         access_token = self.get_access_token()
         if not access_token:
             logger.error("无法获取访问令牌,无法发送消息")
-            return False
+            return None
         
-        url = "https://open.feishu.cn/open-apis/im/v1/messages"
+        url = f"{self.api_base}/open-apis/im/v1/messages"
         
         headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json; charset=utf-8"
         }
         
-        # 构建消息内容
-        if message_type == 'text':
-            content_json = {
-                "text": content
-            }
-        else:
-            content_json = {
-                "text": content  # 默认按文本处理
-            }
-        
         params = {
             "receive_id_type": receive_id_type
         }
@@ -121,24 +124,55 @@ class DirectFeishuSender:
         data = {
             "receive_id": recipient_id,
             "msg_type": "text",
-            "content": json.dumps(content_json)
+            "content": json.dumps({"text": content})
         }
         
         try:
-            response = requests.post(url, headers=headers, params=params, json=data, timeout=10)
+            response = self.session.post(url, headers=headers, params=params, json=data, timeout=self.timeout)
             if response.status_code == 200:
                 result = response.json()
                 if result.get("code") == 0:
-                    logger.info(f"消息发送成功: {content[:50]}...")
-                    return True
+                    logger.info("消息发送成功: %.50s...", content)
+                    return (result.get("data") or {}).get("message_id") or ''
                 else:
-                    logger.error(f"消息发送失败: {result}")
-                    return False
+                    logger.error("消息发送失败: %s", result)
+                    return None
             else:
-                logger.error(f"消息发送请求失败: {response.status_code} - {response.text}")
-                return False
+                logger.error("消息发送请求失败: %s - %s", response.status_code, response.text)
+                return None
         except Exception as e:
-            logger.error(f"发送消息异常: {e}")
+            logger.error("发送消息异常: %s", e)
+            return None
+    
+    def update_message(self, message_id: str, content: str) -> bool:
+        """
+        编辑已发送的文本消息（飞书对单条消息的编辑次数有上限）
+        """
+        access_token = self.get_access_token()
+        if not access_token:
+            logger.error("无法获取访问令牌,无法编辑消息")
+            return False
+        
+        url = f"{self.api_base}/open-apis/im/v1/messages/{message_id}"
+        
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json; charset=utf-8"
+        }
+        
+        data = {
+            "msg_type": "text",
+            "content": json.dumps({"text": content})
+        }
+        
+        try:
+            response = self.session.put(url, headers=headers, json=data, timeout=self.timeout)
+            if response.status_code == 200 and response.json().get("code") == 0:
+                return True
+            logger.error("编辑消息失败: %s - %s", response.status_code, response.text)
+            return False
+        except Exception as e:
+            logger.error("编辑消息异常: %s", e)
             return False
 
 
@@ -148,24 +182,28 @@ class OpenClawGatewayClient:
     通过 OpenAI 兼容 API 与 OpenClaw agent 交互
     """
     
-    def __init__(self, gateway_url: str, gateway_token: str, agent_id: str):
+    def __init__(self, gateway_url: str, gateway_token: str, agent_id: str, session: requests.Session = None,
+                 timeout: Tuple[float, float] = (5, 30)):
         """
         初始化客户端
         :param gateway_url: OpenClaw Gateway URL
         :param gateway_token: Gateway 认证令牌
         :param agent_id: Agent ID
+        :param session: 复用连接的 Session，默认新建
+        :param timeout: (连接超时, 读超时)，单位秒
         """
         self.gateway_url = gateway_url
         self.gateway_token = gateway_token
         self.agent_id = agent_id
+        self.session = session or create_session()
+        self.timeout = timeout
         self.chat_url = f"{gateway_url}/v1/chat/completions"
     
-    def chat(self, message: str, user_id: str = None) -> str:
+    def build_request(self, message: str, user_id: str = None, stream: bool = False,
+                      history: List[Dict] = None) -> Tuple[Dict, Dict]:
         """
-        与 agent 对话
-        :param message: 用户消息
-        :param user_id: 用户ID（用于会话保持）
-        :return: agent 的回复
+        构造对话请求的 (headers, body)
+        :param history: 之前的对话（OpenAI 格式的 user/assistant 消息），放在本条消息之前
         """
         headers = {
             'Authorization': f'Bearer {self.gateway_token}',
@@ -175,27 +213,58 @@ class OpenClawGatewayClient:
         data = {
             'model': f'openclaw:{self.agent_id}',
             'messages': [
+                *(history or []),
                 {'role': 'user', 'content': message}
             ],
-            'stream': False
+            'stream': stream
         }
         
         if user_id:
             data['user'] = user_id
+        return headers, data
+    
+    def chat(self, message: str, user_id: str = None, history: List[Dict] = None) -> str:
+        """
+        与 agent 对话
+        :param message: 用户消息
+        :param user_id: 用户ID（用于会话保持）
+        :param history: 之前的对话
+        :return: agent 的回复
+        """
+        headers, data = self.build_request(message, user_id, history=history)
         
         try:
-            response = requests.post(self.chat_url, headers=headers, json=data, timeout=30)
+            response = self.session.post(self.chat_url, headers=headers, json=data, timeout=self.timeout)
             response.raise_for_status()
             
             result = response.json()
             return result['choices'][0]['message']['content']
         except requests.exceptions.RequestException as e:
-            logger.error(f"调用 OpenClaw Gateway 失败: {e}")
+            logger.error("调用 OpenClaw Gateway 失败: %s", e)
             return None
         except (KeyError, IndexError) as e:
-            logger.error(f"解析 OpenClaw 响应失败: {e}")
-            logger.error(f"响应内容: {response.text if 'response' in locals() else 'N/A'}")
+            logger.error("解析 OpenClaw 响应失败: %s", e)
+            logger.error("响应内容: %s", response.text if 'response' in locals() else 'N/A')
             return None
+    
+    def chat_stream(self, message: str, user_id: str = None, history: List[Dict] = None) -> Iterator[str]:
+        """
+        流式对话：逐段产出 agent 回复的增量内容（OpenAI 兼容的 SSE 流，以 data: [DONE] 结束）
+        读超时作用于相邻两段数据之间；连接失败、流中断或解析失败时抛出异常
+        """
+        headers, data = self.build_request(message, user_id, stream=True, history=history)
+        
+        with self.session.post(self.chat_url, headers=headers, json=data, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            # chunk_size=1：按到达的字节逐行解析，每段内容到达即交付；
+            # SSE 固定为 UTF-8，按字节分行后再解码（text/event-stream 不带 charset 时 requests 会按 ISO-8859-1 解码）
+            for line in response.iter_lines(chunk_size=1):
+                delta = parse_stream_line(line.decode('utf-8'))
+                if delta is None:
+                    return
+                if delta:
+                    yield delta
+
 
 class FeishuReplyService:
     """
@@ -203,6 +272,14 @@ class FeishuReplyService:
     用于从公网服务器获取未处理的消息并进行处理和回复
     """
     
+    # 拉取消息时只请求本服务用到的字段（不含 raw_data），旧版本服务端忽略该参数返回全部字段
+    REMOTE_FIELDS = 'id,message_id,sender_id,chat_id,content,message_type'
+    # stream 模式下确认（标记远程已处理）的攒批等待时间（秒）与单次请求的消息数上限
+    STREAM_ACK_INTERVAL = 0.2
+    STREAM_ACK_BATCH = 100
+    # 处理出错的消息重试等待时间上限（秒）
+    PROCESS_RETRY_MAX_DELAY = 300
+    
     def __init__(self):
         """
         初始化回复服务
@@ -213,6 +290,31 @@ class FeishuReplyService:
         self.verification_code = self.config.get('verification_code')
         self.check_interval = self.config.get('check_interval', 3)  # 检查间隔（秒）
         self.local_db_path = self.config.get('local_db_path', './feishu_local_messages.db')
+        # 本地库写锁的最长等待时间（秒），多个处理线程同时写入时排队而不是报 database is locked
+        self.local_db_timeout = self.config.get('local_db_busy_timeout', 5000) / 1000.0
+        # 获取模式：poll 轮询未处理消息；claim 领取租约（支持多实例并行消费）
+        self.fetch_mode = self.config.get('fetch_mode', 'poll')
+        self.consumer_id = self.config.get('consumer_id')
+        self.lease_seconds = self.config.get('lease_seconds', 60)
+        # 长轮询等待时间（秒），0 表示关闭长轮询，每秒轮询一次
+        self.long_poll_wait = self.config.get('long_poll_wait', 25)
+        # stream 模式下的读超时（秒），需大于服务端心跳间隔
+        self.stream_read_timeout = self.config.get('stream_read_timeout', 60)
+        # 本地 raw_data 的 zlib 压缩级别，0 表示明文存储
+        self.raw_data_level = self.config.get('raw_data_level', 6)
+        # 公网服务配置了多个机器人时只拉取本服务所用应用的消息（单机器人的公网服务忽略该参数）
+        self.app_id = self.config.get('feishu_app_id') or None
+        # 并行处理消息的线程数；同一发送者的消息始终按顺序逐条处理
+        self.process_concurrency = max(1, self.config.get('process_concurrency', 4))
+        # 处理出错的消息按指数退避重试（首次等待 process_retry_delay 秒），达到次数上限后发送默认回复并标记已处理
+        self.process_max_attempts = max(1, self.config.get('process_max_attempts', 5))
+        self.process_retry_delay = max(0.0, self.config.get('process_retry_delay', 5))
+        # HTTP 连接池：飞书、OpenClaw 与公网服务各一个 Session，连接在请求之间复用
+        http_config = self.config.get('http', {})
+        self.http_timeout = (http_config.get('connect_timeout', 5), http_config.get('read_timeout', 10))
+        self.http_pool_size = http_config.get('pool_size', 10)
+        self.http_keep_alive = http_config.get('keep_alive', True)
+        self.session = create_session(self.http_pool_size, self.http_keep_alive)
         
         # 初始化本地数据库
         self.init_local_db()
@@ -220,7 +322,10 @@ class FeishuReplyService:
         # 初始化直接发送器,传入配置文件中的凭证
         self.direct_sender = DirectFeishuSender(
             app_id=self.config.get('feishu_app_id'),
-            app_secret=self.config.get('feishu_app_secret')
+            app_secret=self.config.get('feishu_app_secret'),
+            session=create_session(self.http_pool_size, self.http_keep_alive),
+            timeout=self.http_timeout,
+            api_base=http_config.get('feishu_api_base', 'https://open.feishu.cn')
         )
         
         # 初始化 OpenClaw Gateway 客户端
@@ -230,18 +335,69 @@ class FeishuReplyService:
             self.openclaw_client = OpenClawGatewayClient(
                 gateway_url=openclaw_config.get('gateway_url', ''),
                 gateway_token=openclaw_config.get('gateway_token', ''),
-                agent_id=openclaw_config.get('agent_id', 'secretary-agent')
+                agent_id=openclaw_config.get('agent_id', 'secretary-agent'),
+                session=create_session(self.http_pool_size, self.http_keep_alive),
+                timeout=(self.http_timeout[0], openclaw_config.get('timeout', 30))
             )
-            logger.info(f"OpenClaw Gateway 客户端已初始化，agent_id: {openclaw_config.get('agent_id')}")
+            logger.info("OpenClaw Gateway 客户端已初始化，agent_id: %s", openclaw_config.get('agent_id'))
         else:
             self.openclaw_client = None
             logger.info("OpenClaw Gateway 未启用")
+        self.openclaw_stream = self.openclaw_enabled and openclaw_config.get('stream', False)
+        self.stream_settings = {
+            'interval': openclaw_config.get('stream_interval', 1),
+            'first_chars': openclaw_config.get('stream_first_chars', 10),
+            'max_edits': openclaw_config.get('stream_max_edits', 20),
+        }
+        
+        # 对话历史：调用 OpenClaw 时附带该用户最近的对话，热会话缓存在内存中，未命中时从本地库读取
+        history_config = self.config.get('history', {})
+        if history_config.get('enabled', False):
+            self.conversations = ConversationStore(
+                self.load_conversation,
+                capacity=history_config.get('cache_size', 1000),
+                max_turns=history_config.get('max_turns', 10),
+                max_chars=history_config.get('max_chars', 4000)
+            )
+        else:
+            self.conversations = None
+        
+        # OpenClaw 回复缓存：相同问题（规范化后）在有效期内直接返回缓存的回复
+        cache_config = self.config.get('response_cache', {})
+        if self.openclaw_enabled and cache_config.get('enabled', False):
+            self.response_cache = ResponseCache(
+                self.local_db_path,
+                timeout=self.local_db_timeout,
+                ttl=cache_config.get('ttl', 3600),
+                max_entries=cache_config.get('max_entries', 1000),
+                bypass_agents=cache_config.get('bypass_agents', []),
+                per_user_agents=cache_config.get('per_user_agents', [])
+            )
+            if not self.response_cache.enabled_for(self.openclaw_client.agent_id):
+                logger.info("agent %s 不使用回复缓存", self.openclaw_client.agent_id)
+            elif self.openclaw_client.agent_id in self.response_cache.per_user_agents:
+                logger.info("agent %s 的回复缓存按用户区分", self.openclaw_client.agent_id)
+            if self.conversations:
+                logger.warning("已开启对话历史：只有没有历史的首条消息读写回复缓存，回复缓存基本不会命中")
+        else:
+            self.response_cache = None
         
         # 线程相关
         self.fetch_thread = None
         self.process_thread = None
         self.stop_event = threading.Event()
         self.db_lock = threading.Lock()  # 数据库访问锁
+        
+        # 消息处理线程池（按 sender_id 串行），在处理线程启动时创建
+        self.executor = None
+        # 有任务在处理或排队中的发送者 -> 任务数；调度时跳过这些发送者，保证同一发送者同时只有一条消息在处理
+        self.busy_senders = {}
+        self.busy_lock = threading.Lock()
+        # 任务完成时唤醒调度，立即派发该发送者的下一条消息
+        self.dispatch_event = threading.Event()
+        # stream 模式下已落库、待确认的远程消息ID，由确认线程攒批标记为已处理
+        self.pending_acks = []
+        self.ack_cond = threading.Condition()
     
     def load_config(self) -> Dict:
         """
@@ -255,9 +411,28 @@ class FeishuReplyService:
             'feishuListenerUrl': os.getenv('FEISHU_LISTENER_URL', ''),
             'verification_code': os.getenv('VERIFICATION_CODE', ''),
             'local_db_path': os.getenv('LOCAL_DB_PATH', './feishu_local_messages.db'),
+            'local_db_busy_timeout': int(os.getenv('LOCAL_DB_BUSY_TIMEOUT', '5000')),
             'check_interval': int(os.getenv('CHECK_INTERVAL', '3')),
             'feishu_app_id': os.getenv('FEISHU_APP_ID', ''),
             'feishu_app_secret': os.getenv('FEISHU_APP_SECRET', ''),
+            'fetch_mode': os.getenv('FETCH_MODE', 'poll').lower(),
+            'consumer_id': os.getenv('CONSUMER_ID', '') or f"{socket.gethostname()}-{os.getpid()}",
+            'lease_seconds': float(os.getenv('LEASE_SECONDS', '60')),
+            'long_poll_wait': float(os.getenv('LONG_POLL_WAIT', '25')),
+            'stream_read_timeout': float(os.getenv('STREAM_READ_TIMEOUT', '60')),
+            'raw_data_level': int(os.getenv('RAW_DATA_COMPRESS_LEVEL', '6')),
+            'process_concurrency': int(os.getenv('PROCESS_CONCURRENCY', '4')),
+            'process_max_attempts': int(os.getenv('PROCESS_MAX_ATTEMPTS', '5')),
+            'process_retry_delay': float(os.getenv('PROCESS_RETRY_DELAY', '5')),
+        }
+        
+        # HTTP 连接池配置
+        config['http'] = {
+            'pool_size': int(os.getenv('HTTP_POOL_SIZE', '10')),
+            'keep_alive': os.getenv('HTTP_KEEP_ALIVE', 'true').lower() in ('true', '1', 'yes'),
+            'connect_timeout': float(os.getenv('HTTP_CONNECT_TIMEOUT', '5')),
+            'read_timeout': float(os.getenv('HTTP_READ_TIMEOUT', '10')),
+            'feishu_api_base': os.getenv('FEISHU_API_BASE', 'https://open.feishu.cn'),
         }
         
         # OpenClaw 配置
@@ -267,17 +442,51 @@ class FeishuReplyService:
             'gateway_url': os.getenv('OPENCLAW_GATEWAY_URL', ''),
             'gateway_token': os.getenv('OPENCLAW_GATEWAY_TOKEN', ''),
             'agent_id': os.getenv('OPENCLAW_AGENT_ID', 'secretary-agent'),
+            'timeout': float(os.getenv('OPENCLAW_TIMEOUT', '30')),
+            # 流式回复：边生成边发送，首条消息发出后按节奏原地编辑
+            'stream': os.getenv('OPENCLAW_STREAM', 'false').lower() in ('true', '1', 'yes'),
+            'stream_interval': float(os.getenv('STREAM_UPDATE_INTERVAL', '1')),
+            'stream_first_chars': int(os.getenv('STREAM_FIRST_CHARS', '10')),
+            'stream_max_edits': int(os.getenv('STREAM_MAX_EDITS', '20')),
+        }
+        
+        # 对话历史配置
+        config['history'] = {
+            'enabled': os.getenv('HISTORY_ENABLED', 'false').lower() in ('true', '1', 'yes'),
+            'cache_size': int(os.getenv('HISTORY_CACHE_SIZE', '1000')),
+            'max_turns': int(os.getenv('HISTORY_MAX_TURNS', '10')),
+            'max_chars': int(os.getenv('HISTORY_MAX_CHARS', '4000')),
+        }
+        
+        # OpenClaw 回复缓存配置
+        config['response_cache'] = {
+            'enabled': os.getenv('RESPONSE_CACHE_ENABLED', 'false').lower() in ('true', '1', 'yes'),
+            'ttl': float(os.getenv('RESPONSE_CACHE_TTL', '3600')),
+            'max_entries': int(os.getenv('RESPONSE_CACHE_SIZE', '1000')),
+            'bypass_agents': [agent.strip() for agent in os.getenv('RESPONSE_CACHE_BYPASS_AGENTS', '').split(',')
+                              if agent.strip()],
+            'per_user_agents': [agent.strip() for agent in os.getenv('RESPONSE_CACHE_PER_USER_AGENTS', '').split(',')
+                                if agent.strip()],
         }
         
         return config
     
+    def connect_local_db(self) -> sqlite3.Connection:
+        """
+        打开本地数据库连接，写锁被占用时最多等待 LOCAL_DB_BUSY_TIMEOUT 毫秒
+        """
+        return sqlite3.connect(self.local_db_path, timeout=self.local_db_timeout)
+    
     def init_local_db(self):
         """
         初始化本地数据库,用于记录已处理的消息
         """
-        conn = sqlite3.connect(self.local_db_path)
+        conn = self.connect_local_db()
         cursor = conn.cursor()
         
+        # WAL 模式（写入数据库文件，只需设置一次）：读不阻塞写，处理线程并发写入时只在提交时短暂互斥
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # 创建 incoming_messages 表（从公网服务获取的原始消息）
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS incoming_messages (
@@ -290,10 +499,18 @@ class FeishuReplyService:
                 message_type TEXT,
                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
                 processed INTEGER DEFAULT 0,
-                raw_data TEXT
+                raw_data TEXT,
+                attempts INTEGER DEFAULT 0,
+                retry_at REAL DEFAULT 0
             )
         ''')
         
+        # 已有的本地库补齐处理出错的次数与下次重试时间（Unix 时间戳）
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(incoming_messages)')}
+        for column, definition in (('attempts', 'INTEGER DEFAULT 0'), ('retry_at', 'REAL DEFAULT 0')):
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE incoming_messages ADD COLUMN {column} {definition}')
+        
         # 创建索引
         cursor.execute('''
             CREATE INDEX IF NOT EXISTS idx_incoming_processed 
@@ -305,17 +522,34 @@ class FeishuReplyService:
             ON incoming_messages(timestamp)
         ''')
         
-        # 创建已处理消息表
+        # 按会话读取对话历史
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_incoming_conversation 
+            ON incoming_messages(sender_id, chat_id)
+        ''')
+        
+        # 创建已处理消息表（failed = 1 表示回复不是 OpenClaw 的回答：默认回复、调用失败或流式回复中断，不作为对话历史）
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS processed_messages (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 message_id TEXT UNIQUE,
                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
                 original_content TEXT,
-                processed_result TEXT
+                processed_result TEXT,
+                failed INTEGER DEFAULT 0
             )
         ''')
         
+        # 已有的本地库补齐 failed 字段，按默认回复的固定格式标记此前保存的失败回复
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(processed_messages)')}
+        if 'failed' not in columns:
+            cursor.execute('ALTER TABLE processed_messages ADD COLUMN failed INTEGER DEFAULT 0')
+            cursor.execute('''
+                UPDATE processed_messages SET failed = 1 
+                WHERE processed_result LIKE ? OR processed_result LIKE ? OR processed_result LIKE ?
+            ''', ('抱歉，AI助手暂时无法回复。%', '已收到您的消息: %。我是一个AI助手，很高兴为您服务！', '%（回复中断: %）'))
+            logger.info("本地库迁移: processed_messages 增加字段 failed，已标记 %s 条失败回复", cursor.rowcount)
+        
         # 创建待回复消息表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS pending_replies (
@@ -327,6 +561,22 @@ class FeishuReplyService:
             )
         ''')
         
+        # 创建 OpenClaw 回复缓存表（cache_key 为 agent_id 与规范化问题的哈希，created_at 为 Unix 时间戳）
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache (
+                cache_key TEXT PRIMARY KEY,
+                agent_id TEXT,
+                question TEXT,
+                response TEXT,
+                created_at REAL
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_response_cache_created 
+            ON response_cache(created_at)
+        ''')
+        
         conn.commit()
         conn.close()
     
@@ -342,7 +592,7 @@ class FeishuReplyService:
         message_type = message.get('message_type', 'text')
         
         with self.db_lock:
-            conn = sqlite3.connect(self.local_db_path)
+            conn = self.connect_local_db()
             cursor = conn.cursor()
             
             try:
@@ -357,32 +607,43 @@ class FeishuReplyService:
                     chat_id,
                     content,
                     message_type,
-                    json.dumps(message, ensure_ascii=False)
+                    compress_raw_data(json.dumps(message, ensure_ascii=False), self.raw_data_level)
                 ))
                 
                 conn.commit()
+                # 唤醒处理线程派发新消息
+                self.dispatch_event.set()
                 return True
             except Exception as e:
-                logger.error(f"保存消息到本地数据库失败: {e}")
+                logger.error("保存消息到本地数据库失败: %s", e)
                 return False
             finally:
                 conn.close()
     
-    def get_local_unprocessed_messages(self, limit: int = 10) -> List[Dict]:
+    def get_local_unprocessed_messages(self, limit: int = 10, exclude_senders: List[str] = None) -> List[Dict]:
         """
-        从本地数据库获取未处理的消息
+        从本地数据库获取未处理的消息（按入库顺序）
+        :param exclude_senders: 跳过这些发送者的消息
         """
         with self.db_lock:
-            conn = sqlite3.connect(self.local_db_path)
+            conn = self.connect_local_db()
             cursor = conn.cursor()
             
             try:
-                cursor.execute('''
-                    SELECT * FROM incoming_messages 
-                    WHERE processed = 0 
-                    ORDER BY timestamp ASC 
+                exclude_senders = list(exclude_senders or [])
+                sender_filter = ''
+                if exclude_senders:
+                    sender_filter = f"AND COALESCE(sender_id, '') NOT IN ({','.join('?' * len(exclude_senders))})"
+                # 不读取 raw_data，需要时通过 get_local_raw_data 单独获取；
+                # 按自增 id 排序（timestamp 只精确到秒，同一秒内的先后顺序不确定）
+                cursor.execute(f'''
+                    SELECT id, server_id, message_id, sender_id, chat_id, content, message_type, timestamp, processed, 
+                           attempts, retry_at 
+                    FROM incoming_messages 
+                    WHERE processed = 0 {sender_filter}
+                    ORDER BY id ASC 
                     LIMIT ?
-                ''', (limit,))
+                ''', (*exclude_senders, limit))
                 
                 rows = cursor.fetchall()
                 columns = [column[0] for column in cursor.description]
@@ -390,17 +651,29 @@ class FeishuReplyService:
                 
                 return messages
             except Exception as e:
-                logger.error(f"获取本地未处理消息失败: {e}")
+                logger.error("获取本地未处理消息失败: %s", e)
                 return []
             finally:
                 conn.close()
     
+    def get_local_raw_data(self, local_id: int) -> Optional[str]:
+        """
+        读取并解压本地消息的 raw_data
+        """
+        with self.db_lock:
+            conn = self.connect_local_db()
+            try:
+                row = conn.execute('SELECT raw_data FROM incoming_messages WHERE id = ?', (local_id,)).fetchone()
+                return decompress_raw_data(row[0]) if row else None
+            finally:
+                conn.close()
+    
     def mark_local_processed(self, local_id: int) -> bool:
         """
         标记本地消息为已处理
         """
         with self.db_lock:
-            conn = sqlite3.connect(self.local_db_path)
+            conn = self.connect_local_db()
             cursor = conn.cursor()
             
             try:
@@ -413,11 +686,48 @@ class FeishuReplyService:
                 conn.commit()
                 return cursor.rowcount > 0
             except Exception as e:
-                logger.error(f"标记本地消息已处理失败: {e}")
+                logger.error("标记本地消息已处理失败: %s", e)
                 return False
             finally:
                 conn.close()
     
+    def record_local_failure(self, msg: Dict, error: Exception) -> bool:
+        """
+        记录本地消息处理出错：未达到 process_max_attempts 次时按指数退避设置下次重试时间，
+        期间不派发该发送者的消息（保持顺序）；达到上限后保存默认回复（待发送）并标记已处理，不再重试
+        :return: 是否已放弃重试
+        """
+        message_id = msg.get('message_id', 'unknown')
+        content = msg.get('content', '')
+        attempts = (msg.get('attempts') or 0) + 1
+        give_up = attempts >= self.process_max_attempts
+        if give_up:
+            logger.error("本地消息 %s 处理失败 %s 次，发送默认回复并不再重试: %s", message_id, attempts, error)
+            reply = self.fallback_reply(content, str(error) or type(error).__name__)
+            if msg.get('sender_id'):
+                self.add_reply_message(msg['sender_id'], reply)
+            self.save_processed_message(message_id, content, reply, failed=True)
+            retry_at = 0
+        else:
+            delay = min(self.process_retry_delay * 2 ** (attempts - 1), self.PROCESS_RETRY_MAX_DELAY)
+            logger.warning("本地消息 %s 第 %s 次处理失败，%.1f 秒后重试: %s", message_id, attempts, delay, error)
+            retry_at = time.time() + delay
+        
+        with self.db_lock:
+            conn = self.connect_local_db()
+            try:
+                conn.execute('''
+                    UPDATE incoming_messages 
+                    SET attempts = ?, retry_at = ?, processed = ? 
+                    WHERE id = ?
+                ''', (attempts, retry_at, 1 if give_up else 0, msg['id']))
+                conn.commit()
+            except Exception as e:
+                logger.error("保存本地消息 %s 的重试状态失败: %s", message_id, e)
+            finally:
+                conn.close()
+        return give_up
+    
     def fetch_from_remote(self):
         """
         线程1：从公网服务获取消息并落库
@@ -425,33 +735,157 @@ class FeishuReplyService:
         logger.info("消息获取线程启动")
         
         while self.running and not self.stop_event.is_set():
+            started = time.monotonic()
+            remote_messages = None
             try:
                 # 从公网服务获取未处理的消息
-                remote_messages = self.get_unprocessed_messages()
+                if self.fetch_mode == 'claim':
+                    remote_messages = self.claim_messages()
+                else:
+                    remote_messages = self.get_unprocessed_messages()
                 
                 if remote_messages:
-                    logger.info(f"从公网服务获取到 {len(remote_messages)} 条消息")
+                    logger.info("从公网服务获取到 %s 条消息", len(remote_messages))
                     
+                    saved_ids = []
+                    failed_ids = []
                     for msg in remote_messages:
                         # 保存到本地数据库
                         if self.save_incoming_message(msg):
-                            # 标记公网服务上的消息为已处理
                             server_id = msg.get('id')
-                            if server_id and self.mark_message_as_processed(server_id):
-                                logger.debug(f"消息 {msg.get('message_id')} 已保存到本地并标记远程为已处理")
+                            if server_id:
+                                saved_ids.append(server_id)
                         else:
-                            logger.warning(f"消息 {msg.get('message_id')} 保存到本地失败")
+                            logger.warning("消息 %s 保存到本地失败", msg.get('message_id'))
+                            if msg.get('id'):
+                                failed_ids.append(msg.get('id'))
+                    
+                    if self.fetch_mode == 'claim':
+                        # 确认已落库的消息，释放落库失败的消息供重新领取
+                        if saved_ids and self.lease_action('ack', saved_ids):
+                            logger.debug("%s 条消息已保存到本地并确认", len(saved_ids))
+                        if failed_ids:
+                            self.lease_action('release', failed_ids)
+                    # 一次请求批量标记公网服务上的消息为已处理
+                    elif saved_ids and self.mark_messages_as_processed(saved_ids):
+                        logger.debug("%s 条消息已保存到本地并标记远程为已处理", len(saved_ids))
                 else:
                     logger.debug("没有新消息")
                 
             except Exception as e:
-                logger.error(f"从远程获取消息时发生错误: {e}")
+                logger.error("从远程获取消息时发生错误: %s", e)
             
-            # 休息1秒
+            # 长轮询拿到消息或已在服务端等待过时立即进入下一轮，
+            # 否则（未开启长轮询、请求失败、旧版本服务端立即返回）休息1秒
+            if self.long_poll_wait > 0 and (remote_messages or time.monotonic() - started >= 1):
+                continue
             self.stop_event.wait(1)
         
         logger.info("消息获取线程停止")
     
+    def stream_from_remote(self):
+        """
+        线程1（stream 模式）：订阅公网服务的 SSE 消息流，收到即落库
+        断线后携带 Last-Event-ID 重连；进程刚启动时不带，服务端会先推送全部未处理消息。
+        Last-Event-ID 只前进到最后一条已落库的消息：落库失败时断开重连，服务端从该消息起重新推送
+        """
+        logger.info("消息获取线程启动（推送流模式）")
+        ack_thread = threading.Thread(target=self.ack_stream_messages, name="AckThread", daemon=True)
+        ack_thread.start()
+        
+        url = f"{self.api_base_url}/api/messages/stream"
+        params = {'fields': self.REMOTE_FIELDS}
+        if self.app_id:
+            params['app_id'] = self.app_id
+        last_event_id = None
+        
+        while self.running and not self.stop_event.is_set():
+            headers = {
+                'X-Verification-Code': self.verification_code,
+                'Accept': 'text/event-stream'
+            }
+            if last_event_id:
+                headers['Last-Event-ID'] = last_event_id
+            
+            try:
+                # 读超时需大于服务端心跳间隔，超时即视为连接已失效
+                with self.session.get(url, headers=headers, params=params, stream=True,
+                                      timeout=(self.http_timeout[0], self.stream_read_timeout)) as response:
+                    if response.status_code != 200:
+                        logger.error("订阅消息流失败: %s - %s", response.status_code, response.text)
+                    else:
+                        logger.info("消息流已连接，Last-Event-ID: %s", last_event_id)
+                        event_id, data_lines = None, []
+                        # chunk_size=1：按到达的字节逐行解析，避免等待凑满缓冲区才交付事件
+                        for line in response.iter_lines(chunk_size=1, decode_unicode=True):
+                            if self.stop_event.is_set():
+                                break
+                            if line:
+                                field, _, value = line.partition(':')
+                                value = value[1:] if value.startswith(' ') else value
+                                if field == 'id':
+                                    event_id = value
+                                elif field == 'data':
+                                    data_lines.append(value)
+                                continue
+                            
+                            # 空行表示一个事件结束
+                            if data_lines and not self.handle_stream_message(json.loads('\n'.join(data_lines))):
+                                break
+                            if event_id:
+                                last_event_id = event_id
+                            event_id, data_lines = None, []
+            except requests.exceptions.RequestException as e:
+                logger.warning("消息流连接中断: %s", e)
+            except Exception as e:
+                logger.error("处理消息流时发生错误: %s", e)
+            
+            self.stop_event.wait(1)
+        
+        ack_thread.join(timeout=5)
+        logger.info("消息获取线程停止")
+    
+    def ack_stream_messages(self):
+        """
+        stream 模式的确认线程：攒批后一次请求标记远程为已处理，失败的留到下一批重试；
+        停止时确认剩余的消息，仍失败的在下次连接时由服务端重新推送（本地按 server_id 去重）
+        """
+        while True:
+            with self.ack_cond:
+                while not self.pending_acks and not self.stop_event.is_set():
+                    self.ack_cond.wait(1)
+                if not self.pending_acks:
+                    return
+            # 同一批推送的消息连续到达，稍等片刻一起确认
+            self.stop_event.wait(self.STREAM_ACK_INTERVAL)
+            with self.ack_cond:
+                message_ids = self.pending_acks[:self.STREAM_ACK_BATCH]
+                del self.pending_acks[:self.STREAM_ACK_BATCH]
+            if self.mark_messages_as_processed(message_ids):
+                logger.debug("%s 条推送消息已保存到本地并标记远程为已处理", len(message_ids))
+                continue
+            with self.ack_cond:
+                self.pending_acks[:0] = message_ids
+            if self.stop_event.is_set():
+                return
+            self.stop_event.wait(1)
+    
+    def handle_stream_message(self, msg: Dict) -> bool:
+        """
+        处理推送流中的单条消息：落库后交给确认线程批量标记远程为已处理
+        :return: 是否已落库
+        """
+        logger.info("从消息流收到消息: %s", msg.get('message_id'))
+        if not self.save_incoming_message(msg):
+            logger.warning("消息 %s 保存到本地失败，重新连接后从该消息继续", msg.get('message_id'))
+            return False
+        server_id = msg.get('id')
+        if server_id:
+            with self.ack_cond:
+                self.pending_acks.append(server_id)
+                self.ack_cond.notify()
+        return True
+    
     def get_unprocessed_messages(self) -> List[Dict]:
         """
         从公网服务器获取未处理的消息
@@ -461,8 +895,15 @@ class FeishuReplyService:
             'X-Verification-Code': self.verification_code
         }
         
+        params = {'fields': self.REMOTE_FIELDS}
+        if self.long_poll_wait > 0:
+            params['wait'] = self.long_poll_wait
+        if self.app_id:
+            params['app_id'] = self.app_id
+        
         try:
-            response = requests.get(url, headers=headers, timeout=10)
+            response = self.session.get(url, headers=headers, params=params,
+                                        timeout=timeout_with(self.http_timeout, self.long_poll_wait))
             if response.status_code == 200:
                 result = response.json()
                 # 检查是否是包含data字段的响应格式
@@ -471,12 +912,68 @@ class FeishuReplyService:
                 else:
                     return result
             else:
-                logger.error(f"获取消息失败: {response.status_code} - {response.text}")
+                logger.error("获取消息失败: %s - %s", response.status_code, response.text)
+                return []
+        except requests.exceptions.RequestException as e:
+            logger.error("请求异常: %s", e)
+            return []
+    
+    def claim_messages(self) -> List[Dict]:
+        """
+        从公网服务器领取未处理的消息（带租约）
+        """
+        url = f"{self.api_base_url}/api/messages/claim"
+        headers = {
+            'X-Verification-Code': self.verification_code
+        }
+        data = {
+            'consumer_id': self.consumer_id,
+            'lease_seconds': self.lease_seconds,
+            'wait': self.long_poll_wait,
+            'fields': self.REMOTE_FIELDS
+        }
+        if self.app_id:
+            data['app_id'] = self.app_id
+        
+        try:
+            response = self.session.post(url, headers=headers, json=data,
+                                         timeout=timeout_with(self.http_timeout, self.long_poll_wait))
+            if response.status_code == 200:
+                return response.json().get('data', [])
+            else:
+                logger.error("领取消息失败: %s - %s", response.status_code, response.text)
                 return []
         except requests.exceptions.RequestException as e:
-            logger.error(f"请求异常: {e}")
+            logger.error("请求异常: %s", e)
             return []
     
+    def lease_action(self, action: str, message_ids: List[int]) -> bool:
+        """
+        对已领取的消息执行租约操作
+        :param action: renew（续租）、ack（确认）或 release（释放）
+        """
+        url = f"{self.api_base_url}/api/messages/{action}"
+        headers = {
+            'X-Verification-Code': self.verification_code
+        }
+        data = {
+            'consumer_id': self.consumer_id,
+            'ids': message_ids
+        }
+        if action == 'renew':
+            data['lease_seconds'] = self.lease_seconds
+        if self.app_id:
+            data['app_id'] = self.app_id
+        
+        try:
+            response = self.session.post(url, headers=headers, json=data, timeout=self.http_timeout)
+            if response.status_code != 200:
+                logger.error("租约操作失败(%s): %s - %s", action, response.status_code, response.text)
+            return response.status_code == 200
+        except requests.exceptions.RequestException as e:
+            logger.error("租约操作异常(%s): %s", action, e)
+            return False
+    
     def mark_message_as_processed(self, message_id: int) -> bool:
         """
         标记消息为已处理
@@ -486,66 +983,104 @@ class FeishuReplyService:
             'X-Verification-Code': self.verification_code
         }
         
+        params = {'app_id': self.app_id} if self.app_id else {}
+        
         try:
-            response = requests.post(url, headers=headers, timeout=10)
+            response = self.session.post(url, headers=headers, params=params, timeout=self.http_timeout)
             return response.status_code == 200
         except requests.exceptions.RequestException as e:
-            logger.error(f"标记消息为已处理失败: {e}")
+            logger.error("标记消息为已处理失败: %s", e)
             return False
     
-    def save_processed_message(self, message_id: str, original_content: str, result: str):
+    def mark_messages_as_processed(self, message_ids: List[int]) -> bool:
+        """
+        批量标记消息为已处理
+        公网服务不支持批量接口时（旧版本返回404）退回逐条标记
+        """
+        url = f"{self.api_base_url}/api/messages/mark-processed"
+        headers = {
+            'X-Verification-Code': self.verification_code
+        }
+        
+        data = {'ids': message_ids}
+        if self.app_id:
+            data['app_id'] = self.app_id
+        
+        try:
+            response = self.session.post(url, headers=headers, json=data, timeout=self.http_timeout)
+            if response.status_code == 404:
+                logger.warning("公网服务不支持批量标记，改为逐条标记")
+                return all([self.mark_message_as_processed(message_id) for message_id in message_ids])
+            if response.status_code != 200:
+                logger.error("批量标记消息失败: %s - %s", response.status_code, response.text)
+            return response.status_code == 200
+        except requests.exceptions.RequestException as e:
+            logger.error("批量标记消息为已处理失败: %s", e)
+            return False
+    
+    def save_processed_message(self, message_id: str, original_content: str, result: str, failed: bool = False):
         """
         在本地数据库中保存已处理的消息记录
+        :param failed: 回复不是 OpenClaw 的回答（默认回复、调用失败、流式回复中断），读取对话历史时跳过
         """
-        conn = sqlite3.connect(self.local_db_path)
+        conn = self.connect_local_db()
         cursor = conn.cursor()
         
         try:
             cursor.execute('''
                 INSERT OR REPLACE INTO processed_messages 
-                (message_id, original_content, processed_result) 
-                VALUES (?, ?, ?)
-            ''', (message_id, original_content, result))
+                (message_id, original_content, processed_result, failed) 
+                VALUES (?, ?, ?, ?)
+            ''', (message_id, original_content, result, 1 if failed else 0))
             
             conn.commit()
         except Exception as e:
-            logger.error(f"保存已处理消息记录失败: {e}")
+            logger.error("保存已处理消息记录失败: %s", e)
         finally:
             conn.close()
     
-    def add_reply_message(self, recipient_id: str, content: str) -> bool:
+    def add_reply_message(self, recipient_id: str, content: str, sent: bool = False) -> bool:
         """
         添加待回复的消息到本地数据库
+        :param sent: 回复已通过流式发送送达时直接记为已发送
         """
-        conn = sqlite3.connect(self.local_db_path)
+        conn = self.connect_local_db()
         cursor = conn.cursor()
         
         try:
             cursor.execute('''
-                INSERT INTO pending_replies (recipient_id, content) 
-                VALUES (?, ?)
-            ''', (recipient_id, content))
+                INSERT INTO pending_replies (recipient_id, content, sent) 
+                VALUES (?, ?, ?)
+            ''', (recipient_id, content, 1 if sent else 0))
             
             conn.commit()
             return True
         except Exception as e:
-            logger.error(f"添加回复消息失败: {e}")
+            logger.error("添加回复消息失败: %s", e)
             return False
         finally:
             conn.close()
     
-    def get_pending_replies(self) -> List[Dict]:
+    def get_pending_replies(self, recipient_id: str = None) -> List[Dict]:
         """
         获取待发送的回复消息
+        :param recipient_id: 只获取发给该接收者的回复
         """
-        conn = sqlite3.connect(self.local_db_path)
+        conn = self.connect_local_db()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT * FROM pending_replies 
-            WHERE sent = 0 
-            ORDER BY created_at ASC
-        ''')
+        if recipient_id is None:
+            cursor.execute('''
+                SELECT * FROM pending_replies 
+                WHERE sent = 0 
+                ORDER BY id ASC
+            ''')
+        else:
+            cursor.execute('''
+                SELECT * FROM pending_replies 
+                WHERE sent = 0 AND recipient_id = ? 
+                ORDER BY id ASC
+            ''', (recipient_id,))
         
         rows = cursor.fetchall()
         columns = [column[0] for column in cursor.description]
@@ -558,7 +1093,7 @@ class FeishuReplyService:
         """
         标记回复消息为已发送
         """
-        conn = sqlite3.connect(self.local_db_path)
+        conn = self.connect_local_db()
         cursor = conn.cursor()
         
         try:
@@ -571,7 +1106,7 @@ class FeishuReplyService:
             conn.commit()
             return cursor.rowcount > 0
         except Exception as e:
-            logger.error(f"标记回复为已发送失败: {e}")
+            logger.error("标记回复为已发送失败: %s", e)
             return False
         finally:
             conn.close()
@@ -584,19 +1119,31 @@ class FeishuReplyService:
         if self.direct_sender.app_id and self.direct_sender.app_secret:
             success = self.direct_sender.send_message(recipient_id, content)
             if success:
-                logger.info(f"回复消息已直接发送到飞书: {content[:50]}...")
+                logger.info("回复消息已直接发送到飞书: %.50s...", content)
             else:
-                logger.error(f"直接发送到飞书失败")
+                logger.error("直接发送到飞书失败")
             return success
         else:
             logger.error("未配置飞书应用凭证,无法发送消息")
             return False
     
-    def send_pending_replies_to_server(self) -> int:
+    def get_pending_recipients(self) -> List[str]:
+        """
+        获取有待发送回复的接收者
+        """
+        conn = self.connect_local_db()
+        try:
+            rows = conn.execute('SELECT DISTINCT recipient_id FROM pending_replies WHERE sent = 0').fetchall()
+            return [row[0] for row in rows if row[0] is not None]
+        finally:
+            conn.close()
+    
+    def send_pending_replies_to_server(self, recipient_id: str = None) -> int:
         """
         将本地待发送的回复消息批量发送到公网服务器
+        :param recipient_id: 只发送给该接收者的回复
         """
-        pending_replies = self.get_pending_replies()
+        pending_replies = self.get_pending_replies(recipient_id)
         sent_count = 0
         
         for reply in pending_replies:
@@ -609,106 +1156,339 @@ class FeishuReplyService:
                 # 标记为已发送
                 if self.mark_reply_as_sent(reply_id):
                     sent_count += 1
-                    logger.info(f"回复消息 {reply_id} 已发送并标记为已发送")
+                    logger.info("回复消息 %s 已发送并标记为已发送", reply_id)
                 else:
-                    logger.error(f"回复消息 {reply_id} 发送成功但本地标记失败")
+                    logger.error("回复消息 %s 发送成功但本地标记失败", reply_id)
             else:
-                logger.error(f"回复消息 {reply_id} 发送失败")
+                logger.error("回复消息 %s 发送失败", reply_id)
         
         return sent_count
     
-    def process_single_message(self, message: Dict) -> str:
+    def load_conversation(self, key: Tuple[str, str], limit: int) -> List[Tuple[str, str]]:
+        """
+        从本地库读取会话最近 limit 轮对话 (用户消息, 回复)，按时间从早到晚排列；跳过失败的回复
+        :param key: (chat_id, sender_id)
+        """
+        chat_id, sender_id = key
+        conn = self.connect_local_db()
+        try:
+            rows = conn.execute('''
+                SELECT original_content, processed_result 
+                FROM processed_messages 
+                WHERE failed = 0 AND message_id IN (
+                    SELECT message_id FROM incoming_messages WHERE sender_id = ? AND chat_id = ?
+                )
+                ORDER BY id DESC 
+                LIMIT ?
+            ''', (sender_id, chat_id, limit)).fetchall()
+            return [(user or '', assistant or '') for user, assistant in reversed(rows)]
+        except Exception as e:
+            logger.error("读取对话历史失败: %s", e)
+            return []
+        finally:
+            conn.close()
+    
+    def conversation_key(self, message: Dict) -> Optional[Tuple[str, str]]:
+        """
+        会话键：同一聊天中的同一发送者（群聊中每个成员各自一个会话，与按发送者串行处理一致）
+        """
+        sender_id = message.get('sender_id')
+        if not sender_id:
+            return None
+        return message.get('chat_id') or '', sender_id
+    
+    def conversation_history(self, message: Dict) -> List[Dict]:
+        """
+        该消息所在会话之前的对话，OpenAI 格式的 user/assistant 消息；未启用对话历史时为空
+        """
+        key = self.conversation_key(message)
+        if not self.conversations or key is None:
+            return []
+        history = []
+        for user, assistant in self.conversations.get(key):
+            history.append({'role': 'user', 'content': self.openclaw_prompt(user)})
+            history.append({'role': 'assistant', 'content': assistant})
+        return history
+    
+    def record_conversation(self, message: Dict, content: str, reply: str):
+        """
+        把本轮对话追加到缓存中的会话历史（本地库中的记录由 save_processed_message 保存）
+        只记录 OpenClaw 正常返回的回答，默认回复与中断的回复不作为上下文
+        """
+        key = self.conversation_key(message)
+        if self.conversations and key is not None:
+            self.conversations.append(key, content, reply)
+    
+    def cached_response(self, content: str, history: List[Dict] = None, user_id: str = '') -> Optional[str]:
+        """
+        查询回复缓存（RESPONSE_CACHE_PER_USER_AGENTS 中的 agent 按用户区分）；附带对话历史时回复依赖上下文，不使用缓存
+        """
+        if not self.response_cache or history:
+            return None
+        response = self.response_cache.get(self.openclaw_client.agent_id, content, user_id)
+        if response is not None:
+            logger.info("命中回复缓存: %.50s", content)
+        return response
+    
+    def cache_response(self, content: str, response: str, history: List[Dict] = None, user_id: str = ''):
+        """
+        缓存 OpenClaw 的回复（只缓存 OpenClaw 正常返回的完整回复）
+        """
+        if self.response_cache and not history:
+            self.response_cache.put(self.openclaw_client.agent_id, content, response, user_id)
+    
+    def openclaw_prompt(self, content: str) -> str:
+        """
+        发给 OpenClaw 的消息内容
+        """
+        return f"来自飞书的消息: {content}"
+    
+    def fallback_reply(self, content: str, error_message: str = None) -> str:
+        """
+        OpenClaw 未启用时的默认回复；传入 error_message 时为调用失败的回复
+        """
+        if error_message is None:
+            return f"已收到您的消息: {content}。我是一个AI助手，很高兴为您服务！"
+        return f"抱歉，AI助手暂时无法回复。已收到您的消息: {content}\n\n错误信息: {error_message}"
+    
+    def stream_reply(self, recipient_id: str, content: str, history: List[Dict] = None) -> Tuple[str, bool, bool]:
+        """
+        流式调用 OpenClaw 并边生成边发送：收到首批内容后发出一条消息，之后按节奏原地编辑，结束时编辑为完整内容
+        :return: (完整回复, 是否已送达飞书, 是否为 OpenClaw 的完整回答)；未送达的回复由调用方放入待发送队列
+        """
+        # 先发出该用户此前未送达的回复，保持回复顺序
+        self.send_pending_replies_to_server(recipient_id)
+        
+        reply = StreamingReply(**self.stream_settings)
+        message_id = None
+        error_message = None
+        logger.info("流式调用 OpenClaw agent: %s", self.openclaw_client.agent_id)
+        try:
+            for delta in self.openclaw_client.chat_stream(self.openclaw_prompt(content), user_id=recipient_id,
+                                                          history=history):
+                reply.append(delta)
+                action = reply.next_action()
+                if action == 'create':
+                    message_id = self.direct_sender.create_message(recipient_id, reply.partial_text())
+                    if message_id is None:
+                        # 首条消息发送失败，不再逐步更新，完整回复走待发送队列
+                        reply.disabled = True
+                    else:
+                        reply.mark_sent()
+                        # 已发出但没有消息ID，无法编辑：不再逐步更新，结束时只发送剩余内容
+                        reply.disabled = not message_id
+                elif action == 'edit' and self.direct_sender.update_message(message_id, reply.partial_text()):
+                    reply.mark_sent()
+        except Exception as e:
+            error_message = str(e)
+            logger.error("流式调用 OpenClaw 失败: %s", error_message)
+        
+        if not reply.text:
+            return self.fallback_reply(content, error_message or "OpenClaw 返回空回复"), False, False
+        text = reply.text
+        if error_message:
+            text = f"{text}\n\n（回复中断: {error_message}）"
+        else:
+            self.cache_response(content, text, history, recipient_id)
+        logger.info("OpenClaw 返回回复: %.100s...", text)
+        if message_id:
+            delivered = self.direct_sender.update_message(message_id, text)
+        elif reply.created:
+            # 首条消息已发出但无法编辑，剩余内容单独发送一次，发送失败时只有剩余内容进入待发送队列
+            tail = text[reply.sent_length:].lstrip()
+            if tail and not self.direct_sender.send_message(recipient_id, tail):
+                self.add_reply_message(recipient_id, tail)
+            delivered = True
+        else:
+            delivered = False
+        return text, delivered, error_message is None
+    
+    def process_single_message(self, message: Dict) -> Tuple[str, bool]:
         """
         处理单条消息 - 调用OpenClaw进行智能回复
+        :return: (回复内容, 是否为 OpenClaw 的回答)；默认回复、调用失败与中断的回复不计入对话历史
         """
         message_id = message.get('message_id', 'unknown')
         sender_id = message.get('sender_id', 'unknown')
         content = message.get('content', '')
         
-        logger.info(f"处理消息: ID={message_id}, 发送者={sender_id}, 内容='{content}'")
+        logger.info("处理消息: ID=%s, 发送者=%s, 内容='%.200s'", message_id, sender_id, content)
         
         response_content = None
         error_message = None
+        delivered = False
+        answered = False
+        
+        history = self.conversation_history(message) if self.openclaw_client else []
+        cached = self.cached_response(content, history, sender_id)
         
+        if cached is not None:
+            response_content = cached
+            answered = True
+        # 流式回复：边生成边发送到飞书，已送达的回复不再进入待发送队列
+        elif self.openclaw_stream and self.openclaw_client and self.direct_sender.app_id and self.direct_sender.app_secret:
+            response_content, delivered, answered = self.stream_reply(sender_id, content, history)
         # 如果启用了 OpenClaw Gateway，使用它进行智能回复
-        if self.openclaw_enabled and self.openclaw_client:
+        elif self.openclaw_enabled and self.openclaw_client:
             try:
-                logger.info(f"调用 OpenClaw agent: {self.openclaw_client.agent_id}")
-                openclaw_message = f"来自飞书的消息: {content}"
+                logger.info("调用 OpenClaw agent: %s", self.openclaw_client.agent_id)
                 response_content = self.openclaw_client.chat(
-                    message=openclaw_message,
-                    user_id=sender_id
+                    message=self.openclaw_prompt(content),
+                    user_id=sender_id,
+                    history=history
                 )
                 
                 if response_content:
-                    logger.info(f"OpenClaw 返回回复: {response_content[:100]}...")
+                    logger.info("OpenClaw 返回回复: %.100s...", response_content)
+                    self.cache_response(content, response_content, history, sender_id)
+                    answered = True
                 else:
                     error_message = "OpenClaw 返回空回复"
-                    logger.warning(f"{error_message}")
-                    response_content = f"抱歉，AI助手暂时无法回复。已收到您的消息: {content}\n\n错误信息: {error_message}"
+                    logger.warning("%s", error_message)
+                    response_content = self.fallback_reply(content, error_message)
             except Exception as e:
                 error_message = str(e)
-                logger.error(f"调用 OpenClaw 时发生错误: {error_message}")
-                response_content = f"抱歉，AI助手暂时无法回复。已收到您的消息: {content}\n\n错误信息: {error_message}"
+                logger.error("调用 OpenClaw 时发生错误: %s", error_message)
+                response_content = self.fallback_reply(content, error_message)
         else:
             # 未启用 OpenClaw，使用默认回复
-            response_content = f"已收到您的消息: {content}。我是一个AI助手，很高兴为您服务！"
+            response_content = self.fallback_reply(content)
         
         # 将回复添加到待发送队列
-        self.add_reply_message(sender_id, response_content)
+        self.add_reply_message(sender_id, response_content, sent=delivered)
+        if answered:
+            self.record_conversation(message, content, response_content)
         
-        return response_content
+        return response_content, answered
+    
+    def handle_local_message(self, msg: Dict):
+        """
+        处理一条本地消息（在线程池中执行）：生成回复 -> 记录结果 -> 标记本地已处理 -> 发送该用户的待发送回复
+        处理完成前消息在本地保持未处理，进程中途退出时重启后重新处理
+        """
+        local_id = msg['id']
+        message_id = msg.get('message_id', 'unknown')
+        sender_id = msg.get('sender_id', 'unknown')
+        content = msg.get('content', '')
+        
+        logger.info("处理本地消息: ID=%s, 发送者=%s, 内容='%.200s'", message_id, sender_id, content)
+        
+        try:
+            # 处理消息
+            result, answered = self.process_single_message(msg)
+            
+            # 保存处理结果到本地
+            self.save_processed_message(message_id, content, result, failed=not answered)
+        except Exception as e:
+            # 消息保持未处理，退避后重试；达到次数上限后改为发送默认回复
+            if not self.record_local_failure(msg, e):
+                return
+        else:
+            # 标记本地消息为已处理
+            if self.mark_local_processed(local_id):
+                logger.info("本地消息 %s 已标记为已处理", message_id)
+            else:
+                logger.error("本地消息 %s 标记为已处理失败", message_id)
+        
+        # 发送给该用户的回复（包括此前发送失败的），同一用户的回复按顺序发出
+        if sender_id:
+            sent_count = self.send_pending_replies_to_server(sender_id)
+            if sent_count > 0:
+                logger.info("成功发送 %s 条回复消息到飞书", sent_count)
+    
+    def submit_task(self, sender_id: str, fn, *args):
+        """
+        以发送者为键提交任务：同一发送者的任务按提交顺序执行，不同发送者并行
+        """
+        with self.busy_lock:
+            self.busy_senders[sender_id] = self.busy_senders.get(sender_id, 0) + 1
+        
+        def run():
+            try:
+                fn(*args)
+            finally:
+                with self.busy_lock:
+                    count = self.busy_senders.get(sender_id, 0) - 1
+                    if count > 0:
+                        self.busy_senders[sender_id] = count
+                    else:
+                        self.busy_senders.pop(sender_id, None)
+                self.dispatch_event.set()
+        
+        self.executor.submit(sender_id, run)
+    
+    def dispatch_local_messages(self) -> int:
+        """
+        按入库顺序把未处理的消息派发给线程池，每个发送者同时只派发一条；
+        处理出错的消息保持未处理，到达重试时间（retry_at）前不派发该发送者的消息，之后仍排在其后续消息之前
+        :return: 派发的消息数
+        """
+        with self.busy_lock:
+            free = self.process_concurrency * 2 - sum(self.busy_senders.values())
+            busy = list(self.busy_senders)
+        if free <= 0:
+            return 0
+        
+        now = time.time()
+        dispatched = set()
+        waiting = set()
+        for msg in self.get_local_unprocessed_messages(limit=100, exclude_senders=busy):
+            sender_id = msg.get('sender_id') or ''
+            if sender_id in dispatched or sender_id in waiting:
+                continue
+            if (msg.get('retry_at') or 0) > now:
+                waiting.add(sender_id)
+                continue
+            dispatched.add(sender_id)
+            self.submit_task(sender_id, self.handle_local_message, msg)
+            if len(dispatched) >= free:
+                break
+        return len(dispatched)
+    
+    def dispatch_pending_replies(self) -> int:
+        """
+        补发此前发送失败的回复：按接收者提交到线程池，与该用户的消息处理串行，不会重复发送
+        """
+        with self.busy_lock:
+            busy = set(self.busy_senders)
+        recipients = [recipient for recipient in self.get_pending_recipients() if recipient not in busy]
+        for recipient_id in recipients:
+            self.submit_task(recipient_id, self.send_pending_replies_to_server, recipient_id)
+        return len(recipients)
     
     def process_local_messages(self):
         """
-        线程2：处理本地数据库中的消息
+        线程2：调度本地数据库中的消息，交给线程池处理
         """
-        logger.info("消息处理线程启动")
+        logger.info("消息处理线程启动，并发数: %s", self.process_concurrency)
+        self.executor = KeyedExecutor(self.process_concurrency, name="ProcessWorker")
+        # 上次停止时丢弃的排队任务不会再执行，重新开始计数
+        with self.busy_lock:
+            self.busy_senders.clear()
+        last_reply_check = 0
         
         while self.running and not self.stop_event.is_set():
+            dispatched = 0
+            self.dispatch_event.clear()
             try:
-                # 从本地数据库获取未处理的消息（FIFO）
-                local_messages = self.get_local_unprocessed_messages(limit=1)
-                
-                if local_messages:
-                    msg = local_messages[0]
-                    local_id = msg['id']
-                    message_id = msg.get('message_id', 'unknown')
-                    sender_id = msg.get('sender_id', 'unknown')
-                    content = msg.get('content', '')
-                    
-                    logger.info(f"处理本地消息: ID={message_id}, 发送者={sender_id}, 内容='{content}'")
-                    
-                    try:
-                        # 处理消息
-                        result = self.process_single_message(msg)
-                        
-                        # 保存处理结果到本地
-                        original_content = msg.get('content', '')
-                        self.save_processed_message(message_id, original_content, result)
-                        
-                        # 标记本地消息为已处理
-                        if self.mark_local_processed(local_id):
-                            logger.info(f"本地消息 {message_id} 已标记为已处理")
-                        else:
-                            logger.error(f"本地消息 {message_id} 标记为已处理失败")
-                            
-                    except Exception as e:
-                        logger.error(f"处理消息时发生错误: {e}")
-                else:
-                    logger.debug("没有待处理的本地消息")
+                dispatched = self.dispatch_local_messages()
+                if dispatched:
+                    logger.debug("派发 %s 条本地消息", dispatched)
                 
-                # 发送待回复的消息到飞书
-                sent_count = self.send_pending_replies_to_server()
-                if sent_count > 0:
-                    logger.info(f"成功发送 {sent_count} 条回复消息到飞书")
+                # 定期补发待发送的回复（启动时立即检查一次）
+                if time.monotonic() - last_reply_check >= self.check_interval:
+                    last_reply_check = time.monotonic()
+                    self.dispatch_pending_replies()
                 
             except Exception as e:
-                logger.error(f"处理本地消息时发生错误: {e}")
+                logger.error("处理本地消息时发生错误: %s", e)
             
-            # 短暂休息后继续处理
-            self.stop_event.wait(0.1)
+            # 有空闲的处理线程时立即继续派发，否则等待任务完成或新消息落库
+            if not dispatched:
+                self.dispatch_event.wait(0.1)
         
+        # 等待处理中的消息完成，排队中的消息留在本地库中，下次启动时处理
+        self.executor.shutdown(timeout=5)
         logger.info("消息处理线程停止")
     
     def start(self):
@@ -718,9 +1498,11 @@ class FeishuReplyService:
         self.running = True
         self.stop_event.clear()
         logger.info("飞书回复服务启动")
+        logger.info("消息获取模式: %s，消费者ID: %s", self.fetch_mode, self.consumer_id)
         
         # 启动消息获取线程
-        self.fetch_thread = threading.Thread(target=self.fetch_from_remote, name="FetchThread")
+        fetch_target = self.stream_from_remote if self.fetch_mode == 'stream' else self.fetch_from_remote
+        self.fetch_thread = threading.Thread(target=fetch_target, name="FetchThread")
         self.fetch_thread.daemon = True
         self.fetch_thread.start()
         logger.info("消息获取线程已启动")
@@ -731,7 +1513,7 @@ class FeishuReplyService:
         self.process_thread.start()
         logger.info("消息处理线程已启动")
         
-        # 等待线程结束
+        # 等待线程结束；SIGTERM 处理函数只设置 stop_event，退出循环后与键盘中断走同一停止流程
         try:
             while self.running and not self.stop_event.is_set():
                 self.stop_event.wait(1)
@@ -747,9 +1529,12 @@ class FeishuReplyService:
                     
         except KeyboardInterrupt:
             logger.info("收到键盘中断信号")
-            self.stop()
+        else:
+            if self.stop_event.is_set():
+                logger.info("收到停止信号")
         
-        logger.info("飞书回复服务已停止")
+        # 停止获取与处理线程：处理中的消息完成后退出，剩余的推送确认在确认线程退出前发出
+        self.stop()
     
     def stop(self):
         """
@@ -770,6 +1555,16 @@ class FeishuReplyService:
             if self.process_thread.is_alive():
                 logger.warning("消息处理线程未正常退出")
         
+        # 关闭连接池中的空闲连接，restart 后的请求会重新建立连接
+        self.session.close()
+        self.direct_sender.session.close()
+        if self.openclaw_client:
+            self.openclaw_client.session.close()
+        
+        if self.conversations:
+            logger.info("对话历史缓存统计: %s", self.conversations.stats())
+        if self.response_cache:
+            logger.info("回复缓存统计: %s", self.response_cache.stats())
         logger.info("飞书回复服务已停止")
     
     def restart(self):
@@ -787,7 +1582,7 @@ def main():
     主函数,处理命令行参数
     """
     if len(sys.argv) < 2:
-        print("用法: python feishu_resp_server.py [start|stop|restart|status]")
+        print("用法: python feishu_resp_server.py [start|stop|restart|status] [--engine=thread|async]")
         sys.exit(1)
     
     command = sys.argv[1].lower()
@@ -801,9 +1596,28 @@ def main():
         print("警告: .env 文件不存在，请创建并配置环境变量")
         print("可以从 .env.example 复制模板: cp .env.example .env")
     
+    load_dotenv()
+    setup_logging('feishu_resp_server', os.path.join(log_dir, 'service.log'), console=False,
+                  max_bytes=100*1024*1024, backup_count=3)
+    
+    # 处理引擎：thread 为线程 + requests（默认），async 为 asyncio + aiohttp
+    engine = os.getenv('ENGINE', 'thread').lower()
+    for arg in sys.argv[2:]:
+        if arg.startswith('--engine='):
+            engine = arg.split('=', 1)[1].lower()
+    if engine not in ('thread', 'async'):
+        print(f"未知引擎: {engine}")
+        sys.exit(1)
+    
     service = FeishuReplyService()
     
-    if command == 'start':
+    if command == 'start' and engine == 'async':
+        from async_engine import AsyncReplyEngine
+        AsyncReplyEngine(service).run()
+    elif command == 'start':
+        # SIGTERM 时通知主循环退出并执行 stop()（处理函数中不记录日志，避免与日志队列的锁重入）；
+        # 随后正常退出，atexit 写完日志队列
+        signal.signal(signal.SIGTERM, lambda signum, frame: service.stop_event.set())
         service.start()
     elif command == 'stop':
         service.stop()
@@ -824,7 +1638,7 @@ def main():
             print("无法确定服务状态")
     else:
         print(f"未知命令: {command}")
-        print("用法: python feishu_resp_server.py [start|stop|restart|status]")
+        print("用法: python feishu_resp_server.py [start|stop|restart|status] [--engine=thread|async]")
         sys.exit(1)
 
 
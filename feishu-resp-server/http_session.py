@@ -0,0 +1,33 @@
+"""
+回复服务的 HTTP 连接池
+
+飞书开放平台、OpenClaw Gateway 与公网监听服务各用一个 requests.Session：
+同一主机的连接在请求之间保持（keep-alive）并复用，省去每次调用的 TCP 与 TLS 握手。
+Session 的连接池是线程安全的，同一客户端可以在多个线程中共用。
+"""
+
+from typing import Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def create_session(pool_size: int = 10, keep_alive: bool = True) -> requests.Session:
+    """
+    创建带连接池的 Session
+    :param pool_size: 每个主机最多保留的空闲连接数，并发超过时临时新建连接、用完即关闭
+    :param keep_alive: False 时每个请求带 Connection: close，与直接调用 requests.get/post 相同
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def timeout_with(timeout: Tuple[float, float], extra: float) -> Tuple[float, float]:
+    """在 (连接超时, 读超时) 的读超时上追加等待时间，用于长轮询等服务端会挂起的请求"""
+    connect_timeout, read_timeout = timeout
+    return connect_timeout, read_timeout + extra
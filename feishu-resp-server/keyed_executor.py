@@ -0,0 +1,105 @@
+"""
+按键串行、键间并行的线程池
+
+同一个键的任务按提交顺序逐个执行，不会同时在两个线程中运行；不同键的任务由多个线程并行执行。
+回复服务以 sender_id 为键处理消息：不同用户的消息并行处理，同一用户的消息保持先后顺序。
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict
+
+# 子 logger，沿用 feishu_resp_server 的日志处理器
+logger = logging.getLogger('feishu_resp_server.keyed_executor')
+
+
+class KeyedExecutor:
+    """
+    每个键一个任务队列，有待执行任务且没有线程在执行的键排在就绪队列中；
+    线程每次取一个键执行其队首任务，执行完若该键还有任务则重新排到就绪队列末尾，各键轮流执行
+    """
+
+    def __init__(self, workers: int, name: str = 'KeyedWorker'):
+        self.workers = max(1, workers)
+        # key -> 待执行的任务；键存在期间要么在就绪队列中，要么正在被某个线程执行
+        self._queues: Dict[Any, deque] = {}
+        self._ready = deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._active = 0
+        self.completed = 0
+        self.failed = 0
+        self._threads = [threading.Thread(target=self._worker, name=f"{name}-{index}", daemon=True)
+                         for index in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, fn: Callable, *args):
+        """提交任务，排在同一个键已提交的任务之后执行"""
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError('executor is shut down')
+            queue = self._queues.get(key)
+            if queue is None:
+                self._queues[key] = deque([(fn, args)])
+                self._ready.append(key)
+                self._cond.notify()
+            else:
+                queue.append((fn, args))
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._ready and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                key = self._ready.popleft()
+                fn, args = self._queues[key].popleft()
+                self._active += 1
+
+            try:
+                fn(*args)
+                failed = False
+            except Exception as e:
+                failed = True
+                logger.error("任务执行失败(key=%s): %s", key, e)
+
+            with self._cond:
+                self._active -= 1
+                if failed:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                if self._queues[key]:
+                    self._ready.append(key)
+                    self._cond.notify()
+                else:
+                    del self._queues[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'active': self._active,
+                'queued': sum(len(queue) for queue in self._queues.values()),
+                'keys': len(self._queues),
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+
+    def shutdown(self, timeout: float = None):
+        """
+        停止接收任务，等待正在执行的任务完成；排队中的任务不再执行
+        """
+        with self._cond:
+            self._stopped = True
+            dropped = sum(len(queue) for queue in self._queues.values())
+            self._cond.notify_all()
+        if dropped:
+            logger.info("线程池停止，丢弃 %s 个排队中的任务", dropped)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
@@ -0,0 +1,179 @@
+"""
+本地回复服务的日志初始化（main() 中调用）
+
+处理器挂在 feishu_resp_server logger 上，各子模块使用其子 logger 共享处理器；
+日志写入 logs/service.log，按大小轮转。
+- 获取与处理线程只把日志记录放入有界队列，文件写入由后台线程（QueueListener）完成；
+  队列满时丢弃并计数，不阻塞消息处理
+- 按日志模板限流：同一模板的 INFO 及以下级别日志每秒最多输出 LOG_RATE_LIMIT 条，
+  被抑制的条数附在该模板下一条输出的日志中
+- LOG_FORMAT=json 时每行输出一个 JSON 对象
+"""
+
+import os
+import copy
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+_exc_formatter = logging.Formatter()
+
+_queue_handler = None
+_listener = None
+_rate_filter = None
+_configured = False
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    按 (logger, 日志模板) 限流，只作用于 INFO 及以下级别
+    日志使用 %s 占位的惰性格式化，模板即调用处的固定字符串，被抑制的记录不会被格式化
+    """
+
+    def __init__(self, rate: int, max_keys: int = 1000):
+        super().__init__()
+        self.rate = rate
+        self.max_keys = max_keys
+        self.suppressed = 0
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        # 同步写入时同一条记录会经过多个处理器，只判定一次
+        decided = getattr(record, '_rate_limit_passed', None)
+        if decided is not None:
+            return decided
+        record._rate_limit_passed = self._allow(record)
+        return record._rate_limit_passed
+
+    def _allow(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= 1.0:
+                dropped = window[2] if window else 0
+                if window is None and len(self._windows) >= self.max_keys:
+                    self._windows.clear()
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.rate:
+                window[1] += 1
+                return True
+            else:
+                window[2] += 1
+                self.suppressed += 1
+                return False
+        if dropped and isinstance(record.msg, str):
+            record.msg = f"{record.msg}（前1秒内已抑制 {dropped} 条同类日志）"
+        return True
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """队列满时丢弃日志而不是阻塞调用线程"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 在调用线程中合并参数（参数对象之后可能被修改），异常堆栈单独保存在 exc_text 中
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(logger_name: Optional[str] = 'feishu_resp_server', log_file: str = 'logs/service.log',
+                  console: bool = False, max_bytes: int = 0, backup_count: int = 0) -> logging.Logger:
+    """
+    配置日志（重复调用时直接返回）
+    :param logger_name: 挂载处理器的 logger
+    :param log_file: 日志文件路径
+    :param console: 是否同时输出到控制台
+    :param max_bytes: 单个日志文件大小上限，0 表示不轮转
+    :param backup_count: 轮转保留的文件数
+    环境变量: LOG_LEVEL, LOG_FORMAT(text|json), LOG_QUEUE_SIZE（0 表示在调用线程中同步写入）, LOG_RATE_LIMIT
+    """
+    global _queue_handler, _listener, _rate_filter, _configured
+
+    target = logging.getLogger(logger_name)
+    target.setLevel(getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper(), logging.INFO))
+    if _configured:
+        return target
+    _configured = True
+
+    log_format = os.getenv('LOG_FORMAT', 'text').lower()
+    queue_size = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+    rate_limit = int(os.getenv('LOG_RATE_LIMIT', '0'))
+
+    log_dir = os.path.dirname(log_file)
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+
+    formatter = JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = [RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    _rate_filter = RateLimitFilter(rate_limit) if rate_limit > 0 else None
+
+    if queue_size > 0:
+        _queue_handler = _DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+        front_handlers = [_queue_handler]
+    else:
+        front_handlers = handlers
+
+    for handler in front_handlers:
+        if _rate_filter:
+            handler.addFilter(_rate_filter)
+        target.addHandler(handler)
+    return target
+
+
+def stop_logging():
+    """停止后台写入线程，队列中剩余的日志会先写完"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
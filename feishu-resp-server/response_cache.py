@@ -0,0 +1,157 @@
+"""
+OpenClaw 回复缓存（保存在本地库的 response_cache 表中，重启后仍然有效）
+
+以 agent_id 与规范化后的消息文本为键：不同用户的相同提问共用缓存的回复，不再调用 OpenClaw。
+- 个性化：per_user_agents 中的 agent 的键额外包含用户，每个用户各自缓存，回复中的个性化内容不会发给其他用户；
+  个性化 agent 也可以放入 bypass_agents 完全不使用缓存
+- 规范化：Unicode NFKC、忽略大小写、合并空白（中文字符两侧的空白去掉）、去掉末尾的标点，
+  "如何重置VPN？" 与 "如何重置 vpn" 视为同一问题
+- 过期：写入后超过 ttl 秒的条目视为未命中并删除
+- 容量：条目数超过 max_entries 时删除最早写入的条目（最接近过期的条目）；命中只读不写
+- 绕过：bypass_agents 中的 agent 不读写缓存
+"""
+
+import re
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+from typing import Dict, Iterable, Optional
+
+# 子 logger，沿用 feishu_resp_server 的日志处理器
+logger = logging.getLogger('feishu_resp_server.response_cache')
+
+_WHITESPACE = re.compile(r'\s+')
+# 中日韩文字与全角标点两侧的空白
+_CJK_SPACING = re.compile(r'\s*([\u2e80-\u9fff\uf900-\ufaff\uff00-\uffef\u3000-\u303f])\s*')
+_TRAILING_PUNCTUATION = '?？!！。.,，~～ '
+
+
+def normalize_question(text: str) -> str:
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    text = _CJK_SPACING.sub(r'\1', _WHITESPACE.sub(' ', text))
+    return text.strip().rstrip(_TRAILING_PUNCTUATION)
+
+
+class ResponseCache:
+
+    def __init__(self, db_path: str, ttl: float = 3600, max_entries: int = 1000, bypass_agents: Iterable[str] = (),
+                 timeout: float = 5.0, per_user_agents: Iterable[str] = ()):
+        """
+        :param timeout: 本地库写锁的最长等待时间（秒）
+        :param per_user_agents: 按用户分别缓存的 agent，其余 agent 所有用户共用
+        """
+        self.db_path = db_path
+        self.timeout = timeout
+        self.per_user_agents = set(per_user_agents)
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.bypass_agents = set(bypass_agents)
+        # 写入与容量淘汰串行执行
+        self._write_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.stores = 0
+        self.evictions = 0
+        self.bypassed = 0
+
+    def cache_key(self, agent_id: str, question: str, user_id: str = '') -> str:
+        scope = f"{user_id or ''}\n" if agent_id in self.per_user_agents else ''
+        return hashlib.sha256(f"{agent_id}\n{scope}{question}".encode('utf-8')).hexdigest()
+
+    def enabled_for(self, agent_id: str) -> bool:
+        return agent_id not in self.bypass_agents
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, agent_id: str, message: str, user_id: str = '') -> Optional[str]:
+        """返回未过期的缓存回复，未命中返回 None"""
+        if not self.enabled_for(agent_id):
+            self._count('bypassed')
+            return None
+        question = normalize_question(message)
+        if not question:
+            return None
+        key = self.cache_key(agent_id, question, user_id)
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+        try:
+            row = conn.execute('SELECT response, created_at FROM response_cache WHERE cache_key = ?', (key,)).fetchone()
+            if row is None:
+                self._count('misses')
+                return None
+            response, created_at = row
+            if time.time() - created_at > self.ttl:
+                with self._write_lock:
+                    conn.execute('DELETE FROM response_cache WHERE cache_key = ? AND created_at = ?', (key, created_at))
+                    conn.commit()
+                self._count('expired')
+                self._count('misses')
+                return None
+            self._count('hits')
+            return response
+        except Exception as e:
+            logger.error("读取回复缓存失败: %s", e)
+            return None
+        finally:
+            conn.close()
+
+    def put(self, agent_id: str, message: str, response: str, user_id: str = ''):
+        """写入（或覆盖）回复，超出容量时删除最早写入的条目"""
+        if not self.enabled_for(agent_id) or not response:
+            return
+        question = normalize_question(message)
+        if not question:
+            return
+        now = time.time()
+        with self._write_lock:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+            try:
+                conn.execute('''
+                    INSERT OR REPLACE INTO response_cache (cache_key, agent_id, question, response, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (self.cache_key(agent_id, question, user_id), agent_id, question, response, now))
+                # 先删除过期条目，仍超出容量时删除最早写入的条目
+                conn.execute('DELETE FROM response_cache WHERE created_at < ?', (now - self.ttl,))
+                overflow = conn.execute('SELECT COUNT(*) FROM response_cache').fetchone()[0] - self.max_entries
+                if overflow > 0:
+                    conn.execute('''
+                        DELETE FROM response_cache WHERE cache_key IN (
+                            SELECT cache_key FROM response_cache ORDER BY created_at ASC LIMIT ?
+                        )
+                    ''', (overflow,))
+                conn.commit()
+            except Exception as e:
+                logger.error("写入回复缓存失败: %s", e)
+                return
+            finally:
+                conn.close()
+        self._count('stores')
+        if overflow > 0:
+            with self._stats_lock:
+                self.evictions += overflow
+
+    def stats(self) -> Dict[str, int]:
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+        try:
+            entries = conn.execute('SELECT COUNT(*) FROM response_cache').fetchone()[0]
+        finally:
+            conn.close()
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+                'expired': self.expired,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'bypassed': self.bypassed,
+            }
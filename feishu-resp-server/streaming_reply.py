@@ -0,0 +1,88 @@
+"""
+流式回复的发送节奏与 SSE 流解析（线程引擎与 asyncio 引擎共用，本身不发起网络请求）
+
+OpenClaw 以 SSE 流逐段返回回复时，先向飞书发送一条消息，之后按节奏原地编辑这条消息：
+- 首条消息：累积内容达到 first_chars 个字符，或距收到第一段内容已过 interval 秒
+- 之后每隔至少 interval 秒编辑一次，内容有变化才编辑
+- 飞书单条消息的编辑次数有上限（max_edits），中间编辑最多 max_edits - 1 次，留一次给最终内容
+"""
+
+import json
+import time
+from typing import Optional
+
+
+class StreamingReply:
+    # 生成过程中显示在内容末尾，最终内容不带
+    TYPING_SUFFIX = ' …'
+
+    def __init__(self, interval: float = 1.0, first_chars: int = 10, max_edits: int = 20, clock=time.monotonic):
+        self.interval = interval
+        self.first_chars = max(1, first_chars)
+        self.max_edits = max(1, max_edits)
+        self.clock = clock
+        self._parts = []
+        self._length = 0
+        self.first_delta_at = None
+        self.created = False
+        self.edits = 0
+        self.last_sent_at = None
+        self.sent_length = 0
+        # 首条消息发送失败或无法编辑（没有消息ID）后不再逐步更新，只累积完整回复
+        self.disabled = False
+
+    def append(self, delta: str):
+        if not delta:
+            return
+        if self.first_delta_at is None:
+            self.first_delta_at = self.clock()
+        self._parts.append(delta)
+        self._length += len(delta)
+
+    @property
+    def text(self) -> str:
+        if len(self._parts) > 1:
+            self._parts = [''.join(self._parts)]
+        return self._parts[0] if self._parts else ''
+
+    def partial_text(self) -> str:
+        return self.text + self.TYPING_SUFFIX
+
+    def next_action(self) -> Optional[str]:
+        """
+        返回现在应做的操作：'create' 发送首条消息，'edit' 编辑消息，None 暂不发送
+        """
+        if self.disabled or not self._length:
+            return None
+        now = self.clock()
+        if not self.created:
+            if self._length >= self.first_chars or now - self.first_delta_at >= self.interval:
+                return 'create'
+            return None
+        if (self._length > self.sent_length and self.edits < self.max_edits - 1
+                and now - self.last_sent_at >= self.interval):
+            return 'edit'
+        return None
+
+    def mark_sent(self):
+        """首条消息发送成功或一次编辑成功后调用"""
+        if self.created:
+            self.edits += 1
+        self.created = True
+        self.last_sent_at = self.clock()
+        self.sent_length = self._length
+
+
+def parse_stream_line(line: str) -> Optional[str]:
+    """
+    解析 OpenAI 兼容 SSE 流中的一行：返回增量内容（非数据行、无内容时为空字符串），流结束（[DONE]）返回 None
+    """
+    if not line or not line.startswith('data:'):
+        return ''
+    payload = line[5:].strip()
+    if payload == '[DONE]':
+        return None
+    choices = json.loads(payload).get('choices') or []
+    if not choices:
+        return ''
+    return (choices[0].get('delta') or {}).get('content') or ''